@@ -21,29 +21,147 @@ def t_to_alpha_sigma(t):
     return torch.cos(t * math.pi / 2), torch.sin(t * math.pi / 2)
 
 
-@torch.no_grad()
-def sample_discrete_euler(model, x, steps, sigma_max=1, **extra_args):
-    """Draws samples from a model given starting noise. Euler method"""
+def with_conditions(model, x, extra_args):
+    """Adds the model's step-independent conditioning (`model.prepare_conditions`,
+    e.g. MMDiT's projected features with the CFG batch) to `extra_args`, so it is
+    computed once per generation instead of on every step."""
+    prepare = getattr(model, 'prepare_conditions', None)
+    if prepare is None or extra_args.get('conditions') is not None:
+        return extra_args
+    return {**extra_args, 'conditions': prepare(x, **extra_args)}
 
-    # Make tensor of ones to broadcast the single t values
-    ts = x.new_ones([x.shape[0]])
 
-    # Create the noise schedule
+# ---- rectified flow ODE samplers ----
+# x_t = (1 - t) * x_0 + t * noise, the model predicts v = dx/dt and t runs from sigma_max to 0.
+# Schedules map (steps, sigma_max, shift) to the steps + 1 timesteps. Samplers are step
+# functions fn(model, x, t_curr, t_next, extra_args, state) -> x at t_next, `state` being a
+# dict kept across the steps of one generation (for multistep methods).
+
+FLOW_SCHEDULES = {}
+FLOW_SAMPLERS = {}
+
+
+def register_flow_schedule(name):
+    def wrap(fn):
+        FLOW_SCHEDULES[name] = fn
+        return fn
+    return wrap
+
+
+def register_flow_sampler(name):
+    def wrap(fn):
+        FLOW_SAMPLERS[name] = fn
+        return fn
+    return wrap
+
+
+@register_flow_schedule('linear')
+def linear_schedule(steps, sigma_max=1, shift=1.0):
+    return torch.linspace(sigma_max, 0, steps + 1)
+
+
+@register_flow_schedule('shifted')
+def shifted_schedule(steps, sigma_max=1, shift=3.0):
+    """Time-shifted linear schedule (SD3): shift > 1 spends more steps at high noise."""
     t = torch.linspace(sigma_max, 0, steps + 1)
+    return shift * t / (1 + (shift - 1) * t)
+
+
+@register_flow_schedule('cosine')
+def cosine_schedule(steps, sigma_max=1, shift=1.0):
+    """sigma_max * cos(pi/2 * u): small steps at the start, large ones near t = 0."""
+    t = sigma_max * torch.cos(torch.linspace(0, 1, steps + 1) * math.pi / 2)
+    t[-1] = 0.
+    return t
+
+
+def _flow(model, x, t, extra_args):
+    # Broadcast the current timestep to the correct shape
+    t = t * torch.ones((x.shape[0],), dtype=x.dtype, device=x.device)
+    return model(x, t, **extra_args)
 
-    #alphas, sigmas = 1-t, t
 
-    for t_curr, t_prev in tqdm(zip(t[:-1], t[1:])):
-            # Broadcast the current timestep to the correct shape
-            t_curr_tensor = t_curr * torch.ones(
-                (x.shape[0],), dtype=x.dtype, device=x.device
-            )
-            dt = t_prev - t_curr  # we solve backwards in our formulation
-            x = x + dt * model(x, t_curr_tensor, **extra_args) #.denoise(x, denoiser, t_curr_tensor, cond, uc)
+@register_flow_sampler('euler')
+def flow_euler(model, x, t_curr, t_next, extra_args, state):
+    """First order, one model evaluation per step."""
+    dt = t_next - t_curr  # we solve backwards in our formulation
+    return x + dt * _flow(model, x, t_curr, extra_args)
+
+
+@register_flow_sampler('heun')
+def flow_heun(model, x, t_curr, t_next, extra_args, state):
+    """Second order (trapezoidal), two evaluations per step; the last step to t = 0 is Euler."""
+    dt = t_next - t_curr
+    v = _flow(model, x, t_curr, extra_args)
+    if t_next > 0:
+        v = (v + _flow(model, x + dt * v, t_next, extra_args)) / 2
+    return x + dt * v
+
+
+@register_flow_sampler('midpoint')
+def flow_midpoint(model, x, t_curr, t_next, extra_args, state):
+    """Second order (explicit midpoint), two evaluations per step."""
+    dt = t_next - t_curr
+    v = _flow(model, x, t_curr, extra_args)
+    return x + dt * _flow(model, x + dt / 2 * v, t_curr + dt / 2, extra_args)
+
+
+@register_flow_sampler('dpmpp-2m')
+def flow_dpmpp_2m(model, x, t_curr, t_next, extra_args, state):
+    """DPM-Solver++(2M) for flow matching: multistep on the data prediction x_0 = x - t * v
+    with alpha_t = 1 - t, sigma_t = t and lambda_t = log(alpha_t / sigma_t). Second order at
+    one evaluation per step; first order on the first step, the final step returns x_0."""
+    def lam(t):
+        return torch.log((1 - t) / t)
+
+    x0 = x - t_curr * _flow(model, x, t_curr, extra_args)
+    if t_next == 0:
+        return x0
+    h = lam(t_next) - lam(t_curr)  # inf when starting from pure noise (t = 1)
+    d = x0
+    if 'x0' in state and torch.isfinite(state['h']):
+        r = state['h'] / h
+        d = (1 + 1 / (2 * r)) * x0 - 1 / (2 * r) * state['x0']
+    state['x0'], state['h'] = x0, h
+    return (t_next / t_curr) * x - (1 - t_next) * torch.expm1(-h) * d
+
+
+@torch.no_grad()
+def sample_flow(model, x, steps, sampler='euler', schedule='linear', sigma_max=1, shift=3.0,
+                callback=None, **extra_args):
+    """Draws samples from a rectified flow model given starting noise, with a sampler from
+    FLOW_SAMPLERS over a schedule from FLOW_SCHEDULES (`shift` is used by 'shifted').
+
+    `callback`, if given, is called after every step with
+    {'stage': 'denoise', 'x': x, 'i': i, 'steps': steps, 't': t_next}.
+    """
+    if sampler not in FLOW_SAMPLERS:
+        raise ValueError(f'unknown sampler {sampler!r}, expected one of {sorted(FLOW_SAMPLERS)}')
+    if schedule not in FLOW_SCHEDULES:
+        raise ValueError(f'unknown schedule {schedule!r}, expected one of {sorted(FLOW_SCHEDULES)}')
+    step = FLOW_SAMPLERS[sampler]
+    t = FLOW_SCHEDULES[schedule](steps, sigma_max, shift)
+    extra_args = with_conditions(model, x, extra_args)
+
+    state = {}
+    for i, (t_curr, t_next) in enumerate(tqdm(zip(t[:-1], t[1:]), total=steps)):
+        x = step(model, x, t_curr, t_next, extra_args, state)
+        if callback is not None:
+            callback({'stage': 'denoise', 'x': x, 'i': i, 'steps': steps, 't': t_next})
 
     # If we are on the last timestep, output the denoised image
     return x
 
+
+def sample_discrete_euler(model, x, steps, sigma_max=1, callback=None, **extra_args):
+    """Draws samples from a model given starting noise. Euler method
+
+    `callback`, if given, is called after every step with
+    {'stage': 'denoise', 'x': x, 'i': i, 'steps': steps, 't': t_prev}.
+    """
+    return sample_flow(model, x, steps, 'euler', 'linear', sigma_max, callback=callback, **extra_args)
+
+
 @torch.no_grad()
 def sample(model, x, steps, eta, **extra_args):
     """Draws samples from a model given starting noise. v-diffusion"""
@@ -54,6 +172,9 @@ def sample(model, x, steps, eta, **extra_args):
 
     alphas, sigmas = get_alphas_sigmas(t)
 
+    with torch.cuda.amp.autocast():
+        extra_args = with_conditions(model, x, extra_args)
+
     # The sampling loop
     for i in trange(steps):
 
@@ -175,6 +296,7 @@ def sample_k(
 
 
     with torch.cuda.amp.autocast():
+        extra_args = with_conditions(model_fn, x, extra_args)
         if sampler_type == "k-heun":
             return K.sampling.sample_heun(denoiser, x, sigmas, disable=False, callback=wrapped_callback, extra_args=extra_args)
         elif sampler_type == "k-lms":
@@ -206,6 +328,8 @@ def sample_rf(
         device="cuda", 
         callback=None, 
         cond_fn=None,
+        sampler="euler",
+        schedule="linear",
         **extra_args
     ):
 
@@ -229,4 +353,4 @@ def sample_rf(
     with torch.cuda.amp.autocast():
         # TODO: Add callback support
         #return sample_discrete_euler(model_fn, x, steps, sigma_max, callback=wrapped_callback, **extra_args)
-        return sample_discrete_euler(model_fn, x, steps, sigma_max, **extra_args)
\ No newline at end of file
+        return sample_flow(model_fn, x, steps, sampler, schedule, sigma_max, **extra_args)
\ No newline at end of file
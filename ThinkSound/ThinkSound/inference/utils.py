@@ -1,3 +1,5 @@
+import torch
+
 from ..data.utils import PadCrop
 
 from torchaudio import transforms as T
@@ -32,4 +34,27 @@ def prepare_audio(audio, in_sr, target_sr, target_length, target_channels, devic
 
     audio = set_audio_channels(audio, target_channels)
 
-    return audio
\ No newline at end of file
+    return audio
+
+class PeakLimiter:
+    """
+    Streaming stand-in for normalizing a whole clip by its peak: scales each incoming segment
+    (..., C, n) by ceiling / running peak. The running peak starts at the first segment's peak
+    (so if the loudest part falls into the first segment the result equals whole-clip
+    normalization) and only grows, following |x| sample by sample, so later louder passages
+    are held at `ceiling` instead of clipping. `floor` (default 0.01, -40 dBFS) caps the gain at
+    ceiling / floor, so a near-silent first segment is not blown up to full scale.
+    """
+
+    def __init__(self, ceiling=1.0, floor=1e-2):
+        self.ceiling = ceiling
+        self.floor = floor
+        self.peak = None
+
+    def __call__(self, x):
+        level = x.abs().amax(dim=-2)  # (..., n), loudest channel per sample
+        if self.peak is None:
+            self.peak = level.amax(dim=-1, keepdim=True).clamp(min=self.floor)
+        envelope = torch.maximum(torch.cummax(level, dim=-1).values, self.peak)
+        self.peak = envelope[..., -1:]
+        return x * (self.ceiling / envelope).unsqueeze(-2)
@@ -513,57 +513,64 @@ class AudioAutoencoder(nn.Module):
         Smaller chunk_size uses less memory, but more compute.
         The chunk_size vs memory tradeoff isn't linear, and possibly depends on the GPU and CUDA version
         For example, on a A6000 chunk_size 128 is overall faster than 256 and 512 even though it has more chunks
+        Chunks are joined as in `decode_audio_stream`.
         '''
         if not chunked:
             # default behavior. Decode the entire latent in parallel
             return self.decode(latents, **kwargs)
         else:
             # chunked decoding
-            hop_size = chunk_size - overlap
-            total_size = latents.shape[2]
-            batch_size = latents.shape[0]
-            chunks = []
-            for i in range(0, total_size - chunk_size + 1, hop_size):
-                chunk = latents[:,:,i:i+chunk_size]
-                chunks.append(chunk)
-            if i+chunk_size != total_size:
-                # Final chunk
-                chunk = latents[:,:,-chunk_size:]
-                chunks.append(chunk)
-            chunks = torch.stack(chunks)
-            num_chunks = chunks.shape[0]
-            # samples_per_latent is just the downsampling ratio
-            samples_per_latent = self.downsampling_ratio
-            # Create an empty waveform, we will populate it with chunks as decode them
-            y_size = total_size * samples_per_latent
-            y_final = torch.zeros((batch_size,self.out_channels,y_size)).to(latents.device)
-            for i in range(num_chunks):
-                x_chunk = chunks[i,:]
-                # decode the chunk
-                y_chunk = self.decode(x_chunk)
-                # figure out where to put the audio along the time domain
-                if i == num_chunks-1:
-                    # final chunk always goes at the end
-                    t_end = y_size
-                    t_start = t_end - y_chunk.shape[2]
-                else:
-                    t_start = i * hop_size * samples_per_latent
-                    t_end = t_start + chunk_size * samples_per_latent
-                #  remove the edges of the overlaps
-                ol = (overlap//2) * samples_per_latent
-                chunk_start = 0
-                chunk_end = y_chunk.shape[2]
-                if i > 0:
-                    # no overlap for the start of the first chunk
-                    t_start += ol
-                    chunk_start += ol
-                if i < num_chunks-1:
-                    # no overlap for the end of the last chunk
-                    t_end -= ol
-                    chunk_end -= ol
-                # paste the chunked audio into our y_final output audio
-                y_final[:,:,t_start:t_end] = y_chunk[:,:,chunk_start:chunk_end]
-            return y_final
+            return torch.cat(list(self.decode_audio_stream(latents, overlap=overlap, chunk_size=chunk_size, **kwargs)), dim=2)
+
+    def decode_audio_stream(self, latents, overlap=32, chunk_size=128, **kwargs):
+        '''
+        Chunked decoding as a generator: yields the waveform (B, C, n) front to back, one segment per
+        decoded chunk, so the start of a clip can be written out while the rest is still decoding and
+        only one decoded chunk is held at a time. Chunking follows `decode_audio`.
+        Neighbouring chunks are overlap-added with a linear crossfade over the middle half of their
+        overlap; the outer quarters, next to the chunk edges, come from one chunk only.
+        '''
+        if not 0 <= overlap < chunk_size:
+            raise ValueError(f"overlap must satisfy 0 <= overlap < chunk_size, got overlap={overlap}, chunk_size={chunk_size}")
+        total_size = latents.shape[2]
+        if total_size <= chunk_size:
+            yield self.decode(latents, **kwargs)
+            return
+
+        hop_size = chunk_size - overlap
+        starts = list(range(0, total_size - chunk_size + 1, hop_size))
+        if starts[-1] + chunk_size != total_size:
+            # Final chunk
+            starts.append(total_size - chunk_size)
+
+        # samples_per_latent is just the downsampling ratio
+        samples_per_latent = self.downsampling_ratio
+        bounds = [(start * samples_per_latent, (start + chunk_size) * samples_per_latent) for start in starts]
+        # crossfade windows [f0, f1) between chunk i and i + 1, kept in order when the final chunk overlaps more
+        fades = []
+        for (_, end), (next_start, _) in zip(bounds[:-1], bounds[1:]):
+            quarter = (end - next_start) // 4
+            f0 = max(next_start + quarter, fades[-1][1] if fades else 0)
+            fades.append((f0, max(end - quarter, f0)))
+
+        pending = None
+        for i, (t_start, _) in enumerate(bounds):
+            y_chunk = self.decode(latents[:, :, starts[i]:starts[i] + chunk_size], **kwargs)
+            segments = []
+            emit_from = 0
+            if pending is not None:
+                f0, f1 = fades[i - 1]
+                fade_in = (torch.arange(f1 - f0, device=y_chunk.device, dtype=y_chunk.dtype) + 0.5) / (f1 - f0)
+                segments.append(pending * (1 - fade_in) + y_chunk[:, :, f0 - t_start:f1 - t_start] * fade_in)
+                emit_from = f1 - t_start
+            if i < len(bounds) - 1:
+                f0, f1 = fades[i]
+                segments.append(y_chunk[:, :, emit_from:f0 - t_start])
+                pending = y_chunk[:, :, f0 - t_start:f1 - t_start]
+            else:
+                # final chunk always goes at the end
+                segments.append(y_chunk[:, :, emit_from:])
+            yield torch.cat(segments, dim=2)
 
     
 class DiffusionAutoencoder(AudioAutoencoder):
@@ -600,6 +600,7 @@ class MMDiTWrapper(ConditionedDiffusionModel):
                 batch_cfg: bool = True,
                 rescale_cfg: bool = False,
                 scale_phi: float = 0.0,
+                conditions=None,
                 **kwargs):
 
         # breakpoint()
@@ -618,7 +619,33 @@ class MMDiTWrapper(ConditionedDiffusionModel):
             cfg_scale=cfg_scale,
             cfg_dropout_prob=cfg_dropout_prob,
             scale_phi=scale_phi,
+            conditions=conditions,
             **kwargs)
+
+    def prepare_conditions(self,
+                           x,
+                           clip_f,
+                           sync_f,
+                           text_f,
+                           inpaint_masked_input=None,
+                           t5_features=None,
+                           metaclip_global_text_features=None,
+                           cfg_scale=1.0,
+                           cfg_dropout_prob: float = 0.0,
+                           clip_mask=None,
+                           **kwargs):
+        # step-independent conditioning, computed once per generation by the samplers
+        return self.model.prepare_conditions(
+            latent=x,
+            clip_f=clip_f,
+            sync_f=sync_f,
+            text_f=text_f,
+            inpaint_masked_input=inpaint_masked_input,
+            t5_features=t5_features,
+            metaclip_global_text_features=metaclip_global_text_features,
+            cfg_scale=cfg_scale,
+            cfg_dropout_prob=cfg_dropout_prob,
+            clip_mask=clip_mask)
     
 class MMConditionedDiffusionModelWrapper(ConditionedDiffusionModel):
     """
@@ -700,8 +727,12 @@ class MMConditionedDiffusionModelWrapper(ConditionedDiffusionModel):
     def forward(self, x: torch.Tensor, t: torch.Tensor, cond: tp.Dict[str, tp.Any], **kwargs):
         # breakpoint()
         # print(kwargs)
+        # a `conditions` kwarg from `prepare_conditions` is passed through and replaces `cond`
         return self.model(x=x, t=t, **self.get_conditioning_inputs(cond), **kwargs)
 
+    def prepare_conditions(self, x: torch.Tensor, cond: tp.Dict[str, tp.Any], **kwargs):
+        return self.model.prepare_conditions(x, **self.get_conditioning_inputs(cond), **kwargs)
+
     def generate(self, *args, **kwargs):
         return generate_diffusion_cond(self, *args, **kwargs)
 
@@ -3,6 +3,7 @@ import torch.nn as nn
 
 # https://github.com/facebookresearch/DiT
 
+from functools import lru_cache
 from typing import Union
 
 import torch
@@ -32,6 +33,17 @@ def compute_rope_rotations(length: int,
         return rot
 
 
+@lru_cache(maxsize=32)
+def cached_rope_rotations(length: int,
+                          dim: int,
+                          theta: int,
+                          freq_scaling: float = 1.0,
+                          device: Union[torch.device, str] = 'cpu') -> Tensor:
+    """`compute_rope_rotations` memoized per (length, dim, theta, freq_scaling, device), so
+    models serving several sequence lengths build each table once. Do not modify the result."""
+    return compute_rope_rotations(length, dim, theta, freq_scaling=freq_scaling, device=device)
+
+
 def apply_rope(x: Tensor, rot: Tensor) -> tuple[Tensor, Tensor]:
     with torch.amp.autocast(device_type='cuda', enabled=False):
         _x = x.float()
@@ -6,7 +6,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import sys
-from .embeddings import compute_rope_rotations
+from .embeddings import cached_rope_rotations
 from .embeddings import TimestepEmbedder
 from .blocks import MLP, ChannelLastConv1d, ConvMLP
 from .transformer_layers import (FinalBlock, JointBlock, MMDitSingleBlock)
@@ -22,6 +22,8 @@ class PreprocessedConditions:
     text_f: torch.Tensor
     clip_f_c: torch.Tensor
     text_f_c: torch.Tensor
+    # set by MMmodule.prepare_conditions, CFG-doubled like the features
+    inpaint_masked_input: Optional[torch.Tensor] = None
 
 
 class MMmodule(nn.Module):
@@ -197,24 +199,40 @@ class MMmodule(nn.Module):
         self.initialize_weights()
         self.initialize_rotations()
 
-    def initialize_rotations(self):
+    def rotations(self, latent_seq_len: int, clip_seq_len: int) -> tuple[torch.Tensor, torch.Tensor]:
+        """
+        (latent_rot, clip_rot) for the given lengths on the model's device, from the shared
+        `cached_rope_rotations` LRU
+        """
         base_freq = 1.0
-        latent_rot = compute_rope_rotations(self._latent_seq_len,
-                                            self.hidden_dim // self.num_heads,
-                                            10000,
-                                            freq_scaling=base_freq,
-                                            device=self.device)
-        clip_rot = compute_rope_rotations(self._clip_seq_len,
-                                          self.hidden_dim // self.num_heads,
-                                          10000,
-                                          freq_scaling=base_freq * self._latent_seq_len /
-                                          self._clip_seq_len,
-                                          device=self.device)
-
-        self.register_buffer("latent_rot", latent_rot, persistent=False)
-        self.register_buffer("clip_rot", clip_rot, persistent=False)
+        latent_rot = cached_rope_rotations(latent_seq_len,
+                                           self.hidden_dim // self.num_heads,
+                                           10000,
+                                           freq_scaling=base_freq,
+                                           device=self.device)
+        clip_rot = cached_rope_rotations(clip_seq_len,
+                                         self.hidden_dim // self.num_heads,
+                                         10000,
+                                         freq_scaling=base_freq * latent_seq_len / clip_seq_len,
+                                         device=self.device)
+        return latent_rot, clip_rot
+
+    def initialize_rotations(self):
+        self.rotations(self._latent_seq_len, self._clip_seq_len)
+
+    @property
+    def latent_rot(self) -> torch.Tensor:
+        return self.rotations(self._latent_seq_len, self._clip_seq_len)[0]
+
+    @property
+    def clip_rot(self) -> torch.Tensor:
+        return self.rotations(self._latent_seq_len, self._clip_seq_len)[1]
 
     def update_seq_lengths(self, latent_seq_len: int, clip_seq_len: int, sync_seq_len: int) -> None:
+        """
+        only sets the default lengths (empty sequences, `latent_rot`/`clip_rot`); the forward pass
+        takes its lengths from the inputs, so one model serves every duration
+        """
         self._latent_seq_len = latent_seq_len
         self._clip_seq_len = clip_seq_len
         self._sync_seq_len = sync_seq_len
@@ -258,20 +276,25 @@ class MMmodule(nn.Module):
         nn.init.constant_(self.empty_sync_feat, 0)
 
     def preprocess_conditions(self, clip_f: torch.Tensor, sync_f: torch.Tensor,
-                              text_f: torch.Tensor, t5_features: torch.Tensor, metaclip_global_text_features: torch.Tensor) -> PreprocessedConditions:
+                              text_f: torch.Tensor, t5_features: torch.Tensor, metaclip_global_text_features: torch.Tensor,
+                              latent_seq_len: Optional[int] = None,
+                              clip_mask: Optional[torch.Tensor] = None) -> PreprocessedConditions:
         """
         cache computations that do not depend on the latent/time step
         i.e., the features are reused over steps during inference
+        clip/sync lengths are taken from the inputs, latent_seq_len defaults to the configured one
+        clip_mask: (B, VN) bool, False on padded clip frames, which are then left out of the
+            pooled clip condition
         """
         # breakpoint()
-        assert clip_f.shape[1] == self._clip_seq_len, f'{clip_f.shape=} {self._clip_seq_len=}'
-        assert sync_f.shape[1] == self._sync_seq_len, f'{sync_f.shape=} {self._sync_seq_len=}'
+        latent_seq_len = latent_seq_len or self._latent_seq_len
+        assert sync_f.shape[1] % 8 == 0, f'{sync_f.shape=}'
         assert text_f.shape[1] == self._text_seq_len, f'{text_f.shape=} {self._text_seq_len=}'
 
         bs = clip_f.shape[0]
 
         # B * num_segments (24) * 8 * 768
-        num_sync_segments = self._sync_seq_len // 8
+        num_sync_segments = sync_f.shape[1] // 8
         sync_f = sync_f.view(bs, num_sync_segments, 8, -1) + self.sync_pos_emb
         sync_f = sync_f.flatten(1, 2)  # (B, VN, D)
 
@@ -305,11 +328,15 @@ class MMmodule(nn.Module):
         # upsample the sync features to match the audio
         sync_f = sync_f.transpose(1, 2)  # (B, D, VN)
         # sync_f = resample(sync_f, self._latent_seq_len)
-        sync_f = F.interpolate(sync_f, size=self._latent_seq_len, mode='nearest-exact')
+        sync_f = F.interpolate(sync_f, size=latent_seq_len, mode='nearest-exact')
         sync_f = sync_f.transpose(1, 2)  # (B, N, D)
 
         # get conditional features from the clip side
-        clip_f_c = self.clip_cond_proj(clip_f.mean(dim=1))  # (B, D)
+        if clip_mask is None:
+            clip_f_c = self.clip_cond_proj(clip_f.mean(dim=1))  # (B, D)
+        else:
+            clip_mask = clip_mask.unsqueeze(-1).to(clip_f.dtype)  # (B, VN, 1)
+            clip_f_c = self.clip_cond_proj((clip_f * clip_mask).sum(dim=1) / clip_mask.sum(dim=1).clamp(min=1))
 
         return PreprocessedConditions(clip_f=clip_f,
                                       sync_f=sync_f,
@@ -324,7 +351,7 @@ class MMmodule(nn.Module):
         for non-cacheable computations
         """
         # print(f'cfg_scale: {cfg_scale}, cfg_dropout_prob: {cfg_dropout_prob}, scale_phi: {scale_phi}')
-        assert latent.shape[1] == self._latent_seq_len, f'{latent.shape=} {self._latent_seq_len=}'
+        assert latent.shape[1] == conditions.sync_f.shape[1], f'{latent.shape=} {conditions.sync_f.shape=}'
         empty_conditions = None
         if inpaint_masked_input is not None:
             inpaint_masked_input = inpaint_masked_input.transpose(1,2)
@@ -333,6 +360,7 @@ class MMmodule(nn.Module):
         text_f = conditions.text_f
         clip_f_c = conditions.clip_f_c
         text_f_c = conditions.text_f_c
+        latent_rot, clip_rot = self.rotations(latent.shape[1], clip_f.shape[1])
             
         # breakpoint()
         if inpaint_masked_input is not None:
@@ -346,7 +374,7 @@ class MMmodule(nn.Module):
 
         for block in self.joint_blocks:
             latent, clip_f, text_f = block(latent, clip_f, text_f, global_c, extended_c,
-                                           self.latent_rot, self.clip_rot)  # (B, N, D)
+                                           latent_rot, clip_rot)  # (B, N, D)
         if self.add_video:
             if clip_f.shape[1] != latent.shape[1]:
                 clip_f = resample(clip_f, latent)
@@ -369,26 +397,28 @@ class MMmodule(nn.Module):
         
         for block in self.fused_blocks:
             if self.cross_attend:
-                latent = block(latent, extended_c, self.latent_rot, context=text_f)
+                latent = block(latent, extended_c, latent_rot, context=text_f)
             else:
-                latent = block(latent, extended_c, self.latent_rot)
+                latent = block(latent, extended_c, latent_rot)
 
         # should be extended_c; this is a minor implementation error #55
         flow = self.final_layer(latent, extended_c)  # (B, N, out_dim), remove t
         return flow
 
-    def forward(self, latent: torch.Tensor, t: torch.Tensor, clip_f: torch.Tensor, sync_f: torch.Tensor,
-                text_f: torch.Tensor, inpaint_masked_input, t5_features, metaclip_global_text_features, cfg_scale:float,cfg_dropout_prob:float,scale_phi:float) -> torch.Tensor:
+    def prepare_conditions(self, latent: torch.Tensor, clip_f: torch.Tensor, sync_f: torch.Tensor,
+                           text_f: torch.Tensor, inpaint_masked_input=None, t5_features=None,
+                           metaclip_global_text_features=None, cfg_scale: float = 1.0,
+                           cfg_dropout_prob: float = 0.0,
+                           clip_mask: Optional[torch.Tensor] = None) -> PreprocessedConditions:
         """
-        latent: (B, N, C) 
-        vf: (B, T, C_V)
-        t: (B,)
+        the step-independent part of `forward`: condition dropout, the CFG batch with the empty
+        sequences appended and `preprocess_conditions`. samplers call it once per generation and
+        pass the result to every step as `conditions`
+        latent: (B, C, N), only its shape and device are used
+        clip_mask: (B, VN) bool, see `preprocess_conditions`
         """
-        # breakpoint()
-        # print(f'cfg_scale: {cfg_scale}, cfg_dropout_prob: {cfg_dropout_prob}, scale_phi: {scale_phi}')
         if self.use_inpaint and inpaint_masked_input is None:
             inpaint_masked_input = torch.zeros_like(latent, device=latent.device)
-        latent = latent.permute(0, 2, 1)
 
         if cfg_dropout_prob > 0.0:
             if inpaint_masked_input is not None:
@@ -428,11 +458,9 @@ class MMmodule(nn.Module):
             # empty_conditions = self.get_empty_conditions(latent.shape[0])
             # breakpoint()
             bsz = latent.shape[0]
-            latent = torch.cat([latent,latent], dim=0)
             if inpaint_masked_input is not None:
                 empty_inpaint_masked_input = torch.zeros_like(inpaint_masked_input, device=latent.device)
                 inpaint_masked_input = torch.cat([inpaint_masked_input,empty_inpaint_masked_input], dim=0)
-            t = torch.cat([t, t], dim=0)
             empty_clip_f = torch.zeros_like(clip_f, device=latent.device)
             empty_sync_f = torch.zeros_like(sync_f, device=latent.device)
             empty_text_f = torch.zeros_like(text_f, device=latent.device)
@@ -440,8 +468,8 @@ class MMmodule(nn.Module):
             # clip_f = torch.cat([clip_f,empty_clip_f], dim=0)
             # sync_f = torch.cat([sync_f,empty_sync_f], dim=0)
             # text_f = torch.cat([text_f,empty_text_f], dim=0)
-            clip_f = safe_cat(clip_f,self.get_empty_clip_sequence(bsz), dim=0, match_dim=1)
-            sync_f = safe_cat(sync_f,self.get_empty_sync_sequence(bsz), dim=0, match_dim=1)
+            clip_f = safe_cat(clip_f,self.get_empty_clip_sequence(bsz, clip_f.shape[1]), dim=0, match_dim=1)
+            sync_f = safe_cat(sync_f,self.get_empty_sync_sequence(bsz, sync_f.shape[1]), dim=0, match_dim=1)
             text_f = safe_cat(text_f,self.get_empty_string_sequence(bsz), dim=0, match_dim=1)
             if t5_features is not None:
                 empty_t5_features = torch.zeros_like(t5_features, device=latent.device)
@@ -450,12 +478,42 @@ class MMmodule(nn.Module):
             if metaclip_global_text_features is not None:
                 empty_metaclip_global_text_features = torch.zeros_like(metaclip_global_text_features, device=latent.device)
                 metaclip_global_text_features = torch.cat([metaclip_global_text_features,empty_metaclip_global_text_features], dim=0)
+            if clip_mask is not None:
+                clip_mask = torch.cat([clip_mask, torch.ones_like(clip_mask)], dim=0)
             # metaclip_global_text_features = torch.cat([metaclip_global_text_features,metaclip_global_text_features], dim=0)
             # clip_f_c = torch.cat([clip_f_c,empty_clip_f_c], dim=0)
             # text_f_c = torch.cat([text_f_c,empty_text_f_c], dim=0)
 
-        conditions = self.preprocess_conditions(clip_f, sync_f, text_f, t5_features, metaclip_global_text_features)
-        flow = self.predict_flow(latent, t, conditions, inpaint_masked_input, cfg_scale,cfg_dropout_prob,scale_phi)
+        conditions = self.preprocess_conditions(clip_f, sync_f, text_f, t5_features, metaclip_global_text_features,
+                                                latent_seq_len=latent.shape[-1], clip_mask=clip_mask)
+        conditions.inpaint_masked_input = inpaint_masked_input
+        return conditions
+
+    def forward(self, latent: torch.Tensor, t: torch.Tensor, clip_f: torch.Tensor = None, sync_f: torch.Tensor = None,
+                text_f: torch.Tensor = None, inpaint_masked_input=None, t5_features=None, metaclip_global_text_features=None,
+                cfg_scale: float = 1.0, cfg_dropout_prob: float = 0.0, scale_phi: float = 0.0,
+                conditions: Optional[PreprocessedConditions] = None,
+                clip_mask: Optional[torch.Tensor] = None) -> torch.Tensor:
+        """
+        latent: (B, N, C) 
+        vf: (B, T, C_V)
+        t: (B,)
+        conditions: output of `prepare_conditions` for the same cfg_scale, replaces the condition
+            arguments
+        clip_mask: (B, VN) bool, False on padded clip frames (batched clips of different lengths)
+        """
+        if conditions is None:
+            conditions = self.prepare_conditions(latent, clip_f, sync_f, text_f, inpaint_masked_input, t5_features,
+                                                 metaclip_global_text_features, cfg_scale, cfg_dropout_prob,
+                                                 clip_mask=clip_mask)
+        latent = latent.permute(0, 2, 1)
+        if cfg_scale != 1.0:
+            latent = torch.cat([latent,latent], dim=0)
+            t = torch.cat([t, t], dim=0)
+        assert conditions.clip_f.shape[0] == latent.shape[0], \
+            f'{conditions.clip_f.shape=} {latent.shape=}, conditions prepared for another cfg_scale?'
+
+        flow = self.predict_flow(latent, t, conditions, conditions.inpaint_masked_input, cfg_scale,cfg_dropout_prob,scale_phi)
         if cfg_scale != 1.0:
             cond_output, uncond_output = torch.chunk(flow, 2, dim=0)
             cfg_output = uncond_output + (cond_output - uncond_output) * cfg_scale
@@ -474,11 +532,11 @@ class MMmodule(nn.Module):
     def get_empty_t5_sequence(self, bs: int) -> torch.Tensor:
         return self.empty_t5_feat.unsqueeze(0).expand(bs, -1, -1)
 
-    def get_empty_clip_sequence(self, bs: int) -> torch.Tensor:
-        return self.empty_clip_feat.unsqueeze(0).expand(bs, self._clip_seq_len, -1)
+    def get_empty_clip_sequence(self, bs: int, length: Optional[int] = None) -> torch.Tensor:
+        return self.empty_clip_feat.unsqueeze(0).expand(bs, length or self._clip_seq_len, -1)
 
-    def get_empty_sync_sequence(self, bs: int) -> torch.Tensor:
-        return self.empty_sync_feat.unsqueeze(0).expand(bs, self._sync_seq_len, -1)
+    def get_empty_sync_sequence(self, bs: int, length: Optional[int] = None) -> torch.Tensor:
+        return self.empty_sync_feat.unsqueeze(0).expand(bs, length or self._sync_seq_len, -1)
 
     def get_empty_conditions(
             self,
@@ -73,6 +73,18 @@ class AutoencoderPretransform(Pretransform):
             decoded = decoded.float()
 
         return decoded
+
+    def decode_stream(self, z, chunk_size=128, overlap=32, **kwargs):
+        """`decode` as a generator of waveform segments, see `AudioAutoencoder.decode_audio_stream`"""
+        z = z * self.scale
+
+        if self.model_half:
+            z = z.half()
+            self.model.to(torch.float16)
+
+        for decoded in self.model.decode_audio_stream(z, overlap=overlap, chunk_size=chunk_size,
+                                                      iterate_batch=self.iterate_batch, **kwargs):
+            yield decoded.float() if self.model_half else decoded
     
     def tokenize(self, x, **kwargs):
         assert self.model.is_discrete, "Cannot tokenize with a continuous model"
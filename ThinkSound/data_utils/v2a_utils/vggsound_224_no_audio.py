@@ -71,6 +71,107 @@ def pad_to_square(video_tensor):
 
     return video_padded
 
+def make_sync_transform():
+    return v2.Compose([
+        v2.Resize(_SYNC_SIZE, interpolation=v2.InterpolationMode.BICUBIC),
+        v2.CenterCrop(_SYNC_SIZE),
+        v2.ToImage(),
+        v2.ToDtype(torch.float32, scale=True),
+        v2.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
+    ])
+
+
+def load_video_chunks(video_path, duration_sec, clip_processor, sync_transform, video_id=None):
+    """
+    Decode one video into the CLIP (8 fps) and Synchformer (25 fps) inputs.
+    Shared by the dataset below and by the resident inference service, which
+    calls it directly on the uploaded file instead of going through a csv.
+    """
+    video_id = video_id or Path(video_path).stem
+    clip_expected_length = int(_CLIP_FPS * duration_sec)
+    sync_expected_length = int(_SYNC_FPS * duration_sec)
+
+    reader = StreamingMediaDecoder(video_path)
+    reader.add_basic_video_stream(
+        frames_per_chunk=int(_CLIP_FPS * duration_sec),
+        frame_rate=_CLIP_FPS,
+        format='rgb24',
+    )
+    reader.add_basic_video_stream(
+        frames_per_chunk=int(_SYNC_FPS * duration_sec),
+        frame_rate=_SYNC_FPS,
+        format='rgb24',
+    ) 
+    # reader.add_basic_audio_stream(frames_per_chunk=2**30,)
+
+    reader.fill_buffer()
+    data_chunk = reader.pop_chunks()
+
+    clip_chunk = data_chunk[0]
+    sync_chunk = data_chunk[1]
+    # audio_chunk = data_chunk[2]
+    # if len(audio_chunk.shape) != 2:
+    #     raise RuntimeError(f'error audio shape {video_id}')
+    if clip_chunk is None:
+        raise RuntimeError(f'CLIP video returned None {video_id}')
+    # if clip_chunk.shape[0] < clip_expected_length:
+    #     raise RuntimeError(
+    #         f'CLIP video too short {video_id}, expected {clip_expected_length}, got {clip_chunk.shape[0]}'
+    #     )
+
+    if sync_chunk is None:
+        raise RuntimeError(f'Sync video returned None {video_id}')
+
+    # truncate the video
+    clip_chunk = clip_chunk[:clip_expected_length]
+    if clip_chunk.shape[0] != clip_expected_length:
+        current_length = clip_chunk.shape[0]
+        padding_needed = clip_expected_length - current_length
+
+        # Check that padding needed is no more than 2
+        # assert padding_needed < 4, f'Padding no more than 2 frames allowed, but {padding_needed} needed'
+
+        # If assertion passes, proceed with padding
+        if padding_needed > 0:
+            last_frame = clip_chunk[-1]
+            log.info(last_frame.shape) 
+            # Repeat the last frame to reach the expected length
+            padding = last_frame.repeat(padding_needed, 1, 1, 1)
+            clip_chunk = torch.cat((clip_chunk, padding), dim=0)
+        # raise RuntimeError(f'CLIP video wrong length {video_id}, '
+        #                    f'expected {clip_expected_length}, '
+        #                    f'got {clip_chunk.shape[0]}')
+
+    # save_image(clip_chunk[0] / 255.0,'ori.png')
+    clip_chunk = pad_to_square(clip_chunk)
+    # save_image(clip_chunk[0] / 255.0,'square.png')
+    # clip_chunk = self.clip_transform(clip_chunk)
+    clip_chunk = clip_processor(images=clip_chunk, return_tensors="pt")["pixel_values"]
+    # log.info(clip_chunk.shape)
+    # save_tensor_as_image(clip_chunk[0].numpy(),'scale.png')
+    # log.info(clip_chunk[0])
+    # clip_chunk = outputs
+    # text_ids = outputs["input_ids"]
+    # temp_img = clip_chunk[0].permute(1, 2, 0) * 255
+    # save_image(clip_chunk[0],'scale.png')
+    sync_chunk = sync_chunk[:sync_expected_length]
+    if sync_chunk.shape[0] != sync_expected_length:
+        # padding using the last frame, but no more than 2
+        current_length = sync_chunk.shape[0]
+        last_frame = sync_chunk[-1]
+        # 重复最后一帧以进行填充
+        padding = last_frame.repeat(sync_expected_length - current_length, 1, 1, 1)
+        # assert sync_expected_length - current_length < 12, f'sync can pad no more than 2 while {sync_expected_length - current_length}'
+        sync_chunk = torch.cat((sync_chunk, padding), dim=0)
+        # raise RuntimeError(f'Sync video wrong length {video_id}, '
+        #                    f'expected {sync_expected_length}, '
+        #                    f'got {sync_chunk.shape[0]}')
+
+    sync_chunk = sync_transform(sync_chunk)
+
+    return clip_chunk, sync_chunk
+
+
 class VGGSound(Dataset):
 
     def __init__(
@@ -142,13 +243,7 @@ class VGGSound(Dataset):
             v2.ToDtype(torch.float32, scale=True),
         ])
         self.clip_processor = AutoProcessor.from_pretrained("facebook/metaclip-h14-fullcc2.5b")
-        self.sync_transform = v2.Compose([
-            v2.Resize(_SYNC_SIZE, interpolation=v2.InterpolationMode.BICUBIC),
-            v2.CenterCrop(_SYNC_SIZE),
-            v2.ToImage(),
-            v2.ToDtype(torch.float32, scale=True),
-            v2.Normalize(mean=[0.5, 0.5, 0.5], std=[0.5, 0.5, 0.5]),
-        ])
+        self.sync_transform = make_sync_transform()
 
         self.resampler = {}
 
@@ -157,89 +252,13 @@ class VGGSound(Dataset):
         label = self.labels[idx]
         caption_cot = self.caption_cot[idx]
 
-        reader = StreamingMediaDecoder(self.root / (video_id + '.mp4'))
-        reader.add_basic_video_stream(
-            frames_per_chunk=int(_CLIP_FPS * self.duration_sec),
-            frame_rate=_CLIP_FPS,
-            format='rgb24',
+        clip_chunk, sync_chunk = load_video_chunks(
+            self.root / (video_id + '.mp4'),
+            self.duration_sec,
+            self.clip_processor,
+            self.sync_transform,
+            video_id=video_id,
         )
-        reader.add_basic_video_stream(
-            frames_per_chunk=int(_SYNC_FPS * self.duration_sec),
-            frame_rate=_SYNC_FPS,
-            format='rgb24',
-        ) 
-        # reader.add_basic_audio_stream(frames_per_chunk=2**30,)
-
-        reader.fill_buffer()
-        data_chunk = reader.pop_chunks()
-
-        clip_chunk = data_chunk[0]
-        sync_chunk = data_chunk[1]
-        # audio_chunk = data_chunk[2]
-        # if len(audio_chunk.shape) != 2:
-        #     raise RuntimeError(f'error audio shape {video_id}')
-        if clip_chunk is None:
-            raise RuntimeError(f'CLIP video returned None {video_id}')
-        # if clip_chunk.shape[0] < self.clip_expected_length:
-        #     raise RuntimeError(
-        #         f'CLIP video too short {video_id}, expected {self.clip_expected_length}, got {clip_chunk.shape[0]}'
-        #     )
-
-        if sync_chunk is None:
-            raise RuntimeError(f'Sync video returned None {video_id}')
-
-        # truncate the video
-        clip_chunk = clip_chunk[:self.clip_expected_length]
-        # import ipdb
-        # ipdb.set_trace()
-        if clip_chunk.shape[0] != self.clip_expected_length:
-            current_length = clip_chunk.shape[0]
-            padding_needed = self.clip_expected_length - current_length
-            
-            # Check that padding needed is no more than 2
-            # assert padding_needed < 4, f'Padding no more than 2 frames allowed, but {padding_needed} needed'
-
-            # If assertion passes, proceed with padding
-            if padding_needed > 0:
-                last_frame = clip_chunk[-1]
-                log.info(last_frame.shape) 
-                # Repeat the last frame to reach the expected length
-                padding = last_frame.repeat(padding_needed, 1, 1, 1)
-                clip_chunk = torch.cat((clip_chunk, padding), dim=0)
-            # raise RuntimeError(f'CLIP video wrong length {video_id}, '
-            #                    f'expected {self.clip_expected_length}, '
-            #                    f'got {clip_chunk.shape[0]}')
-        
-        # save_image(clip_chunk[0] / 255.0,'ori.png')
-        clip_chunk = pad_to_square(clip_chunk)
-        # save_image(clip_chunk[0] / 255.0,'square.png')
-        # clip_chunk = self.clip_transform(clip_chunk)
-        # import ipdb
-        # ipdb.set_trace()
-        clip_chunk = self.clip_processor(images=clip_chunk, return_tensors="pt")["pixel_values"]
-        # log.info(clip_chunk.shape)
-        # save_tensor_as_image(clip_chunk[0].numpy(),'scale.png')
-        # log.info(clip_chunk[0])
-        # clip_chunk = outputs
-        # text_ids = outputs["input_ids"]
-        # temp_img = clip_chunk[0].permute(1, 2, 0) * 255
-        # save_image(clip_chunk[0],'scale.png')
-        sync_chunk = sync_chunk[:self.sync_expected_length]
-        if sync_chunk.shape[0] != self.sync_expected_length:
-            # padding using the last frame, but no more than 2
-            current_length = sync_chunk.shape[0]
-            last_frame = sync_chunk[-1]
-            # 重复最后一帧以进行填充
-            padding = last_frame.repeat(self.sync_expected_length - current_length, 1, 1, 1)
-            # assert self.sync_expected_length - current_length < 12, f'sync can pad no more than 2 while {self.sync_expected_length - current_length}'
-            sync_chunk = torch.cat((sync_chunk, padding), dim=0)
-            # raise RuntimeError(f'Sync video wrong length {video_id}, '
-            #                    f'expected {self.sync_expected_length}, '
-            #                    f'got {sync_chunk.shape[0]}')
-        
-        sync_chunk = self.sync_transform(sync_chunk)
-        # assert audio_chunk.shape[1] == self.expected_audio_length and clip_chunk.shape[0] == self.clip_expected_length \
-        # and sync_chunk.shape[0] == self.sync_expected_length, 'error processed data shape'
         data = {
             'id': video_id,
             'caption': label,
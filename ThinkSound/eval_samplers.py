@@ -0,0 +1,133 @@
+"""
+Flow sampler / schedule sweep against the 40-step Euler reference, on one demo.npz.
+
+    python eval_samplers.py --results_dir results --duration_sec 9
+    python eval_samplers.py --configs euler:linear:40 dpmpp-2m:shifted:12 heun:linear:8 --save_dir results/samplers
+
+Every config starts from the same noise and conditioning; the first config is the reference.
+Reports model evaluations (NFE), wall time, relative L2 of the latents and, after VAE decode,
+a log-magnitude STFT distance of the waveforms.
+"""
+import argparse
+import json
+import os
+import time
+
+import torch
+import torchaudio
+from lightning.pytorch import seed_everything
+
+from ThinkSound.inference.sampling import sample_flow, FLOW_SAMPLERS, FLOW_SCHEDULES
+from predict import build_model, load, prepare_inputs
+
+
+DEFAULT_CONFIGS = [
+    "euler:linear:40",
+    "euler:linear:16",
+    "euler:shifted:16",
+    "dpmpp-2m:linear:16",
+    "dpmpp-2m:shifted:16",
+    "dpmpp-2m:cosine:16",
+    "dpmpp-2m:shifted:12",
+    "dpmpp-2m:shifted:10",
+    "heun:linear:8",
+    "heun:shifted:8",
+    "midpoint:shifted:6",
+]
+
+
+def parse_config(text):
+    sampler, schedule, steps = text.split(":")
+    assert sampler in FLOW_SAMPLERS, f"unknown sampler {sampler!r}, expected one of {sorted(FLOW_SAMPLERS)}"
+    assert schedule in FLOW_SCHEDULES, f"unknown schedule {schedule!r}, expected one of {sorted(FLOW_SCHEDULES)}"
+    return sampler, schedule, int(steps)
+
+
+def log_spec_distance(a, b, n_fft=2048, hop_length=512):
+    """mean |log |STFT(a)| - log |STFT(b)|| over channels, frames and bins"""
+    window = torch.hann_window(n_fft, device=a.device)
+    def log_mag(x):
+        x = x.reshape(-1, x.shape[-1]).float()
+        spec = torch.stft(x, n_fft, hop_length, window=window, return_complex=True)
+        return torch.log(spec.abs().clamp(min=1e-5))
+    return (log_mag(a) - log_mag(b)).abs().mean().item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--model_config", type=str, default="ThinkSound/configs/model_configs/thinksound.json")
+    parser.add_argument("--ckpt_dir", type=str, default="ckpts/thinksound.ckpt")
+    parser.add_argument("--pretransform_ckpt_path", type=str, default="ckpts/vae.ckpt")
+    parser.add_argument("--results_dir", type=str, default="results", help="directory holding demo.npz")
+    parser.add_argument("--duration_sec", type=float, default=9)
+    parser.add_argument("--configs", type=str, nargs="+", default=DEFAULT_CONFIGS,
+                        help="sampler:schedule:steps, the first one is the reference")
+    parser.add_argument("--shift", type=float, default=3.0, help="shift of the 'shifted' schedule")
+    parser.add_argument("--cfg_scale", type=float, default=6)
+    parser.add_argument("--repeats", type=int, default=1, help="timed runs per config, the fastest counts")
+    parser.add_argument("--no_decode", action="store_true", help="skip VAE decode and the STFT distance")
+    parser.add_argument("--save_dir", type=str, default="", help="write the decoded wavs here for listening")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--device", type=str, default="cuda:0")
+    args = parser.parse_args()
+    configs = [parse_config(c) for c in args.configs]
+
+    with open(args.model_config) as f:
+        model_config = json.load(f)
+    device = torch.device(args.device)
+    diffusion = build_model(model_config, args.duration_sec, args.ckpt_dir, args.pretransform_ckpt_path)
+    diffusion = diffusion.to(device).eval().requires_grad_(False)
+    sample_rate = model_config["sample_rate"]
+
+    audio, meta = load(os.path.join(args.results_dir, "demo.npz"), args.duration_sec)
+    meta = {k: v.to(device) if isinstance(v, torch.Tensor) else v for k, v in meta.items()}
+    seed_everything(args.seed, workers=True)
+    noise, cond_inputs = prepare_inputs(diffusion, [audio, (meta,)], device)
+
+    nfe = [0]
+    diffusion.model.register_forward_pre_hook(lambda *_: nfe.__setitem__(0, nfe[0] + 1))
+
+    def sync():
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+
+    if args.save_dir:
+        os.makedirs(args.save_dir, exist_ok=True)
+
+    rows, ref_latent, ref_wav = [], None, None
+    for sampler, schedule, steps in configs:
+        times = []
+        for _ in range(args.repeats):
+            nfe[0] = 0
+            sync()
+            start = time.perf_counter()
+            with torch.amp.autocast(device.type):
+                latent = sample_flow(diffusion.model, noise, steps, sampler, schedule, shift=args.shift,
+                                     **cond_inputs, cfg_scale=args.cfg_scale, batch_cfg=True)
+            sync()
+            times.append(time.perf_counter() - start)
+        latent = latent.float()
+
+        wav = None
+        if not args.no_decode and diffusion.pretransform is not None:
+            with torch.no_grad(), torch.amp.autocast(device.type):
+                wav = diffusion.pretransform.decode(latent).float()
+
+        if ref_latent is None:
+            ref_latent, ref_wav = latent, wav
+        latent_err = ((latent - ref_latent).norm() / ref_latent.norm()).item()
+        spec_err = log_spec_distance(wav, ref_wav) if wav is not None else float("nan")
+        rows.append((f"{sampler}:{schedule}:{steps}", nfe[0], min(times), latent_err, spec_err))
+
+        if args.save_dir and wav is not None:
+            out = wav[0].div(wav.abs().max()).clamp(-1, 1).mul(32767).to(torch.int16).cpu()
+            torchaudio.save(os.path.join(args.save_dir, f"{sampler}_{schedule}_{steps}.wav"), out, sample_rate)
+
+    ref_s = rows[0][2]
+    print(f"{'config':>22} {'NFE':>4} {'time s':>8} {'speedup':>8} {'latent rel L2':>14} {'log-STFT L1':>12}")
+    for name, n, seconds, latent_err, spec_err in rows:
+        print(f"{name:>22} {n:>4} {seconds:>8.2f} {ref_s / seconds:>7.2f}x {latent_err:>14.4f} {spec_err:>12.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -33,6 +33,94 @@ def setup(rank, world_size):
 def cleanup():
     dist.destroy_process_group()
 
+# Lazy feature extractor
+class FeaturesUtils(OriginalFeatures):
+    def __init__(self, *a,use_half=True, **kw):
+
+        _prev_device = torch.device("cpu")
+
+        try:
+            torch.set_default_device("cuda")
+            super().__init__(*a, **kw)
+        finally:
+            torch.set_default_device(_prev_device)
+
+
+        self.use_half = use_half
+        if self.use_half:
+            logging.info("Using half precision for models to save memory")
+        # initially offload heavy modules
+        if self.clip_model is not None:
+            self.clip_model = self._load_to_cuda(self.clip_model)
+
+        if hasattr(self, 't5_model') and self.t5_model is not None:
+            self.t5_model = self._load_to_cuda(self.t5_model)
+
+        if self.synchformer is not None:
+            self.synchformer = self._load_to_cuda(self.synchformer)
+        #print_gpu("models_offloaded")
+
+    def _load_to_cuda(self, model):
+        if self.use_half:
+            model = model.half()
+        return model.to('cuda')
+
+    @torch.inference_mode()
+    def encode_video_with_clip(self, x, batch_size=-1):
+        out = super().encode_video_with_clip(x.to('cuda'), batch_size)
+        torch.cuda.empty_cache()
+        #print_gpu("after_clip")
+        return out
+
+    @torch.inference_mode()
+    def encode_video_with_sync(self, x, batch_size=-1):
+        x = x.to('cuda')
+        if self.use_half:
+            x = x.half()
+        out = super().encode_video_with_sync(x, batch_size)
+        torch.cuda.empty_cache()
+        #print_gpu("after_sync")
+        return out
+
+    @torch.inference_mode()
+    def encode_text(self, text_list):
+        out = super().encode_text(text_list)
+        torch.cuda.empty_cache()
+        #print_gpu("after_text")
+        return out
+
+    @torch.inference_mode()
+    def encode_t5_text(self, text: list[str]) -> torch.Tensor:
+        assert self.t5_model is not None, 'T5 model is not loaded'
+        assert self.t5_tokenizer is not None, 'T5 Tokenizer is not loaded'
+        # x: (B, L)
+        inputs = self.t5_tokenizer(text,
+            truncation=True,
+            max_length=77,
+            padding="max_length",
+            return_tensors="pt")
+
+        inputs = {k: v.to('cuda') for k, v in inputs.items()}
+
+        return self.t5_model(**inputs).last_hidden_state
+
+
+@torch.no_grad()
+def extract_features(extractor, clip_video, sync_video, caption, caption_cot):
+    """
+    Runs MetaCLIP, Synchformer and T5 for one batch and returns the
+    conditioning tensors keyed like the .npz files written by main().
+    """
+    output = {}
+    output['metaclip_features'] = extractor.encode_video_with_clip(clip_video)
+    output['sync_features'] = extractor.encode_video_with_sync(sync_video)
+    metaclip_global_text_features, metaclip_text_features = extractor.encode_text(caption)
+    output['metaclip_global_text_features'] = metaclip_global_text_features
+    output['metaclip_text_features'] = metaclip_text_features
+    output['t5_features'] = extractor.encode_t5_text(caption_cot)
+    return output
+
+
 def main(args):
     #print_gpu("startup")
     # Dataset
@@ -58,79 +146,6 @@ def main(args):
         collate_fn=error_avoidance_collate
     )
 
-    # Lazy feature extractor
-    class FeaturesUtils(OriginalFeatures):
-        def __init__(self, *a,use_half=True, **kw):
-
-            _prev_device = torch.device("cpu")
-
-            try:
-                torch.set_default_device("cuda")
-                super().__init__(*a, **kw)
-            finally:
-                torch.set_default_device(_prev_device)
-            
-            
-            self.use_half = use_half
-            if self.use_half:
-                logging.info("Using half precision for models to save memory")
-            # initially offload heavy modules
-            if self.clip_model is not None:
-                self.clip_model = self._load_to_cuda(self.clip_model)
-
-            if hasattr(self, 't5_model') and self.t5_model is not None:
-                self.t5_model = self._load_to_cuda(self.t5_model)
-
-            if self.synchformer is not None:
-                self.synchformer = self._load_to_cuda(self.synchformer)
-            #print_gpu("models_offloaded")
-
-        def _load_to_cuda(self, model):
-            if self.use_half:
-                model = model.half()
-            return model.to('cuda')
-
-        @torch.inference_mode()
-        def encode_video_with_clip(self, x, batch_size=-1):
-            out = super().encode_video_with_clip(x.to('cuda'), batch_size)
-            torch.cuda.empty_cache()
-            #print_gpu("after_clip")
-            return out
-
-        @torch.inference_mode()
-        def encode_video_with_sync(self, x, batch_size=-1):
-            x = x.to('cuda')
-            if self.use_half:
-                x = x.half()
-            out = super().encode_video_with_sync(x, batch_size)
-            torch.cuda.empty_cache()
-            #print_gpu("after_sync")
-            return out
-
-        @torch.inference_mode()
-        def encode_text(self, text_list):
-            out = super().encode_text(text_list)
-            torch.cuda.empty_cache()
-            #print_gpu("after_text")
-            return out
-
-        @torch.inference_mode()
-        def encode_t5_text(self, text: list[str]) -> torch.Tensor:
-            assert self.t5_model is not None, 'T5 model is not loaded'
-            assert self.t5_tokenizer is not None, 'T5 Tokenizer is not loaded'
-            # x: (B, L)
-            inputs = self.t5_tokenizer(text,
-                truncation=True,
-                max_length=77,
-                padding="max_length",
-                return_tensors="pt")
-            
-            inputs = {k: v.to('cuda') for k, v in inputs.items()}
-            
-            return self.t5_model(**inputs).last_hidden_state
-
-        
-
     # Initialize new extractor
     extractor = FeaturesUtils(
         vae_ckpt=None,
@@ -157,23 +172,13 @@ def main(args):
             # latent = feature_extractor.module.encode_audio(audio)
             # output['latent'] = latent.detach().cpu()
 
-            clip_video = data['clip_video']
-            # logging.info(f'Processing batch {i} with shape: {clip_video.shape}')  # 添加日志记录
-            clip_features = extractor.encode_video_with_clip(clip_video)
-            output['metaclip_features'] = clip_features
-
-            sync_video = data['sync_video']
-            sync_features = extractor.encode_video_with_sync(sync_video)
-            output['sync_features'] = sync_features
-
-            caption = data['caption']
-            metaclip_global_text_features, metaclip_text_features = extractor.encode_text(caption)
-            output['metaclip_global_text_features'] = metaclip_global_text_features
-            output['metaclip_text_features'] = metaclip_text_features
-
-            caption_cot = data['caption_cot']
-            t5_features = extractor.encode_t5_text(caption_cot)
-            output['t5_features'] = t5_features
+            output.update(extract_features(
+                extractor,
+                data['clip_video'],
+                data['sync_video'],
+                data['caption'],
+                data['caption_cot'],
+            ))
 
 
             # 保存每个样本的输出
@@ -1,17 +1,20 @@
 from prefigure.prefigure import get_all_args, push_wandb_config
 import json
+import logging
 import os
 import re
 import torch
 import torchaudio
 import subprocess, shlex   # <- für FFmpeg-Muxing hinzugefügt
+import tempfile, wave
 from lightning.pytorch import seed_everything
 import random
 from datetime import datetime
 import numpy as np
 from ThinkSound.models import create_model_from_config
 from ThinkSound.models.utils import load_ckpt_state_dict, remove_weight_norm_from_model
-from ThinkSound.inference.sampling import sample, sample_discrete_euler
+from ThinkSound.inference.sampling import sample, sample_flow
+from ThinkSound.inference.utils import PeakLimiter
 from pathlib import Path
 
 # --- FFmpeg-Muxing Helper (NEU) ---
@@ -27,11 +30,92 @@ def _mux_to_mp4(video_path: str, audio_path: str, out_mp4: str):
     )
     subprocess.run(cmd, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     return out_mp4
-# -----------------------------------
 
-def predict_step(diffusion, batch, diffusion_objective, device='cuda:0'):
-    diffusion = diffusion.to(device)
 
+class StreamingAudioWriter:
+    """
+    Schreibt int16-PCM-Segmente (channels, n) fortlaufend in eine WAV-Datei und – mit
+    video_path / out_mp4 – gleichzeitig über eine Pipe in ffmpeg, das sie wie _mux_to_mp4
+    ins Video muxt. Das Muxen läuft so schon während des Decodes, close() wartet nur noch
+    auf den Rest. Gedacht als Sink für predict_step / predict_batch (`sinks=[writer.write]`).
+    """
+
+    def __init__(self, wav_path: str, sample_rate: int = 44100, video_path: str = None, out_mp4: str = None):
+        self.wav_path = wav_path
+        self.sample_rate = sample_rate
+        self.video_path = video_path
+        self.out_mp4 = out_mp4
+        self.samples = 0
+        self._wav = None
+        self._proc = None
+        self._stderr = None
+
+    def _start(self, channels: int):
+        self._wav = wave.open(self.wav_path, 'wb')
+        self._wav.setnchannels(channels)
+        self._wav.setsampwidth(2)
+        self._wav.setframerate(self.sample_rate)
+        if self.video_path and self.out_mp4:
+            self._stderr = tempfile.TemporaryFile()
+            self._proc = subprocess.Popen(
+                ['ffmpeg', '-y', '-loglevel', 'error',
+                 '-i', self.video_path,
+                 '-f', 's16le', '-ar', str(self.sample_rate), '-ac', str(channels), '-i', 'pipe:0',
+                 '-c:v', 'copy', '-map', '0:v:0', '-map', '1:a:0', '-shortest',
+                 '-c:a', 'aac', '-b:a', '192k', '-ar', '48000', '-ac', '2',
+                 '-movflags', '+faststart', self.out_mp4],
+                stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr)
+
+    def write(self, pcm: torch.Tensor):
+        if self._wav is None:
+            self._start(pcm.shape[0])
+        data = pcm.t().contiguous().numpy().tobytes()  # interleaved s16le
+        self._wav.writeframes(data)
+        if self._proc is not None:
+            try:
+                self._proc.stdin.write(data)
+            except BrokenPipeError:
+                # ffmpeg hat aufgegeben (z.B. kaputtes Video) → dessen Fehlermeldung zeigen
+                self._check_ffmpeg(self._proc.wait())
+        self.samples += pcm.shape[1]
+
+    def _check_ffmpeg(self, returncode: int):
+        if returncode != 0:
+            self._stderr.seek(0)
+            raise subprocess.CalledProcessError(returncode, 'ffmpeg', stderr=self._stderr.read())
+
+    def close(self):
+        """WAV abschließen und auf ffmpeg warten; Fehler von ffmpeg als CalledProcessError."""
+        if self._wav is None:
+            self._start(2)
+        self._wav.close()
+        if self._proc is not None:
+            try:
+                self._proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            self._check_ffmpeg(self._proc.wait())
+            self._stderr.close()
+        return self.out_mp4 or self.wav_path
+
+    def abort(self):
+        """Nach einem Fehler: ffmpeg beenden und halb geschriebene Dateien löschen."""
+        if self._proc is not None:
+            self._proc.kill()
+            self._proc.wait()
+            self._stderr.close()
+        if self._wav is not None:
+            try:
+                self._wav.close()
+            except Exception:
+                pass
+        for path in (self.wav_path, self.out_mp4):
+            if path and os.path.exists(path):
+                os.remove(path)
+# -----------------------------------
+
+def prepare_inputs(diffusion, batch, device='cuda:0', noise=None):
+    """Conditioning-Inputs und Start-Noise (hier gezogen, falls nicht übergeben) für einen (reals, metadata)-Batch."""
     reals, metadata = batch
     ids = [item['id'] for item in metadata]
     batch_size, length = reals.shape[0], reals.shape[2]
@@ -44,7 +128,9 @@ def predict_step(diffusion, batch, diffusion_objective, device='cuda:0'):
     conditioning['sync_features'][~video_exist] = diffusion.model.model.empty_sync_feat
 
     cond_inputs = diffusion.get_conditioning_inputs(conditioning)
-    if batch_size > 1:
+    if noise is not None:
+        noise = noise.to(device)
+    elif batch_size > 1:
         noise_list = []
         for _ in range(batch_size):
             noise_1 = torch.randn([1, diffusion.io_channels, length]).to(device)
@@ -52,24 +138,139 @@ def predict_step(diffusion, batch, diffusion_objective, device='cuda:0'):
         noise = torch.cat(noise_list, dim=0)
     else:
         noise = torch.randn([batch_size, diffusion.io_channels, length]).to(device)
+    return noise, cond_inputs
+
+
+def decode_to_sinks(diffusion, fakes, sinks, lengths=None, chunk_size=128, overlap=32, callback=None):
+    """
+    Latents → Audio, segmentweise (pretransform.decode_stream): jeder Clip läuft durch einen
+    eigenen PeakLimiter (statt Normierung auf den Gesamt-Peak) und sinks[i] bekommt die
+    int16-Segmente (channels, n) von Clip i, sobald sie dekodiert sind. `lengths[i]` =
+    Latent-Länge von Clip i, alles dahinter ist Padding und wird verworfen.
+    """
+    ratio = 1
+    segments = [fakes]
+    if diffusion.pretransform is not None:
+        if callback is not None:
+            callback({'stage': 'vae-decode', 'i': 0, 'steps': 1})
+        ratio = diffusion.pretransform.downsampling_ratio
+        if hasattr(diffusion.pretransform, 'decode_stream'):
+            segments = diffusion.pretransform.decode_stream(fakes, chunk_size=chunk_size, overlap=overlap)
+        else:
+            segments = [diffusion.pretransform.decode(fakes)]
+    ends = [length * ratio for length in (lengths or [fakes.shape[-1]] * len(sinks))]
+    limiters = [PeakLimiter() for _ in sinks]
+    pos = 0
+    for segment in segments:
+        segment = segment.to(torch.float32)
+        for i, sink in enumerate(sinks):
+            part = segment[i, :, :max(0, ends[i] - pos)]
+            if part.shape[-1] > 0:
+                sink(limiters[i](part).clamp(-1, 1).mul(32767).to(torch.int16).cpu())
+        pos += segment.shape[-1]
+
+
+def predict_step(diffusion, batch, diffusion_objective, device='cuda:0', callback=None,
+                 steps=40, sampler='euler', schedule='linear', shift=3.0,
+                 sinks=None, decode_chunk_size=128, decode_overlap=32):
+    """
+    `sampler` / `schedule`: Namen aus FLOW_SAMPLERS / FLOW_SCHEDULES (nur rectified_flow).
+    Mit `sinks` (ein Callable pro Clip, z.B. StreamingAudioWriter.write) wird das Audio
+    segmentweise dorthin gestreamt statt als (B, C, n)-int16-Tensor zurückgegeben.
+    """
+    diffusion = diffusion.to(device)
+    noise, cond_inputs = prepare_inputs(diffusion, batch, device)
 
     with torch.amp.autocast('cuda'):
 
         model = diffusion.model
         if diffusion_objective == "v":
-            fakes = sample(model, noise, 40, 0, **cond_inputs, cfg_scale=6, batch_cfg=True)
+            fakes = sample(model, noise, steps, 0, **cond_inputs, cfg_scale=6, batch_cfg=True)
         elif diffusion_objective == "rectified_flow":
             import time
             start_time = time.time()
-            fakes = sample_discrete_euler(model, noise, 40, **cond_inputs, cfg_scale=6, batch_cfg=True)
+            fakes = sample_flow(model, noise, steps, sampler, schedule, shift=shift, callback=callback,
+                                **cond_inputs, cfg_scale=6, batch_cfg=True)
             end_time = time.time()
             execution_time = end_time - start_time
-            print(f"执行时间: {execution_time:.2f} 秒")
-        if diffusion.pretransform is not None:
-            fakes = diffusion.pretransform.decode(fakes)
+            logging.info("sampling (%s/%s, %d steps): %.2f s", sampler, schedule, steps, execution_time)
+        segments = [[] for _ in range(fakes.shape[0])]
+        decode_to_sinks(diffusion, fakes, sinks or [seg.append for seg in segments],
+                        chunk_size=decode_chunk_size, overlap=decode_overlap, callback=callback)
+
+    if sinks is None:
+        return torch.stack([torch.cat(seg, dim=-1) for seg in segments])
+
+
+def pad_metadata(diffusion, metadata, clip_len, sync_len):
+    """
+    Video-Features eines Clips auf clip_len / sync_len Frames auffüllen, mit den leeren
+    ("kein Video") Features des Modells. Dazu die (clip_len,) Bool-Maske der Clip-Frames,
+    über die das globale Clip-Conditioning mittelt.
+    """
+    mm = diffusion.model.model
+    metadata = dict(metadata)
+    clip_f, sync_f = metadata['metaclip_features'], metadata['sync_features']
+    clip_mask = torch.ones(clip_len, dtype=torch.bool, device=clip_f.device)
+    if metadata['video_exist']:
+        # ohne Video ersetzt prepare_inputs ohnehin alles durch die leeren Features
+        clip_mask[clip_f.shape[0]:] = False
+    metadata['metaclip_features'] = torch.cat(
+        [clip_f, mm.empty_clip_feat.detach().to(clip_f).expand(clip_len - clip_f.shape[0], -1)])
+    metadata['sync_features'] = torch.cat(
+        [sync_f, mm.empty_sync_feat.detach().to(sync_f).expand(sync_len - sync_f.shape[0], -1)])
+    return metadata, clip_mask
+
+
+def predict_batch(diffusion, items, diffusion_objective, device='cuda:0', callback=None, seeds=None,
+                  steps=40, sampler='euler', schedule='linear', shift=3.0,
+                  sinks=None, decode_chunk_size=128, decode_overlap=32):
+    """
+    Rechnet Clips unterschiedlicher Länge gemeinsam. `items` = einzelne (reals, metadata)-Paare
+    wie von `load`. Jeder Clip wird auf den längsten aufgefüllt (Latent mit Noise, Video-Features
+    mit den leeren Features, per clip_mask aus dem Clip-Pooling genommen), alle werden in einem
+    Batch entrauscht und dekodiert und danach wieder auf ihre eigene Länge geschnitten.
+    `seeds[i]` seedet einen eigenen CPU-Generator für das Noise von Clip i (der globale RNG
+    bleibt unberührt) – gleiches Start-Noise wie seed_everything(seeds[i]) + predict_step allein.
+    Gibt pro Item einen int16-Tensor (channels, samples) zurück, mit `sinks` (einer pro Item)
+    wird stattdessen gestreamt wie in predict_step.
+    """
+    diffusion = diffusion.to(device)
+    lengths = [reals.shape[-1] for reals, _ in items]
+    metas = [meta for _, meta in items]
+    latent_len = max(lengths)
+    clip_len = max(m['metaclip_features'].shape[0] for m in metas)
+    sync_len = max(m['sync_features'].shape[0] for m in metas)
+
+    padded = [pad_metadata(diffusion, m, clip_len, sync_len) for m in metas]
+    metadata = tuple(m for m, _ in padded)
+    clip_mask = torch.stack([mask for _, mask in padded]).to(device)
+
+    noise = []
+    for i, length in enumerate(lengths):
+        gen = torch.Generator().manual_seed(seeds[i]) if seeds is not None else None
+        n = torch.randn([1, diffusion.io_channels, length], generator=gen)
+        pad = torch.randn([1, diffusion.io_channels, latent_len - length], generator=gen)
+        noise.append(torch.cat([n, pad], dim=-1))
+    noise = torch.cat(noise, dim=0)
+
+    reals = torch.zeros((len(items), diffusion.io_channels, latent_len))
+    noise, cond_inputs = prepare_inputs(diffusion, [reals, metadata], device, noise=noise)
+    cond_inputs['clip_mask'] = clip_mask
 
-    audios = fakes.to(torch.float32).div(torch.max(torch.abs(fakes))).clamp(-1, 1).mul(32767).to(torch.int16).cpu()
-    return audios
+    with torch.amp.autocast('cuda'):
+        model = diffusion.model
+        if diffusion_objective == "v":
+            fakes = sample(model, noise, steps, 0, **cond_inputs, cfg_scale=6, batch_cfg=True)
+        elif diffusion_objective == "rectified_flow":
+            fakes = sample_flow(model, noise, steps, sampler, schedule, shift=shift, callback=callback,
+                                **cond_inputs, cfg_scale=6, batch_cfg=True)
+        segments = [[] for _ in items]
+        decode_to_sinks(diffusion, fakes, sinks or [seg.append for seg in segments], lengths=lengths,
+                        chunk_size=decode_chunk_size, overlap=decode_overlap, callback=callback)
+
+    if sinks is None:
+        return [torch.cat(seg, dim=-1) for seg in segments]
 
 def load_file(filename, info, latent_length):
     npz_file = filename
@@ -97,38 +298,18 @@ def load(filename,duration):
 
     return (audio, info)
 
-def main():
-
-    args = get_all_args()
-
-    if (args.save_dir == ''):
-        args.save_dir=args.results_dir
-
-    seed = args.seed
-
-    if os.environ.get("SLURM_PROCID") is not None:
-        seed += int(os.environ.get("SLURM_PROCID"))
-
-    seed_everything(seed, workers=True)
-
-    if args.model_config == '':
-        args.model_config = "ThinkSound/configs/model_configs/thinksound.json"
-    with open(args.model_config) as f:
-        model_config = json.load(f)
-
-    duration=(float)(args.duration_sec)
-    
-    # Dauerabhängige Sequenzlängen setzen
+def set_duration(model_config, duration):
+    """Dauerabhängige Sequenzlängen in model_config setzen (in-place)."""
     model_config["sample_size"] = duration * model_config["sample_rate"]
     model_config["model"]["diffusion"]["config"]["sync_seq_len"] = 24 * int(duration)
     model_config["model"]["diffusion"]["config"]["clip_seq_len"] = 8 * int(duration)
     model_config["model"]["diffusion"]["config"]["latent_seq_len"] = round(44100 / 64 / 32 * duration)
+    return model_config
 
 
-    model = create_model_from_config(model_config)
-
+def load_diffusion_state(model, ckpt_path):
     # --- Checkpoint laden ---
-    ckpt = torch.load(args.ckpt_dir, map_location="cpu")
+    ckpt = torch.load(ckpt_path, map_location="cpu")
 
     # Lightning-Style: eigentliche Gewichte liegen unter "state_dict"
     if "state_dict" in ckpt:
@@ -159,13 +340,47 @@ def main():
         print("  Missing:", missing[:10], "...")
     if unexpected:
         print("  Unexpected:", unexpected[:10], "...")
+    return model
 
 
-    
-    load_vae_state = load_ckpt_state_dict(args.pretransform_ckpt_path, prefix='autoencoder.')
+def build_model(model_config, duration, ckpt_path, pretransform_ckpt_path):
+    """
+    Baut das Diffusionsmodell und lädt DiT- und VAE-Gewichte. `duration` setzt nur die
+    Default-Sequenzlängen, das MMmodule nimmt die Längen aus den Eingaben und läuft
+    damit für jede Clip-Dauer.
+    Wird von main() und vom residenten API-Worker (app/thinksound_worker.py) genutzt.
+    """
+    model = create_model_from_config(set_duration(model_config, duration))
+    load_diffusion_state(model, ckpt_path)
+
+    load_vae_state = load_ckpt_state_dict(pretransform_ckpt_path, prefix='autoencoder.')
     model.pretransform.load_state_dict(load_vae_state)
+    return model
+
+
+def main():
+
+    args = get_all_args()
+
+    if (args.save_dir == ''):
+        args.save_dir=args.results_dir
 
+    seed = args.seed
+
+    if os.environ.get("SLURM_PROCID") is not None:
+        seed += int(os.environ.get("SLURM_PROCID"))
+
+    seed_everything(seed, workers=True)
+
+    if args.model_config == '':
+        args.model_config = "ThinkSound/configs/model_configs/thinksound.json"
+    with open(args.model_config) as f:
+        model_config = json.load(f)
+
+    duration=(float)(args.duration_sec)
     
+    model = build_model(model_config, duration, args.ckpt_dir, args.pretransform_ckpt_path)
+
     audio,meta=load(os.path.join(args.results_dir, "demo.npz") , duration)
     
     for k, v in meta.items():
@@ -175,7 +390,10 @@ def main():
     audio=predict_step(model, 
         batch=[audio,(meta,)],
         diffusion_objective=model_config["model"]["diffusion"]["diffusion_objective"], 
-        device='cuda:0'
+        device='cuda:0',
+        steps=args.sampler_steps,
+        sampler=args.sampler,
+        schedule=args.schedule,
     )
 
     current_date = datetime.now()
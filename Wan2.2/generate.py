@@ -17,7 +17,7 @@ from PIL import Image
 
 import wan
 from wan.configs import MAX_AREA_CONFIGS, SIZE_CONFIGS, SUPPORTED_SIZES, WAN_CONFIGS
-from wan.distributed.util import init_distributed_group
+from wan.distributed.util import default_backend, init_distributed_group
 from wan.utils.prompt_extend import DashScopePromptExpander, QwenPromptExpander
 from wan.utils.utils import merge_video_audio, save_video, str2bool
 
@@ -94,6 +94,10 @@ def _validate_args(args):
     if args.frame_num is None:
         args.frame_num = cfg.frame_num
 
+    # the ulysses DiT forward runs its own block loop, without the step cache
+    assert args.step_cache is None or args.ulysses_size <= 1, \
+        "--step_cache is not supported with --ulysses_size > 1."
+
     args.base_seed = args.base_seed if args.base_seed >= 0 else random.randint(
         0, sys.maxsize)
     # Size check
@@ -137,11 +141,73 @@ def _parse_args():
         default=None,
         help="Whether to offload the model to CPU after each model forward, reducing GPU memory usage."
     )
+    parser.add_argument(
+        "--t5_cache_dir",
+        type=str,
+        default=None,
+        help="Directory to persist T5 prompt embeddings across runs (t2v/ti2v)."
+    )
+    parser.add_argument(
+        "--vae_tile",
+        type=str,
+        default=None,
+        help="Enable spatially tiled VAE encode/decode with tiles of height*width pixels (ti2v), e.g. 256*256."
+    )
+    parser.add_argument(
+        "--vae_tile_overlap",
+        type=int,
+        default=64,
+        help="Overlap in pixels between VAE tiles; seams are blended across it."
+    )
+    parser.add_argument(
+        "--batch_cfg",
+        type=str2bool,
+        default=True,
+        help="Whether to run the conditional and unconditional CFG branches in one batched forward (t2v/ti2v)."
+    )
+    parser.add_argument(
+        "--step_cache",
+        type=float,
+        default=None,
+        help="Reuse the DiT block residual across steps while the estimated change stays below this threshold (t2v/ti2v/i2v, e.g. 0.05); higher is faster but less accurate. Not supported with ulysses."
+    )
+    parser.add_argument(
+        "--compile",
+        type=str,
+        default=None,
+        help="torch.compile the DiT blocks for the requested shape with this mode (ti2v), e.g. default or reduce-overhead (requires --offload_model False)."
+    )
+    parser.add_argument(
+        "--compile_cache_dir",
+        type=str,
+        default=None,
+        help="Directory to persist compiled kernels across runs."
+    )
+    parser.add_argument(
+        "--block_offload",
+        type=int,
+        default=2,
+        help="With offload_model, stream this many DiT blocks ahead from pinned host memory (ti2v); 0 moves the whole DiT at once."
+    )
+    parser.add_argument(
+        "--expert_residency",
+        type=str,
+        default="auto",
+        choices=["auto", "resident", "swap"],
+        help="How the A14B high/low noise experts share the GPU (t2v/i2v): keep both resident, swap them, or decide by free memory."
+    )
     parser.add_argument(
         "--ulysses_size",
         type=int,
         default=1,
         help="The size of the ulysses parallelism in DiT.")
+    parser.add_argument(
+        "--dist_backend",
+        type=str,
+        default=None,
+        choices=["nccl", "gloo"],
+        help="torch.distributed backend for multi-process runs. Defaults to nccl with CUDA, gloo otherwise; gloo stages the sequence parallel collectives through the CPU and does not support FSDP."
+    )
     parser.add_argument(
         "--t5_fsdp",
         action="store_true",
@@ -301,6 +367,15 @@ def _parse_args():
     return args
 
 
+def _enable_step_cache(pipe, threshold):
+    caches = []
+    if threshold is not None:
+        for name in ('model', 'high_noise_model', 'low_noise_model'):
+            if hasattr(pipe, name):
+                caches.append(getattr(pipe, name).enable_step_cache(threshold))
+    return caches
+
+
 def _init_logging(rank):
     # logging
     if rank == 0:
@@ -324,10 +399,17 @@ def generate(args):
         args.offload_model = False if world_size > 1 else True
         logging.info(
             f"offload_model is not specified, set to {args.offload_model}.")
+    assert not (args.compile == "reduce-overhead" and args.offload_model), \
+        "--compile reduce-overhead captures CUDA graphs and needs --offload_model False."
     if world_size > 1:
-        torch.cuda.set_device(local_rank)
+        args.dist_backend = args.dist_backend or default_backend()
+        assert args.dist_backend == "nccl" or not (
+            args.t5_fsdp or args.dit_fsdp
+        ), "t5_fsdp and dit_fsdp require the nccl backend."
+        if torch.cuda.is_available():
+            torch.cuda.set_device(local_rank)
         dist.init_process_group(
-            backend="nccl",
+            backend=args.dist_backend,
             init_method="env://",
             rank=rank,
             world_size=world_size)
@@ -341,7 +423,7 @@ def generate(args):
 
     if args.ulysses_size > 1:
         assert args.ulysses_size == world_size, f"The number of ulysses_size should be equal to the world size."
-        init_distributed_group()
+        init_distributed_group(args.dist_backend)
 
     if args.use_prompt_extend:
         if args.prompt_extend_method == "dashscope":
@@ -401,6 +483,7 @@ def generate(args):
         args.prompt = input_prompt[0]
         logging.info(f"Extended prompt: {args.prompt}")
 
+    step_caches = []
     if "t2v" in args.task:
         logging.info("Creating WanT2V pipeline.")
         wan_t2v = wan.WanT2V(
@@ -413,7 +496,10 @@ def generate(args):
             use_sp=(args.ulysses_size > 1),
             t5_cpu=args.t5_cpu,
             convert_model_dtype=args.convert_model_dtype,
+            t5_cache_dir=args.t5_cache_dir,
+            expert_residency=args.expert_residency,
         )
+        step_caches = _enable_step_cache(wan_t2v, args.step_cache)
 
         logging.info(f"Generating video ...")
         video = wan_t2v.generate(
@@ -425,7 +511,8 @@ def generate(args):
             sampling_steps=args.sample_steps,
             guide_scale=args.sample_guide_scale,
             seed=args.base_seed,
-            offload_model=args.offload_model)
+            offload_model=args.offload_model,
+            batch_cfg=args.batch_cfg)
     elif "ti2v" in args.task:
         logging.info("Creating WanTI2V pipeline.")
         wan_ti2v = wan.WanTI2V(
@@ -438,7 +525,19 @@ def generate(args):
             use_sp=(args.ulysses_size > 1),
             t5_cpu=args.t5_cpu,
             convert_model_dtype=args.convert_model_dtype,
+            t5_cache_dir=args.t5_cache_dir,
+            block_offload=args.block_offload,
         )
+        if args.vae_tile is not None:
+            tile_h, tile_w = (int(u) for u in args.vae_tile.split('*'))
+            wan_ti2v.vae.enable_tiling((tile_h, tile_w), args.vae_tile_overlap)
+        step_caches = _enable_step_cache(wan_ti2v, args.step_cache)
+        if args.compile is not None and img is None:
+            wan_ti2v.precompile([(SIZE_CONFIGS[args.size], args.frame_num)],
+                                mode=args.compile,
+                                cache_dir=args.compile_cache_dir,
+                                batch_cfg=args.batch_cfg,
+                                offload_model=args.offload_model)
 
         logging.info(f"Generating video ...")
         video = wan_ti2v.generate(
@@ -452,7 +551,8 @@ def generate(args):
             sampling_steps=args.sample_steps,
             guide_scale=args.sample_guide_scale,
             seed=args.base_seed,
-            offload_model=args.offload_model)
+            offload_model=args.offload_model,
+            batch_cfg=args.batch_cfg)
     elif "animate" in args.task:
         logging.info("Creating Wan-Animate pipeline.")
         wan_animate = wan.WanAnimate(
@@ -526,7 +626,9 @@ def generate(args):
             use_sp=(args.ulysses_size > 1),
             t5_cpu=args.t5_cpu,
             convert_model_dtype=args.convert_model_dtype,
+            expert_residency=args.expert_residency,
         )
+        step_caches = _enable_step_cache(wan_i2v, args.step_cache)
         logging.info("Generating video ...")
         video = wan_i2v.generate(
             args.prompt,
@@ -540,6 +642,9 @@ def generate(args):
             seed=args.base_seed,
             offload_model=args.offload_model)
 
+    for cache in step_caches:
+        logging.info(f"Step cache: {cache.stats()}")
+
     if rank == 0:
         # Hardcoded Pfad für ThinkSound
         THINK_VID_DIR = "/workspace/ThinkSound/Videos"
@@ -0,0 +1,109 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Per-step DiT latency, eager vs. `WanModel.enable_compile`, per (size, frame_num) bucket.
+
+    python tests/bench_compile.py --ckpt_dir ./Wan2.2-TI2V-5B --sizes 1280*704 704*1280 --frame_num 121
+    python tests/bench_compile.py --tiny --device cpu   # smoke test with a random-weight model
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.configs import SIZE_CONFIGS, WAN_CONFIGS
+from wan.modules.model import WanModel
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--task", type=str, default="ti2v-5B", choices=list(WAN_CONFIGS))
+    parser.add_argument("--ckpt_dir", type=str, default=None)
+    parser.add_argument("--tiny", action="store_true", default=False,
+                        help="Use a small random-weight model instead of a checkpoint.")
+    parser.add_argument("--sizes", type=str, nargs="+", default=["1280*704", "704*1280"],
+                        choices=list(SIZE_CONFIGS))
+    parser.add_argument("--frame_num", type=int, default=121)
+    parser.add_argument("--batch", type=int, default=2,
+                        help="DiT batch size, 2 for batched CFG.")
+    parser.add_argument("--steps", type=int, default=5, help="Timed steps per mode.")
+    parser.add_argument("--mode", type=str, default="default", help="torch.compile mode.")
+    parser.add_argument("--cache_dir", type=str, default=None)
+    parser.add_argument("--device", type=str, default="cuda")
+    args = parser.parse_args()
+    assert args.tiny or args.ckpt_dir, "--ckpt_dir is required without --tiny"
+    return args
+
+
+def _build_model(args, cfg, z_dim, device):
+    if args.tiny:
+        model = WanModel(
+            model_type='t2v', in_dim=z_dim, out_dim=z_dim, dim=128, ffn_dim=256,
+            num_heads=4, num_layers=4, text_len=cfg.text_len)
+        dtype = torch.float32
+    else:
+        model = WanModel.from_pretrained(args.ckpt_dir)
+        dtype = cfg.param_dtype
+    return model.eval().requires_grad_(False).to(device, dtype), dtype
+
+
+def _step(model, x, t, context, seq_len, device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    model(x, t=t, context=context, seq_len=seq_len)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    return time.perf_counter() - start
+
+
+def main():
+    args = _parse_args()
+    cfg = WAN_CONFIGS[args.task]
+    z_dim = 48 if args.task == 'ti2v-5B' else 16
+    device = torch.device(args.device)
+    model, dtype = _build_model(args, cfg, z_dim, device)
+
+    buckets = []
+    for size in args.sizes:
+        w, h = SIZE_CONFIGS[size]
+        shape = (z_dim, (args.frame_num - 1) // cfg.vae_stride[0] + 1,
+                 h // cfg.vae_stride[1], w // cfg.vae_stride[2])
+        seq_len = math.ceil(shape[2] * shape[3] * shape[1] /
+                            (cfg.patch_size[1] * cfg.patch_size[2]))
+        buckets.append((size, shape, seq_len))
+
+    context = [torch.randn(64, model.text_dim, device=device)] * args.batch
+    results = {}
+    with torch.amp.autocast(device.type, dtype=dtype, enabled=dtype != torch.float32), \
+            torch.no_grad():
+        for size, shape, seq_len in buckets:
+            x = [torch.randn(shape, device=device)] * args.batch
+            t = torch.full((args.batch, seq_len), 500., device=device)
+            _step(model, x, t, context, seq_len, device)
+            results[size] = {
+                'eager_s': min(_step(model, x, t, context, seq_len, device)
+                               for _ in range(args.steps))
+            }
+
+        model.enable_compile(args.mode, args.cache_dir)
+        for size, shape, seq_len in buckets:
+            x = [torch.randn(shape, device=device)] * args.batch
+            t = torch.full((args.batch, seq_len), 500., device=device)
+            with model.precompile():
+                results[size]['compile_s'] = _step(model, x, t, context, seq_len, device)
+            results[size]['compiled_s'] = min(
+                _step(model, x, t, context, seq_len, device) for _ in range(args.steps))
+
+    print(f"{'size':>10} {'frames':>6} {'compile s':>10} {'eager ms':>10} {'compiled ms':>12} {'speedup':>8}")
+    for size, r in results.items():
+        print(f"{size:>10} {args.frame_num:>6} {r['compile_s']:>10.1f} {r['eager_s'] * 1e3:>10.1f} "
+              f"{r['compiled_s'] * 1e3:>12.1f} {r['eager_s'] / r['compiled_s']:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
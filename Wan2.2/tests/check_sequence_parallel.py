@@ -0,0 +1,142 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+Ulysses sequence parallel DiT output vs. the single-process result, on N local ranks.
+
+    python tests/check_sequence_parallel.py --world_size 4                             # gloo, CPU
+    python tests/check_sequence_parallel.py --world_size 2 --backend nccl --device cuda
+"""
+import argparse
+import math
+import os
+import socket
+import sys
+import time
+import types
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.distributed.sequence_parallel import sp_attn_forward, sp_dit_forward
+from wan.modules.model import WanModel
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--world_size", type=int, default=2)
+    parser.add_argument("--backend", type=str, default="gloo", choices=["gloo", "nccl"])
+    parser.add_argument("--device", type=str, default="cpu", choices=["cpu", "cuda"])
+    parser.add_argument("--num_heads", type=int, default=8,
+                        help="Must be divisible by --world_size.")
+    parser.add_argument("--num_layers", type=int, default=2)
+    parser.add_argument("--atol", type=float, default=None,
+                        help="Defaults to 1e-4 on CPU, 5e-2 on CUDA (half precision attention).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    assert args.num_heads % args.world_size == 0, \
+        f"{args.num_heads=} cannot be divided evenly by {args.world_size=}"
+    if args.atol is None:
+        args.atol = 1e-4 if args.device == "cpu" else 5e-2
+    return args
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _cases(model, world_size, device):
+    r"""
+    (name, forward kwargs) pairs covering the pipelines' DiT calls: batched
+    CFG with a scalar timestep (t2v), per-token timesteps (ti2v), and a
+    sequence padded up to `seq_len`.
+    """
+    z, (pt, ph, pw) = model.in_dim, model.patch_size
+    latent = torch.randn(z, 3, 8, 12, device=device)
+    tokens = math.prod(latent.shape[1:]) // (pt * ph * pw)
+    seq_len = math.ceil(tokens / world_size) * world_size
+    cond = torch.randn(7, model.text_dim, device=device)
+    uncond = torch.randn(11, model.text_dim, device=device)
+
+    token_t = torch.full((1, seq_len), 700., device=device)
+    token_t[:, :tokens // 3] = 0.
+    padded = math.ceil((tokens + 1) / world_size) * world_size
+    return [
+        ("t2v cfg batch", dict(x=[latent, latent], t=torch.tensor([700., 700.], device=device),
+                               context=[cond, uncond], seq_len=seq_len)),
+        ("ti2v token t", dict(x=[latent], t=token_t, context=[cond], seq_len=seq_len)),
+        ("padded", dict(x=[latent], t=torch.tensor([300.], device=device),
+                        context=[cond], seq_len=padded)),
+    ]
+
+
+def _timed(model, kwargs, device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    out = model(**kwargs)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return out, time.perf_counter() - start
+
+
+def _worker(rank, args, port):
+    device = torch.device(args.device, rank if args.device == "cuda" else None)
+    if device.type == "cuda":
+        torch.cuda.set_device(device)
+    dist.init_process_group(
+        backend=args.backend,
+        init_method=f"tcp://127.0.0.1:{port}",
+        rank=rank,
+        world_size=args.world_size)
+
+    # same seed on every rank, so every rank holds the same weights and inputs
+    torch.manual_seed(args.seed)
+    model = WanModel(
+        model_type='t2v', in_dim=4, out_dim=4, dim=16 * args.num_heads,
+        ffn_dim=32 * args.num_heads, freq_dim=32, text_dim=32, text_len=16,
+        num_heads=args.num_heads, num_layers=args.num_layers)
+    # the head is zero-initialized, which would hide any mismatch
+    torch.nn.init.normal_(model.head.head.weight, std=0.02)
+    model = model.eval().requires_grad_(False).to(device)
+    cases = _cases(model, args.world_size, device)
+
+    failed = []
+    with torch.no_grad():
+        refs = [_timed(model, kwargs, device) for _, kwargs in cases]
+
+        for block in model.blocks:
+            block.self_attn.forward = types.MethodType(sp_attn_forward, block.self_attn)
+        model.forward = types.MethodType(sp_dit_forward, model)
+        for (name, kwargs), (ref, ref_s) in zip(cases, refs):
+            _timed(model, kwargs, device)
+            out, sp_s = _timed(model, kwargs, device)
+            err = max((u - v).abs().max().item() for u, v in zip(out, ref))
+            if rank == 0:
+                print(f"{name:>14} {args.world_size:>5} {err:>10.2e} "
+                      f"{ref_s * 1e3:>10.1f} {sp_s * 1e3:>10.1f}")
+            if err > args.atol:
+                failed.append(f"{name}: max abs diff {err:.2e} > {args.atol:.0e}")
+
+    dist.barrier()
+    dist.destroy_process_group()
+    assert not failed, f"rank {rank}: " + "; ".join(failed)
+
+
+def main():
+    args = _parse_args()
+    print(f"backend={args.backend} device={args.device}")
+    print(f"{'case':>14} {'ranks':>5} {'max diff':>10} {'single ms':>10} {'sp ms':>10}")
+    try:
+        mp.spawn(_worker, args=(args, _free_port()), nprocs=args.world_size)
+    except mp.ProcessRaisedException as e:
+        print(e)
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+"""
+DiT step cache vs. the uncached sampling loop, on a tiny random-weight model.
+
+    python tests/check_step_cache.py                  # CPU
+    python tests/check_step_cache.py --device cuda
+    python tests/check_step_cache.py --device cuda --block_offload 2
+
+threshold=0 must reproduce the uncached latents exactly and never skip. An
+unreachable threshold skips whenever warmup and max_skip allow, which fixes
+the hit/miss counts for batched and sequential CFG. With --block_offload the
+blocks are streamed by `ModelOffloader` and every cached run must match its
+resident counterpart exactly.
+"""
+import argparse
+import math
+import os
+import sys
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wan.modules.model import WanModel
+from wan.utils.cfg import GuidedForward
+from wan.utils.offload import ModelOffloader
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--device", type=str, default="cpu", choices=["cpu", "cuda"])
+    parser.add_argument("--steps", type=int, default=12)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--max_skip", type=int, default=3)
+    parser.add_argument("--num_layers", type=int, default=4)
+    parser.add_argument("--block_offload", type=int, default=0,
+                        help="Also run with this many blocks streamed ahead (CUDA only).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    assert not (args.block_offload and args.device != "cuda"), \
+        "--block_offload needs --device cuda (pinned host copies)."
+    return args
+
+
+def _expected_counts(steps, warmup, max_skip):
+    r"""
+    Hits and misses per trajectory when every skip is allowed by the threshold.
+    """
+    hits = misses = skipped = 0
+    for i in range(steps):
+        if i >= warmup and skipped < max_skip:
+            hits, skipped = hits + 1, skipped + 1
+        else:
+            misses, skipped = misses + 1, 0
+    return hits, misses
+
+
+def _sample(model, latent, cond, uncond, steps, batch_cfg, offloader=None):
+    r"""
+    Euler flow sampling with guided DiT predictions, as in the pipelines,
+    optionally with the blocks streamed by `offloader`.
+    """
+    if offloader is not None:
+        offloader.load(stream_blocks=True)
+    seq_len = math.prod(latent.shape[1:]) // math.prod(model.patch_size)
+    # built once per generation, so the projected contexts (the cache keys) persist
+    arg_c = {'context': [cond], 'seq_len': seq_len}
+    arg_null = {'context': [uncond], 'seq_len': seq_len}
+    guided_forward = GuidedForward(batch_cfg)
+    sigmas = torch.linspace(1., 0., steps + 1, device=latent.device)
+    x = latent
+    with torch.no_grad():
+        for i in range(steps):
+            t = (sigmas[i] * 1000).reshape(1)
+            v = guided_forward(model, [x], t, arg_c, arg_null, 5.0)
+            x = x + (sigmas[i + 1] - sigmas[i]) * v
+    if offloader is not None:
+        # back to fully resident for the runs that follow
+        offloader.offload()
+        offloader.load(stream_blocks=False)
+    return x
+
+
+def main():
+    args = _parse_args()
+    device = torch.device(args.device)
+
+    torch.manual_seed(args.seed)
+    model = WanModel(
+        model_type='t2v', in_dim=4, out_dim=4, dim=64, ffn_dim=128,
+        freq_dim=32, text_dim=32, text_len=16, num_heads=4,
+        num_layers=args.num_layers)
+    # the head is zero-initialized, which would hide any mismatch
+    torch.nn.init.normal_(model.head.head.weight, std=0.02)
+    model = model.eval().requires_grad_(False).to(device)
+    latent = torch.randn(4, 3, 8, 12, device=device)
+    cond = torch.randn(7, model.text_dim, device=device)
+    uncond = torch.randn(11, model.text_dim, device=device)
+    offloader = ModelOffloader(
+        model, device, prefetch_blocks=args.block_offload
+    ) if args.block_offload else None
+
+    hits, misses = _expected_counts(args.steps, args.warmup, args.max_skip)
+    failed = []
+    print(f"{'case':>32} {'hits':>5} {'misses':>6} {'max diff':>10}")
+    for batch_cfg in (True, False):
+        # the sequential branches are separate forwards, each counted
+        calls = 1 if batch_cfg else 2
+        mode = "batched" if batch_cfg else "sequential"
+        model.disable_step_cache()
+        ref = _sample(model, latent, cond, uncond, args.steps, batch_cfg)
+
+        for threshold, expected in ((0., (0, args.steps * calls)),
+                                    (float('inf'), (hits * calls, misses * calls))):
+            cache = model.enable_step_cache(threshold, args.warmup, args.max_skip)
+            # two generations: the second one starts a new trajectory
+            for _ in range(2):
+                out = _sample(model, latent, cond, uncond, args.steps, batch_cfg)
+            err = (out - ref).abs().max().item()
+            got = (cache.hits, cache.misses)
+            name = f"{mode} threshold={threshold:g}"
+            print(f"{name:>32} {got[0]:>5} {got[1]:>6} {err:>10.2e}")
+            if got != (2 * expected[0], 2 * expected[1]):
+                failed.append(f"{name}: hits/misses {got}, expected "
+                              f"{(2 * expected[0], 2 * expected[1])}")
+            if threshold == 0. and err != 0.:
+                failed.append(f"{name}: max abs diff {err:.2e}, expected exact")
+
+            if offloader is not None:
+                resident = out
+                cache.reset()
+                for _ in range(2):
+                    out = _sample(model, latent, cond, uncond, args.steps,
+                                  batch_cfg, offloader)
+                err = (out - resident).abs().max().item()
+                streamed = (cache.hits, cache.misses)
+                name = f"{name} streamed"
+                print(f"{name:>32} {streamed[0]:>5} {streamed[1]:>6} {err:>10.2e}")
+                if streamed != got or err != 0.:
+                    failed.append(f"{name}: hits/misses {streamed}, max abs diff "
+                                  f"{err:.2e}, expected {got} and exact")
+        model.disable_step_cache()
+
+    if failed:
+        print("\n".join(failed))
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
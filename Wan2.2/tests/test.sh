@@ -18,6 +18,26 @@ cd "$REPO_ROOT" || exit 1
 PY_FILE=./generate.py
 
 
+function sequence_parallel() {
+    # tiny random-weight DiT, no checkpoints needed
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> sequence parallel gloo/CPU vs. single process: "
+    python tests/check_sequence_parallel.py --world_size $GPUS --num_heads $((2 * GPUS)) --backend gloo --device cpu
+
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> sequence parallel nccl/GPU vs. single process: "
+    python tests/check_sequence_parallel.py --world_size $GPUS --num_heads $((2 * GPUS)) --backend nccl --device cuda
+}
+
+
+function step_cache() {
+    # tiny random-weight DiT, no checkpoints needed
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> step cache vs. uncached sampling: "
+    python tests/check_step_cache.py --device cpu
+
+    echo -e "\n\n>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> step cache with streamed blocks vs. resident: "
+    python tests/check_step_cache.py --device cuda --block_offload 2
+}
+
+
 function t2v_A14B() {
     CKPT_DIR="$MODEL_DIR/Wan2.2-T2V-A14B"
 
@@ -86,6 +106,8 @@ function ti2v_5B() {
 
 }
 
+sequence_parallel
+step_cache
 t2v_A14B
 i2v_A14B
 ti2v_5B
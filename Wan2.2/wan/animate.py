@@ -365,17 +365,13 @@ class WanAnimate:
 
         cond_images, face_images, refer_images = self.prepare_source(src_pose_path=src_pose_path, src_face_path=src_face_path, src_ref_path=src_ref_path)
         
-        if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
-            if offload_model:
-                self.text_encoder.model.cpu()
-        else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
-            context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+        # cached per prompt: hits skip the encoder and its device transfer
+        context_all = self.text_encoder.encode(
+            [input_prompt, n_prompt],
+            self.device,
+            encode_device=torch.device('cpu') if self.t5_cpu else self.device,
+            offload=offload_model)
+        context, context_null = context_all[:-1], context_all[-1:]
 
         real_frame_len = len(cond_images)
         target_len = self.get_valid_len(real_frame_len, clip_len, overlap=refert_num)
@@ -2,63 +2,27 @@
 import torch
 import torch.cuda.amp as amp
 
-from ..modules.model import sinusoidal_embedding_1d
+from ..modules.model import rope_apply as _rope_apply
+from ..modules.model import TextContext, rope_table
 from .ulysses import distributed_attention
 from .util import gather_forward, get_rank, get_world_size
 
 
-def pad_freqs(original_tensor, target_len):
-    seq_len, s1, s2 = original_tensor.shape
-    pad_size = target_len - seq_len
-    padding_tensor = torch.ones(
-        pad_size,
-        s1,
-        s2,
-        dtype=original_tensor.dtype,
-        device=original_tensor.device)
-    padded_tensor = torch.cat([original_tensor, padding_tensor], dim=0)
-    return padded_tensor
-
-
 @torch.amp.autocast('cuda', enabled=False)
 def rope_apply(x, grid_sizes, freqs):
     """
     x:          [B, L, N, C].
     grid_sizes: [B, 3].
-    freqs:      [M, C // 2].
+    freqs:      [M, C // 2], or this rank's (cos, sin) slice of `rope_table`.
     """
-    s, n, c = x.size(1), x.size(2), x.size(3) // 2
-    # split freqs
-    freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
-
-    # loop over samples
-    output = []
-    for i, (f, h, w) in enumerate(grid_sizes.tolist()):
-        seq_len = f * h * w
-
-        # precompute multipliers
-        x_i = torch.view_as_complex(x[i, :s].to(torch.float64).reshape(
-            s, n, -1, 2))
-        freqs_i = torch.cat([
-            freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
-            freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
-            freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
-        ],
-                            dim=-1).reshape(seq_len, 1, -1)
-
-        # apply rotary embedding
+    if not isinstance(freqs, tuple):
+        s = x.size(1)
         sp_size = get_world_size()
         sp_rank = get_rank()
-        freqs_i = pad_freqs(freqs_i, s * sp_size)
-        s_per_rank = s
-        freqs_i_rank = freqs_i[(sp_rank * s_per_rank):((sp_rank + 1) *
-                                                       s_per_rank), :, :]
-        x_i = torch.view_as_real(x_i * freqs_i_rank).flatten(2)
-        x_i = torch.cat([x_i, x[i, s:]])
-
-        # append to collection
-        output.append(x_i)
-    return torch.stack(output).float()
+        freqs = tuple(
+            u[:, (sp_rank * s):((sp_rank + 1) * s)]
+            for u in rope_table(freqs, grid_sizes, s * sp_size))
+    return _rope_apply(x, grid_sizes, freqs)
 
 
 def sp_dit_forward(
@@ -96,37 +60,28 @@ def sp_dit_forward(
         for u in x
     ])
 
-    # time embeddings
-    if t.dim() == 1:
-        t = t.expand(t.size(0), seq_len)
-    with torch.amp.autocast('cuda', dtype=torch.float32):
-        bt = t.size(0)
-        t = t.flatten()
-        e = self.time_embedding(
-            sinusoidal_embedding_1d(self.freq_dim,
-                                    t).unflatten(0, (bt, seq_len)).float())
-        e0 = self.time_projection(e).unflatten(2, (6, self.dim))
-        assert e.dtype == torch.float32 and e0.dtype == torch.float32
+    # time embeddings, per token so they can be chunked across ranks
+    e, e0 = self.embed_timesteps(t, seq_len, compact=False)
 
     # context
     context_lens = None
-    context = self.text_embedding(
-        torch.stack([
-            torch.cat([u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
-            for u in context
-        ]))
+    if not isinstance(context, TextContext):
+        context = self.prepare_context(context)
 
     # Context Parallel
     x = torch.chunk(x, get_world_size(), dim=1)[get_rank()]
     e = torch.chunk(e, get_world_size(), dim=1)[get_rank()]
     e0 = torch.chunk(e0, get_world_size(), dim=1)[get_rank()]
+    freqs = tuple(
+        torch.chunk(u, get_world_size(), dim=1)[get_rank()]
+        for u in self.rope_table(grid_sizes, seq_len))
 
     # arguments
     kwargs = dict(
         e=e0,
         seq_lens=seq_lens,
         grid_sizes=grid_sizes,
-        freqs=self.freqs,
+        freqs=freqs,
         context=context,
         context_lens=context_lens)
 
@@ -149,7 +104,10 @@ def sp_attn_forward(self, x, seq_lens, grid_sizes, freqs, dtype=torch.bfloat16):
     half_dtypes = (torch.float16, torch.bfloat16)
 
     def half(x):
-        return x if x.dtype in half_dtypes else x.to(dtype)
+        # CPU attention runs in the input dtype, as in `WanSelfAttention`
+        if x.dtype in half_dtypes or x.device.type != 'cuda':
+            return x
+        return x.to(dtype)
 
     # query, key, value function
     def qkv_fn(x):
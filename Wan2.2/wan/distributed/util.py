@@ -3,11 +3,25 @@ import torch
 import torch.distributed as dist
 
 
-def init_distributed_group():
+def default_backend():
+    r"""
+    NCCL when CUDA is usable, gloo (CPU) otherwise.
+    """
+    if torch.cuda.is_available() and dist.is_nccl_available():
+        return 'nccl'
+    return 'gloo'
+
+
+def init_distributed_group(backend=None):
     """r initialize sequence parallel group.
+
+    Args:
+        backend (`str`, *optional*, defaults to None):
+            'nccl' or 'gloo', `default_backend()` if None. Ignored if the
+            default process group already exists.
     """
     if not dist.is_initialized():
-        dist.init_process_group(backend='nccl')
+        dist.init_process_group(backend=backend or default_backend())
 
 
 def get_rank():
@@ -18,26 +32,41 @@ def get_world_size():
     return dist.get_world_size()
 
 
+def _comm_device(tensor, group=None):
+    r"""
+    Device the collectives of `group` run on. Gloo only handles host tensors,
+    so device tensors are staged through the CPU.
+    """
+    if dist.get_backend(group) == 'gloo':
+        return torch.device('cpu')
+    return tensor.device
+
+
 def all_to_all(x, scatter_dim, gather_dim, group=None, **kwargs):
     """
     `scatter` along one dimension and `gather` along another.
     """
-    world_size = get_world_size()
+    world_size = dist.get_world_size(group)
     if world_size > 1:
-        inputs = [u.contiguous() for u in x.chunk(world_size, dim=scatter_dim)]
-        outputs = [torch.empty_like(u) for u in inputs]
-        dist.all_to_all(outputs, inputs, group=group, **kwargs)
-        x = torch.cat(outputs, dim=gather_dim).contiguous()
+        device = _comm_device(x, group)
+        # one contiguous [world_size, ...] buffer, split evenly along dim 0 by
+        # `all_to_all_single`, which every backend implements
+        inputs = torch.stack(x.chunk(world_size, dim=scatter_dim)).to(device)
+        outputs = torch.empty_like(inputs)
+        dist.all_to_all_single(outputs, inputs, group=group, **kwargs)
+        x = torch.cat(outputs.to(x.device).unbind(0), dim=gather_dim)
     return x
 
 
-def all_gather(tensor):
-    world_size = dist.get_world_size()
+def all_gather(tensor, group=None):
+    world_size = dist.get_world_size(group)
     if world_size == 1:
         return [tensor]
-    tensor_list = [torch.empty_like(tensor) for _ in range(world_size)]
-    torch.distributed.all_gather(tensor_list, tensor)
-    return tensor_list
+    device = _comm_device(tensor, group)
+    staged = tensor.contiguous().to(device)
+    tensor_list = [torch.empty_like(staged) for _ in range(world_size)]
+    dist.all_gather(tensor_list, staged, group=group)
+    return [u.to(tensor.device) for u in tensor_list]
 
 
 def gather_forward(input, dim):
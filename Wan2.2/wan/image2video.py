@@ -28,6 +28,7 @@ from .utils.fm_solvers import (
     retrieve_timesteps,
 )
 from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.offload import ExpertResidency
 
 
 class WanI2V:
@@ -44,6 +45,7 @@ class WanI2V:
         t5_cpu=False,
         init_on_cpu=True,
         convert_model_dtype=False,
+        expert_residency='auto',
     ):
         r"""
         Initializes the image-to-video generation model components.
@@ -70,6 +72,10 @@ class WanI2V:
             convert_model_dtype (`bool`, *optional*, defaults to False):
                 Convert DiT model parameters dtype to 'config.param_dtype'.
                 Only works without FSDP.
+            expert_residency (`str`, *optional*, defaults to 'auto'):
+                How the high/low noise experts share the GPU: 'resident' keeps
+                both loaded, 'swap' keeps one at a time, 'auto' keeps both while
+                enough memory is left. See `ExpertResidency`.
         """
         self.device = torch.device(f"cuda:{device_id}")
         self.config = config
@@ -118,6 +124,14 @@ class WanI2V:
             dit_fsdp=dit_fsdp,
             shard_fn=shard_fn,
             convert_model_dtype=convert_model_dtype)
+        self.residency = ExpertResidency(
+            {
+                'high_noise_model': self.high_noise_model,
+                'low_noise_model': self.low_noise_model,
+            },
+            self.device,
+            policy=expert_residency,
+            pin=not dit_fsdp)
         if use_sp:
             self.sp_size = get_world_size()
         else:
@@ -169,7 +183,11 @@ class WanI2V:
 
         return model
 
-    def _prepare_model_for_timestep(self, t, boundary, offload_model):
+    def _prepare_model_for_timestep(self,
+                                    t,
+                                    boundary,
+                                    offload_model,
+                                    t_next=None):
         r"""
         Prepares and returns the required model for the current timestep.
 
@@ -180,28 +198,21 @@ class WanI2V:
                 The timestep threshold. If `t` is at or above this value,
                 the `high_noise_model` is considered as the required model.
             offload_model (`bool`):
-                A flag intended to control the offloading behavior.
+                Unused, expert placement is handled by `self.residency`.
+            t_next (torch.Tensor, *optional*, defaults to None):
+                Next timestep. On the last high noise step the low noise
+                model is prefetched so the switch does not stall.
 
         Returns:
             torch.nn.Module:
                 The active model on the target device for the current timestep.
         """
         if t.item() >= boundary:
-            required_model_name = 'high_noise_model'
-            offload_model_name = 'low_noise_model'
-        else:
-            required_model_name = 'low_noise_model'
-            offload_model_name = 'high_noise_model'
-        if offload_model or self.init_on_cpu:
-            if next(getattr(
-                    self,
-                    offload_model_name).parameters()).device.type == 'cuda':
-                getattr(self, offload_model_name).to('cpu')
-            if next(getattr(
-                    self,
-                    required_model_name).parameters()).device.type == 'cpu':
-                getattr(self, required_model_name).to(self.device)
-        return getattr(self, required_model_name)
+            model = self.residency.acquire('high_noise_model')
+            if t_next is not None and t_next.item() < boundary:
+                self.residency.prefetch('low_noise_model')
+            return model
+        return self.residency.acquire('low_noise_model')
 
     def generate(self,
                  input_prompt,
@@ -299,17 +310,13 @@ class WanI2V:
             n_prompt = self.sample_neg_prompt
 
         # preprocess
-        if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
-            if offload_model:
-                self.text_encoder.model.cpu()
-        else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
-            context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+        # cached per prompt: hits skip the encoder and its device transfer
+        context_all = self.text_encoder.encode(
+            [input_prompt, n_prompt],
+            self.device,
+            encode_device=torch.device('cpu') if self.t5_cpu else self.device,
+            offload=offload_model)
+        context, context_null = context_all[:-1], context_all[-1:]
 
         y = self.vae.encode([
             torch.concat([
@@ -379,14 +386,15 @@ class WanI2V:
             if offload_model:
                 torch.cuda.empty_cache()
 
-            for _, t in enumerate(tqdm(timesteps)):
+            for i, t in enumerate(tqdm(timesteps)):
                 latent_model_input = [latent.to(self.device)]
                 timestep = [t]
 
                 timestep = torch.stack(timestep).to(self.device)
 
                 model = self._prepare_model_for_timestep(
-                    t, boundary, offload_model)
+                    t, boundary, offload_model,
+                    timesteps[i + 1] if i + 1 < len(timesteps) else None)
                 sample_guide_scale = guide_scale[1] if t.item(
                 ) >= boundary else guide_scale[0]
 
@@ -412,9 +420,8 @@ class WanI2V:
                 x0 = [latent]
                 del latent_model_input, timestep
 
+            self.residency.release(offload_model)
             if offload_model:
-                self.low_noise_model.cpu()
-                self.high_noise_model.cpu()
                 torch.cuda.empty_cache()
 
             if self.rank == 0:
@@ -1,5 +1,13 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import functools
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
 import torch
+import torch.nn.functional as F
 
 try:
     import flash_attn_interface
@@ -13,13 +21,463 @@ try:
 except ModuleNotFoundError:
     FLASH_ATTN_2_AVAILABLE = False
 
-import warnings
-
 __all__ = [
     'flash_attention',
     'attention',
+    'AttentionBackend',
+    'register_attention_backend',
+    'available_attention_backends',
+    'set_attention_backend',
+    'set_attention_timing',
+    'attention_stats',
 ]
 
+# 'auto': first usable backend by priority; 'autotune': time every usable
+# backend once per shape and keep the fastest; otherwise a backend name
+WAN_ATTN_BACKEND = os.getenv('WAN_ATTN_BACKEND', 'auto')
+# synchronize around every call and record per-backend wall time
+WAN_ATTN_TIMING = os.getenv('WAN_ATTN_TIMING', '0') == '1'
+# query rows per tile of the chunked backend
+WAN_ATTN_CHUNK = int(os.getenv('WAN_ATTN_CHUNK', '1024'))
+
+HALF_DTYPES = (torch.float16, torch.bfloat16)
+
+
+class AttentionBackend:
+    r"""
+    One attention implementation in the registry.
+
+    Args:
+        name (`str`):
+            Registry name, also accepted by `WAN_ATTN_BACKEND`.
+        fn (`callable`):
+            `fn(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, causal,
+            window_size, deterministic, dtype)` on padded [B, L, N, C] inputs,
+            returning [B, Lq, Nq, C2]. Rows past `q_lens` must be zero.
+        priority (`int`):
+            Higher priorities are preferred in 'auto' mode.
+        probe (`callable`, *optional*):
+            Returns whether the backend can run in this process at all.
+            Evaluated once.
+        supports (`callable`, *optional*):
+            `supports(q, dropout_p, window_size)` for a single call.
+    """
+
+    def __init__(self, name, fn, priority, probe=None, supports=None):
+        self.name = name
+        self.fn = fn
+        self.priority = priority
+        self._probe = probe
+        self._supports = supports
+
+    @functools.cached_property
+    def available(self):
+        try:
+            return self._probe is None or bool(self._probe())
+        except Exception as e:
+            logging.warning(f'attention backend {self.name} probe failed: {e}')
+            return False
+
+    def supports(self, q, dropout_p, window_size):
+        return self.available and (self._supports is None or
+                                   self._supports(q, dropout_p, window_size))
+
+
+_BACKENDS = {}
+_LOCK = threading.Lock()
+_STATS = defaultdict(lambda: {'calls': 0, 'timed_calls': 0, 'time_s': 0.0})
+_TUNED = {}
+_WARNED = set()
+_STATE = {'backend': WAN_ATTN_BACKEND, 'timing': WAN_ATTN_TIMING}
+
+
+def register_attention_backend(name, priority, probe=None, supports=None):
+    r"""
+    Decorator registering `fn` as attention backend `name`, see `AttentionBackend`.
+    """
+
+    def wrap(fn):
+        _BACKENDS[name] = AttentionBackend(name, fn, priority, probe, supports)
+        _TUNED.clear()
+        return fn
+
+    return wrap
+
+
+def available_attention_backends():
+    r"""
+    Names of the backends that passed their capability probe, best first.
+    """
+    return [
+        b.name for b in sorted(
+            _BACKENDS.values(), key=lambda b: -b.priority) if b.available
+    ]
+
+
+def set_attention_backend(name):
+    r"""
+    Overrides `WAN_ATTN_BACKEND` at runtime ('auto', 'autotune' or a backend name).
+    """
+    assert name in ('auto', 'autotune') or name in _BACKENDS, \
+        f'Unsupported attention backend: {name}'
+    with _LOCK:
+        _STATE['backend'] = name
+        _TUNED.clear()
+        _WARNED.clear()
+
+
+def set_attention_timing(enabled=True):
+    r"""
+    Enables per-call timing (adds a device synchronization around each call).
+    """
+    _STATE['timing'] = enabled
+
+
+def attention_stats(reset=False):
+    r"""
+    Per-backend call counts and, with timing enabled, wall time per call.
+    The 'autotune' entry maps each tuned shape to the backend chosen for it.
+    """
+    with _LOCK:
+        stats = {
+            name: {
+                'calls': s['calls'],
+                'timed_calls': s['timed_calls'],
+                'avg_ms': round(1000 * s['time_s'] / s['timed_calls'], 3)
+                          if s['timed_calls'] else None,
+            } for name, s in _STATS.items()
+        }
+        stats['autotune'] = {str(k): v for k, v in _TUNED.items()}
+        if reset:
+            _STATS.clear()
+    return stats
+
+
+# ---- shared helpers ----
+
+
+def _half(x, dtype):
+    return x if x.dtype in HALF_DTYPES else x.to(dtype)
+
+
+def _cu_seqlens(lens, device):
+    return torch.cat([lens.new_zeros([1]), lens]).cumsum(
+        0, dtype=torch.int32).to(device, non_blocking=True)
+
+
+def _zero_padded_rows(x, q_lens):
+    if q_lens is None:
+        return x
+    keep = torch.arange(x.size(1), device=x.device)[None] < q_lens.to(
+        x.device).view(-1, 1)
+    # masked_fill: fully masked padding rows may hold NaN
+    return x.masked_fill(~keep[:, :, None, None], 0)
+
+
+def _attn_mask(k_lens, b, lq, lk, causal, window_size, device, start=0,
+               end=None):
+    r"""
+    Boolean keep-mask for query rows [start, end), shape [B, 1, rows, Lk]
+    (or [B, 1, 1, Lk] for key padding only), None if nothing is masked.
+    Causal and window offsets are aligned bottom-right, as in flash-attn.
+    """
+    end = lq if end is None else end
+    mask = None
+    if k_lens is not None:
+        mask = (torch.arange(lk, device=device)[None] <
+                k_lens.to(device).view(-1, 1)).view(b, 1, 1, lk)
+    left, right = window_size
+    if causal or left >= 0 or right >= 0:
+        i = torch.arange(start, end, device=device).view(-1, 1) + (lk - lq)
+        j = torch.arange(lk, device=device).view(1, -1)
+        band = torch.ones(end - start, lk, dtype=torch.bool, device=device)
+        if causal:
+            band &= j <= i
+        if left >= 0:
+            band &= j >= i - left
+        if right >= 0:
+            band &= j <= i + right
+        band = band.view(1, 1, end - start, lk)
+        mask = band if mask is None else mask & band
+    return mask
+
+
+def _expand_kv_heads(q, k, v):
+    # [B, N, L, C] layout; grouped-query attention shares each k/v head
+    if k.size(1) != q.size(1):
+        k = k.repeat_interleave(q.size(1) // k.size(1), dim=1)
+        v = v.repeat_interleave(q.size(1) // v.size(1), dim=1)
+    return k, v
+
+
+def _flash_varlen(func, q, k, v, q_lens, k_lens, dtype, **kwargs):
+    b, lq, lk = q.size(0), q.size(1), k.size(1)
+
+    # preprocess query
+    if q_lens is None:
+        packed_q = _half(q.flatten(0, 1), dtype)
+        q_lens = torch.tensor([lq] * b, dtype=torch.int32).to(
+            device=q.device, non_blocking=True)
+        unpad = None
+    else:
+        packed_q = _half(torch.cat([u[:n] for u, n in zip(q, q_lens)]), dtype)
+        unpad = q_lens
+
+    # preprocess key, value
+    if k_lens is None:
+        k = _half(k.flatten(0, 1), dtype)
+        v = _half(v.flatten(0, 1), dtype)
+        k_lens = torch.tensor([lk] * b, dtype=torch.int32).to(
+            device=k.device, non_blocking=True)
+    else:
+        k = _half(torch.cat([u[:n] for u, n in zip(k, k_lens)]), dtype)
+        v = _half(torch.cat([u[:n] for u, n in zip(v, k_lens)]), dtype)
+
+    x = func(
+        q=packed_q.to(v.dtype),
+        k=k.to(v.dtype),
+        v=v,
+        cu_seqlens_q=_cu_seqlens(q_lens, q.device),
+        cu_seqlens_k=_cu_seqlens(k_lens, q.device),
+        max_seqlen_q=lq,
+        max_seqlen_k=lk,
+        **kwargs)
+    if isinstance(x, tuple):
+        x = x[0]
+
+    # restore the padded [B, Lq] layout
+    if unpad is None:
+        return x.unflatten(0, (b, lq))
+    out = x.new_zeros(b, lq, *x.shape[1:])
+    for i, u in enumerate(x.split(unpad.tolist())):
+        out[i, :u.size(0)] = u
+    return out
+
+
+def _cuda_capability(major):
+    return torch.cuda.is_available() and torch.cuda.get_device_capability(
+    )[0] >= major
+
+
+def _flash_supports(q, dropout_p, window_size):
+    return q.device.type == 'cuda' and q.size(-1) <= 256
+
+
+# ---- backends ----
+
+
+@register_attention_backend(
+    'fa3',
+    priority=40,
+    probe=lambda: FLASH_ATTN_3_AVAILABLE and _cuda_capability(9),
+    supports=lambda q, dropout_p, window_size: _flash_supports(
+        q, dropout_p, window_size) and dropout_p == 0 and tuple(window_size) ==
+    (-1, -1))
+def _fa3(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, causal,
+         window_size, deterministic, dtype):
+    # Note: dropout_p, window_size are not supported in FA3 now.
+    return _flash_varlen(
+        flash_attn_interface.flash_attn_varlen_func,
+        q,
+        k,
+        v,
+        q_lens,
+        k_lens,
+        dtype,
+        seqused_q=None,
+        seqused_k=None,
+        softmax_scale=softmax_scale,
+        causal=causal,
+        deterministic=deterministic)
+
+
+@register_attention_backend(
+    'fa2',
+    priority=30,
+    probe=lambda: FLASH_ATTN_2_AVAILABLE and _cuda_capability(8),
+    supports=_flash_supports)
+def _fa2(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, causal,
+         window_size, deterministic, dtype):
+    return _flash_varlen(
+        flash_attn.flash_attn_varlen_func,
+        q,
+        k,
+        v,
+        q_lens,
+        k_lens,
+        dtype,
+        dropout_p=dropout_p,
+        softmax_scale=softmax_scale,
+        causal=causal,
+        window_size=window_size,
+        deterministic=deterministic)
+
+
+@register_attention_backend(
+    'sdpa',
+    priority=20,
+    probe=lambda: hasattr(F, 'scaled_dot_product_attention'))
+def _sdpa(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, causal,
+          window_size, deterministic, dtype):
+    r"""
+    PyTorch SDPA. Without a padding/window mask it can dispatch to the flash
+    kernel, with one it uses the memory-efficient kernel (math on CPU). On CPU
+    the inputs keep their dtype instead of being cast to `dtype`.
+    """
+    b, lq, lk = q.size(0), q.size(1), k.size(1)
+    if q.device.type == 'cuda':
+        q, k, v = (_half(u, dtype) for u in (q, k, v))
+    q, k = q.to(v.dtype), k.to(v.dtype)
+
+    plain_causal = causal and lq == lk and tuple(window_size) == (-1, -1)
+    mask = _attn_mask(k_lens, b, lq, lk, causal and not plain_causal,
+                      window_size, q.device)
+    q, k, v = (u.transpose(1, 2) for u in (q, k, v))
+    k, v = _expand_kv_heads(q, k, v)
+    x = F.scaled_dot_product_attention(
+        q,
+        k,
+        v,
+        attn_mask=mask,
+        dropout_p=dropout_p,
+        is_causal=plain_causal and mask is None,
+        scale=softmax_scale)
+    return _zero_padded_rows(x.transpose(1, 2), q_lens)
+
+
+@register_attention_backend('chunked', priority=10)
+def _chunked(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, causal,
+             window_size, deterministic, dtype):
+    r"""
+    Tiled float32 attention over WAN_ATTN_CHUNK query rows at a time, so peak
+    memory is O(chunk * Lk) instead of O(Lq * Lk). Runs on any device.
+    """
+    b, lq, lk = q.size(0), q.size(1), k.size(1)
+    scale = softmax_scale if softmax_scale is not None else q.size(-1)**-0.5
+    q, k, v = (u.float().transpose(1, 2) for u in (q, k, v))
+    k, v = _expand_kv_heads(q, k, v)
+    kt = k.transpose(-1, -2)
+
+    out = q.new_empty(*q.shape[:3], v.size(-1))
+    for start in range(0, lq, WAN_ATTN_CHUNK):
+        end = min(start + WAN_ATTN_CHUNK, lq)
+        attn = torch.matmul(q[:, :, start:end] * scale, kt)
+        mask = _attn_mask(k_lens, b, lq, lk, causal, window_size, q.device,
+                          start, end)
+        if mask is not None:
+            attn = attn.masked_fill(~mask, float('-inf'))
+        attn = attn.softmax(dim=-1)
+        if dropout_p > 0:
+            attn = F.dropout(attn, dropout_p)
+        out[:, :, start:end] = torch.matmul(attn, v)
+    return _zero_padded_rows(out.transpose(1, 2), q_lens)
+
+
+# ---- dispatch ----
+
+
+def _shape_key(q, k, q_lens, k_lens, causal, window_size):
+    return (q.device.type, str(q.dtype), *q.shape, k.size(1), k.size(2),
+            q_lens is not None, k_lens is not None, causal, tuple(window_size))
+
+
+def _candidates(q, dropout_p, window_size, version):
+    usable = sorted([
+        b for b in _BACKENDS.values() if b.supports(q, dropout_p, window_size)
+    ],
+                    key=lambda b: -b.priority)
+    if version is not None:
+        # explicit flash-attn version requested by the caller
+        preferred = [b for b in usable if b.name == f'fa{version}']
+        if not preferred and version == 3:
+            logging.warning(
+                'Flash attention 3 is not available, use flash attention 2 instead.'
+            )
+        usable = preferred + [b for b in usable if b not in preferred]
+    return usable
+
+
+def _timed(backend, args):
+    sync = args[0].device.type == 'cuda'
+    if sync:
+        torch.cuda.synchronize(args[0].device)
+    t0 = time.perf_counter()
+    x = backend.fn(*args)
+    if sync:
+        torch.cuda.synchronize(args[0].device)
+    return x, time.perf_counter() - t0
+
+
+def _autotune(key, usable, args):
+    # second call of each backend is timed (the first may compile kernels)
+    best, best_s, best_x = None, float('inf'), None
+    failures, last_error = [], None
+    for backend in usable:
+        try:
+            backend.fn(*args)
+            x, dt = _timed(backend, args)
+        except Exception as e:
+            logging.warning(f'attention backend {backend.name} failed: {e}')
+            failures.append(f'{backend.name}: {e!r}')
+            last_error = e
+            continue
+        if dt < best_s:
+            best, best_s, best_x = backend, dt, x
+    if best is None:
+        raise RuntimeError(f'attention autotune {key}: every backend failed ('
+                           + '; '.join(failures) + ')') from last_error
+    with _LOCK:
+        _TUNED[key] = best.name
+    logging.info(f'attention autotune {key}: {best.name} ({best_s * 1e3:.2f} ms)')
+    return best, best_x
+
+
+def _dispatch(q, k, v, q_lens, k_lens, dropout_p, softmax_scale, q_scale,
+              causal, window_size, deterministic, dtype, version):
+    out_dtype = q.dtype
+    if q_scale is not None:
+        q = q * q_scale
+    usable = _candidates(q, dropout_p, window_size, version)
+    assert usable, 'no attention backend available'
+    args = (q, k, v, q_lens, k_lens, dropout_p, softmax_scale, causal,
+            window_size, deterministic, dtype)
+
+    mode = _STATE['backend']
+    backend, x = usable[0], None
+    if mode == 'autotune':
+        key = _shape_key(q, k, q_lens, k_lens, causal, window_size)
+        name = _TUNED.get(key)
+        if name is None:
+            backend, x = _autotune(key, usable, args)
+        else:
+            backend = _BACKENDS[name]
+    elif mode != 'auto' and version is None:
+        forced = [b for b in usable if b.name == mode]
+        if forced:
+            backend = forced[0]
+        elif (mode, q.dtype, q.device.type) not in _WARNED:
+            # once per dtype and device, not on every call
+            _WARNED.add((mode, q.dtype, q.device.type))
+            logging.warning(
+                f'attention backend {mode} is not usable for {q.dtype} inputs on '
+                f'{q.device.type} (dropout={dropout_p}, window={window_size}), '
+                f'using {backend.name} instead.')
+
+    if x is None:
+        if _STATE['timing']:
+            x, dt = _timed(backend, args)
+        else:
+            x, dt = backend.fn(*args), None
+        with _LOCK:
+            s = _STATS[backend.name]
+            s['calls'] += 1
+            if dt is not None:
+                s['timed_calls'] += 1
+                s['time_s'] += dt
+
+    # output
+    return x.type(out_dtype)
+
 
 def flash_attention(
     q,
@@ -48,86 +506,12 @@ def flash_attention(
     window_size:    (left right). If not (-1, -1), apply sliding window local attention.
     deterministic:  bool. If True, slightly slower and uses more memory.
     dtype:          torch.dtype. Apply when dtype of q/k/v is not float16/bfloat16.
+    version:        int. Prefer flash-attn 2 or 3; other backends are used if it is unavailable.
     """
-    half_dtypes = (torch.float16, torch.bfloat16)
-    assert dtype in half_dtypes
-    assert q.device.type == 'cuda' and q.size(-1) <= 256
-
-    # params
-    b, lq, lk, out_dtype = q.size(0), q.size(1), k.size(1), q.dtype
-
-    def half(x):
-        return x if x.dtype in half_dtypes else x.to(dtype)
-
-    # preprocess query
-    if q_lens is None:
-        q = half(q.flatten(0, 1))
-        q_lens = torch.tensor(
-            [lq] * b, dtype=torch.int32).to(
-                device=q.device, non_blocking=True)
-    else:
-        q = half(torch.cat([u[:v] for u, v in zip(q, q_lens)]))
-
-    # preprocess key, value
-    if k_lens is None:
-        k = half(k.flatten(0, 1))
-        v = half(v.flatten(0, 1))
-        k_lens = torch.tensor(
-            [lk] * b, dtype=torch.int32).to(
-                device=k.device, non_blocking=True)
-    else:
-        k = half(torch.cat([u[:v] for u, v in zip(k, k_lens)]))
-        v = half(torch.cat([u[:v] for u, v in zip(v, k_lens)]))
-
-    q = q.to(v.dtype)
-    k = k.to(v.dtype)
-
-    if q_scale is not None:
-        q = q * q_scale
-
-    if version is not None and version == 3 and not FLASH_ATTN_3_AVAILABLE:
-        warnings.warn(
-            'Flash attention 3 is not available, use flash attention 2 instead.'
-        )
-
-    # apply attention
-    if (version is None or version == 3) and FLASH_ATTN_3_AVAILABLE:
-        # Note: dropout_p, window_size are not supported in FA3 now.
-        x = flash_attn_interface.flash_attn_varlen_func(
-            q=q,
-            k=k,
-            v=v,
-            cu_seqlens_q=torch.cat([q_lens.new_zeros([1]), q_lens]).cumsum(
-                0, dtype=torch.int32).to(q.device, non_blocking=True),
-            cu_seqlens_k=torch.cat([k_lens.new_zeros([1]), k_lens]).cumsum(
-                0, dtype=torch.int32).to(q.device, non_blocking=True),
-            seqused_q=None,
-            seqused_k=None,
-            max_seqlen_q=lq,
-            max_seqlen_k=lk,
-            softmax_scale=softmax_scale,
-            causal=causal,
-            deterministic=deterministic)[0].unflatten(0, (b, lq))
-    else:
-        assert FLASH_ATTN_2_AVAILABLE
-        x = flash_attn.flash_attn_varlen_func(
-            q=q,
-            k=k,
-            v=v,
-            cu_seqlens_q=torch.cat([q_lens.new_zeros([1]), q_lens]).cumsum(
-                0, dtype=torch.int32).to(q.device, non_blocking=True),
-            cu_seqlens_k=torch.cat([k_lens.new_zeros([1]), k_lens]).cumsum(
-                0, dtype=torch.int32).to(q.device, non_blocking=True),
-            max_seqlen_q=lq,
-            max_seqlen_k=lk,
-            dropout_p=dropout_p,
-            softmax_scale=softmax_scale,
-            causal=causal,
-            window_size=window_size,
-            deterministic=deterministic).unflatten(0, (b, lq))
-
-    # output
-    return x.type(out_dtype)
+    assert dtype in HALF_DTYPES
+    return _dispatch(q, k, v, q_lens, k_lens, dropout_p, softmax_scale,
+                     q_scale, causal, window_size, deterministic, dtype,
+                     version)
 
 
 def attention(
@@ -145,35 +529,18 @@ def attention(
     dtype=torch.bfloat16,
     fa_version=None,
 ):
-    if FLASH_ATTN_2_AVAILABLE or FLASH_ATTN_3_AVAILABLE:
-        return flash_attention(
-            q=q,
-            k=k,
-            v=v,
-            q_lens=q_lens,
-            k_lens=k_lens,
-            dropout_p=dropout_p,
-            softmax_scale=softmax_scale,
-            q_scale=q_scale,
-            causal=causal,
-            window_size=window_size,
-            deterministic=deterministic,
-            dtype=dtype,
-            version=fa_version,
-        )
-    else:
-        if q_lens is not None or k_lens is not None:
-            warnings.warn(
-                'Padding mask is disabled when using scaled_dot_product_attention. It can have a significant impact on performance.'
-            )
-        attn_mask = None
-
-        q = q.transpose(1, 2).to(dtype)
-        k = k.transpose(1, 2).to(dtype)
-        v = v.transpose(1, 2).to(dtype)
-
-        out = torch.nn.functional.scaled_dot_product_attention(
-            q, k, v, attn_mask=attn_mask, is_causal=causal, dropout_p=dropout_p)
-
-        out = out.transpose(1, 2).contiguous()
-        return out
+    return flash_attention(
+        q=q,
+        k=k,
+        v=v,
+        q_lens=q_lens,
+        k_lens=k_lens,
+        dropout_p=dropout_p,
+        softmax_scale=softmax_scale,
+        q_scale=q_scale,
+        causal=causal,
+        window_size=window_size,
+        deterministic=deterministic,
+        dtype=dtype,
+        version=fa_version,
+    )
@@ -1,5 +1,8 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
 import math
+import os
+from contextlib import contextmanager
 
 import torch
 import torch.nn as nn
@@ -7,8 +10,9 @@ from diffusers.configuration_utils import ConfigMixin, register_to_config
 from diffusers.models.modeling_utils import ModelMixin
 
 from .attention import attention as flash_attention
+from .step_cache import StepCache
 
-__all__ = ['WanModel']
+__all__ = ['WanModel', 'TextContext']
 
 
 def sinusoidal_embedding_1d(dim, position):
@@ -35,35 +39,58 @@ def rope_params(max_seq_len, dim, theta=10000):
     return freqs
 
 
-@torch.amp.autocast('cuda', enabled=False)
-def rope_apply(x, grid_sizes, freqs):
-    n, c = x.size(2), x.size(3) // 2
+def rope_table(freqs, grid_sizes, seq_len):
+    r"""
+    Builds the real-valued 3D RoPE table for a batch of grids.
+
+    Args:
+        freqs(Tensor): Complex rope freqs, shape [1024, C / num_heads / 2]
+        grid_sizes(Tensor): Shape [B, 3], the second dimension contains (F, H, W)
+        seq_len(`int`): Padded sequence length
+
+    Returns:
+        Tuple[Tensor, Tensor]: cos / sin tables, each of shape [B, seq_len, 1, C / num_heads / 2]
+        in float32. Padded positions hold the identity rotation.
+    """
+    c = freqs.size(1)
 
     # split freqs
     freqs = freqs.split([c - 2 * (c // 3), c // 3, c // 3], dim=1)
 
-    # loop over samples
-    output = []
-    for i, (f, h, w) in enumerate(grid_sizes.tolist()):
-        seq_len = f * h * w
-
-        # precompute multipliers
-        x_i = torch.view_as_complex(x[i, :seq_len].to(torch.float64).reshape(
-            seq_len, n, -1, 2))
+    tables = []
+    for f, h, w in grid_sizes.tolist():
+        n = f * h * w
         freqs_i = torch.cat([
             freqs[0][:f].view(f, 1, 1, -1).expand(f, h, w, -1),
             freqs[1][:h].view(1, h, 1, -1).expand(f, h, w, -1),
             freqs[2][:w].view(1, 1, w, -1).expand(f, h, w, -1)
         ],
-                            dim=-1).reshape(seq_len, 1, -1)
+                            dim=-1).reshape(n, c)
+        tables.append(torch.cat([freqs_i, freqs_i.new_ones(seq_len - n, c)]))
+    table = torch.stack(tables).unsqueeze(2)
+    return table.real.float().contiguous(), table.imag.float().contiguous()
+
+
+@torch.amp.autocast('cuda', enabled=False)
+def rope_apply(x, grid_sizes, freqs):
+    r"""
+    Applies 3D RoPE to the whole batch at once in float32.
 
-        # apply rotary embedding
-        x_i = torch.view_as_real(x_i * freqs_i).flatten(2)
-        x_i = torch.cat([x_i, x[i, seq_len:]])
+    Args:
+        x(Tensor): Shape [B, L, num_heads, C / num_heads]
+        grid_sizes(Tensor): Shape [B, 3], the second dimension contains (F, H, W)
+        freqs(Tensor | Tuple[Tensor, Tensor]): Either the complex rope freqs of shape
+            [1024, C / num_heads / 2], or a (cos, sin) table from `rope_table` matching x
+    """
+    if not isinstance(freqs, tuple):
+        freqs = rope_table(freqs, grid_sizes, x.size(1))
+    cos, sin = freqs
 
-        # append to collection
-        output.append(x_i)
-    return torch.stack(output).float()
+    # rotate (even, odd) pairs
+    x = x.float().unflatten(3, (-1, 2))
+    x0, x1 = x[..., 0], x[..., 1]
+    return torch.stack([x0 * cos - x1 * sin, x0 * sin + x1 * cos],
+                       dim=-1).flatten(3)
 
 
 class WanRMSNorm(nn.Module):
@@ -129,7 +156,8 @@ class WanSelfAttention(nn.Module):
             x(Tensor): Shape [B, L, num_heads, C / num_heads]
             seq_lens(Tensor): Shape [B]
             grid_sizes(Tensor): Shape [B, 3], the second dimension contains (F, H, W)
-            freqs(Tensor): Rope freqs, shape [1024, C / num_heads / 2]
+            freqs(Tensor | Tuple[Tensor, Tensor]): Rope freqs, shape [1024, C / num_heads / 2],
+                or the precomputed (cos, sin) table from `rope_table`
         """
         b, s, n, d = *x.shape[:2], self.num_heads, self.head_dim
 
@@ -155,21 +183,96 @@ class WanSelfAttention(nn.Module):
         return x
 
 
+class TextContext:
+    r"""
+    Text context projected by `WanModel.prepare_context`, constant for a whole
+    sampling trajectory. The key/value projections of every cross-attention
+    are computed on first use and reused by all later steps.
+
+    Handles are concatenated along the batch with `+` (memoized), like the
+    context lists they replace, so batched CFG can merge its branches.
+    """
+
+    def __init__(self, embedded):
+        self.embedded = embedded
+        self._kv = {}
+        self._cat = {}
+
+    def __len__(self):
+        return self.embedded.size(0)
+
+    def __add__(self, other):
+        if id(other) not in self._cat:
+            self._cat[id(other)] = (other,
+                                    TextContext(
+                                        torch.cat([self.embedded,
+                                                   other.embedded])))
+        return self._cat[id(other)][1]
+
+    @torch.compiler.disable
+    def key_value(self, attn):
+        if attn not in self._kv:
+            self._kv[attn] = attn.key_value(self.embedded)
+        return self._kv[attn]
+
+
+def context_ids(context):
+    r"""
+    Identity of every sample of a context list or `TextContext`, stable for as
+    long as the underlying tensors live.
+    """
+    if isinstance(context, TextContext):
+        return [(context.embedded.data_ptr(), i) for i in range(len(context))]
+    return [(u.data_ptr(), tuple(u.shape)) for u in context]
+
+
+def _is_compile_failure(err):
+    r"""
+    True for dynamo/inductor failures (tracing, lowering, backend compile),
+    which the eager fallback recovers from. Out-of-memory errors, also when
+    raised during compilation, are left to the callers' own fallbacks.
+    """
+    import torch._dynamo.exc
+
+    cause = err
+    while cause is not None:
+        if isinstance(cause, torch.cuda.OutOfMemoryError):
+            return False
+        cause = cause.__cause__ or cause.__context__
+    return isinstance(err, torch._dynamo.exc.TorchDynamoException)
+
+
 class WanCrossAttention(WanSelfAttention):
 
+    def key_value(self, context):
+        r"""
+        Args:
+            context(Tensor): Shape [B, L2, C]
+
+        Returns:
+            Tuple[Tensor, Tensor]: Keys and values, shape [B, L2, num_heads, C / num_heads]
+        """
+        b, n, d = context.size(0), self.num_heads, self.head_dim
+        k = self.norm_k(self.k(context)).view(b, -1, n, d)
+        v = self.v(context).view(b, -1, n, d)
+        return k, v
+
     def forward(self, x, context, context_lens):
         r"""
         Args:
             x(Tensor): Shape [B, L1, C]
-            context(Tensor): Shape [B, L2, C]
+            context(Tensor | TextContext): Shape [B, L2, C], or a handle whose
+                cached keys/values are used
             context_lens(Tensor): Shape [B]
         """
         b, n, d = x.size(0), self.num_heads, self.head_dim
 
         # compute query, key, value
         q = self.norm_q(self.q(x)).view(b, -1, n, d)
-        k = self.norm_k(self.k(context)).view(b, -1, n, d)
-        v = self.v(context).view(b, -1, n, d)
+        if isinstance(context, TextContext):
+            k, v = context.key_value(self)
+        else:
+            k, v = self.key_value(context)
 
         # compute attention
         x = flash_attention(q, k, v, k_lens=context_lens)
@@ -232,7 +335,8 @@ class WanAttentionBlock(nn.Module):
             e(Tensor): Shape [B, L1, 6, C]
             seq_lens(Tensor): Shape [B], length of each sequence in batch
             grid_sizes(Tensor): Shape [B, 3], the second dimension contains (F, H, W)
-            freqs(Tensor): Rope freqs, shape [1024, C / num_heads / 2]
+            freqs(Tensor | Tuple[Tensor, Tensor]): Rope freqs, shape [1024, C / num_heads / 2],
+                or the precomputed (cos, sin) table from `rope_table`
         """
         assert e.dtype == torch.float32
         with torch.amp.autocast('cuda', dtype=torch.float32):
@@ -403,10 +507,177 @@ class WanModel(ModelMixin, ConfigMixin):
             rope_params(1024, 2 * (d // 6))
         ],
                                dim=1)
+        # (grid sizes, seq_len, device) -> (cos, sin), shared by all blocks and steps
+        self._rope_cache = {}
+        # opt-in reuse of the block stack residual across steps
+        self.step_cache = None
+        # set by `ModelOffloader` while it streams the blocks
+        self.block_streamer = None
+        # opt-in torch.compile'd blocks, used for precompiled shapes only
+        self._compiled = None
+        self._compiled_shapes = set()
+        self._precompiling = False
 
         # initialize weights
         self.init_weights()
 
+    def rope_table(self, grid_sizes, seq_len):
+        r"""
+        Cached `rope_table` for the current grids. The table only depends on the
+        latent grid, so it is built once per generation instead of twice per block.
+        """
+        key = (tuple(map(tuple, grid_sizes.tolist())), seq_len, self.freqs.device)
+        table = self._rope_cache.get(key)
+        if table is None:
+            if len(self._rope_cache) >= 8:
+                self._rope_cache.clear()
+            table = self._rope_cache[key] = rope_table(self.freqs, grid_sizes,
+                                                       seq_len)
+        return table
+
+    def enable_step_cache(self, threshold=0.05, warmup=2, max_skip=3):
+        r"""
+        Enables `StepCache` for this model, see there for the arguments.
+        Returns the cache, whose `hits`/`hit_rate` count skipped forwards.
+        """
+        self.step_cache = StepCache(threshold, warmup, max_skip)
+        return self.step_cache
+
+    def disable_step_cache(self):
+        self.step_cache = None
+
+    def enable_compile(self, mode='default', cache_dir=None):
+        r"""
+        Compiles the forward of every block with `torch.compile` (static shapes).
+
+        Compiled blocks are only used for shapes registered through
+        `precompile()`, so a request with an unexpected shape runs eagerly
+        instead of paying for a recompilation. If compilation fails, the model
+        falls back to eager for good.
+
+        Args:
+            mode (`str`, *optional*, defaults to 'default'):
+                `torch.compile` mode, e.g. 'max-autotune-no-cudagraphs', or
+                'reduce-overhead' to also capture CUDA graphs. CUDA graphs
+                replay the weight addresses seen at capture, so the weights
+                must stay resident (no offloading) afterwards.
+            cache_dir (`str`, *optional*, defaults to None):
+                Directory for Inductor's on-disk graph cache, so compiled
+                kernels survive process restarts.
+        """
+        import torch._dynamo
+        import torch._inductor.config
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Inductor reads the variable on every lookup but pins its default
+            # into it on first use, so an explicit directory has to override
+            os.environ['TORCHINDUCTOR_CACHE_DIR'] = os.path.abspath(cache_dir)
+            torch._inductor.config.fx_graph_cache = True
+        # one graph per (batch, seq_len) bucket and block code object
+        torch._dynamo.config.cache_size_limit = max(
+            torch._dynamo.config.cache_size_limit, 64)
+        self._compiled = [
+            torch.compile(block.forward, mode=mode, dynamic=False)
+            for block in self.blocks
+        ]
+        self._compiled_shapes = set()
+
+    def disable_compile(self):
+        self._compiled = None
+        self._compiled_shapes = set()
+
+    @contextmanager
+    def precompile(self):
+        r"""
+        Forwards run inside this context use (and thus compile) the compiled
+        blocks, and register their shapes for later forwards.
+        """
+        self._precompiling = True
+        try:
+            yield
+        finally:
+            self._precompiling = False
+
+    @contextmanager
+    def _block_forwards(self, key):
+        use = self._compiled is not None and (
+            self._precompiling or key in self._compiled_shapes)
+        if use:
+            for block, fn in zip(self.blocks, self._compiled):
+                block.forward = fn
+        try:
+            yield use
+        finally:
+            if use:
+                for block in self.blocks:
+                    del block.forward
+
+    def _run_blocks(self, x, step=None, **kwargs):
+        r"""
+        Runs the block stack, through the step cache if `step` (per-sample
+        branch keys and timesteps) is given.
+        """
+        if step is not None:
+            # the cache reads block 0 before its forward (and pre-hook) runs
+            if self.block_streamer is not None:
+                self.block_streamer.ensure_block(0)
+            return self.step_cache(self.blocks, x, *step, **kwargs)
+        for block in self.blocks:
+            x = block(x, **kwargs)
+        return x
+
+    def prepare_context(self, context):
+        r"""
+        Pads and projects text embeddings once, for reuse across all sampling
+        steps (and the cross-attention K/V cache) of a generation.
+
+        Args:
+            context (List[Tensor]): Text embeddings each with shape [L, C].
+
+        Returns:
+            TextContext: Handle to pass as `context` to `forward`.
+        """
+        return TextContext(
+            self.text_embedding(
+                torch.stack([
+                    torch.cat(
+                        [u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
+                    for u in context
+                ])))
+
+    def embed_timesteps(self, t, seq_len, compact=True):
+        r"""
+        Time embedding and its projection for per-sample or per-token timesteps.
+
+        The embedding MLPs run once per unique timestep value and the result is
+        gathered back through the inverse index, instead of once per token.
+
+        Args:
+            t (Tensor): Timesteps of shape [B] or [B, seq_len].
+            seq_len (`int`): Sequence length.
+            compact (`bool`, *optional*, defaults to True):
+                Return a token dimension of 1 when all tokens of every sample
+                share one timestep; the blocks broadcast it.
+
+        Returns:
+            Tuple[Tensor, Tensor]: `e` [B, L1, C] and `e0` [B, L1, 6, C] in
+            float32, L1 being 1 or `seq_len`.
+        """
+        if t.dim() == 1:
+            t = t.unsqueeze(1)
+        if compact and (t.size(1) == 1 or bool((t == t[:, :1]).all())):
+            t = t[:, :1]
+        else:
+            t = t.expand(t.size(0), seq_len)
+        with torch.amp.autocast('cuda', dtype=torch.float32):
+            values, index = torch.unique(t, return_inverse=True)
+            e = self.time_embedding(
+                sinusoidal_embedding_1d(self.freq_dim, values).float())
+            e0 = self.time_projection(e).unflatten(1, (6, self.dim))
+            assert e.dtype == torch.float32 and e0.dtype == torch.float32
+        return e[index], e0[index]
+
     def forward(
         self,
         x,
@@ -423,8 +694,9 @@ class WanModel(ModelMixin, ConfigMixin):
                 List of input video tensors, each with shape [C_in, F, H, W]
             t (Tensor):
                 Diffusion timesteps tensor of shape [B]
-            context (List[Tensor]):
-                List of text embeddings each with shape [L, C]
+            context (List[Tensor] | TextContext):
+                List of text embeddings each with shape [L, C], or the handle
+                returned by `prepare_context` for them
             seq_len (`int`):
                 Maximum sequence length for positional encoding
             y (List[Tensor], *optional*):
@@ -457,37 +729,40 @@ class WanModel(ModelMixin, ConfigMixin):
         ])
 
         # time embeddings
-        if t.dim() == 1:
-            t = t.expand(t.size(0), seq_len)
-        with torch.amp.autocast('cuda', dtype=torch.float32):
-            bt = t.size(0)
-            t = t.flatten()
-            e = self.time_embedding(
-                sinusoidal_embedding_1d(self.freq_dim,
-                                        t).unflatten(0, (bt, seq_len)).float())
-            e0 = self.time_projection(e).unflatten(2, (6, self.dim))
-            assert e.dtype == torch.float32 and e0.dtype == torch.float32
+        step = None
+        if self.step_cache is not None:
+            step = (list(enumerate(context_ids(context))),
+                    t.reshape(t.size(0), -1).amax(dim=1).tolist())
+        e, e0 = self.embed_timesteps(t, seq_len)
 
         # context
         context_lens = None
-        context = self.text_embedding(
-            torch.stack([
-                torch.cat(
-                    [u, u.new_zeros(self.text_len - u.size(0), u.size(1))])
-                for u in context
-            ]))
+        if not isinstance(context, TextContext):
+            context = self.prepare_context(context)
 
         # arguments
         kwargs = dict(
             e=e0,
             seq_lens=seq_lens,
             grid_sizes=grid_sizes,
-            freqs=self.freqs,
+            freqs=self.rope_table(grid_sizes, seq_len),
             context=context,
             context_lens=context_lens)
 
-        for block in self.blocks:
-            x = block(x, **kwargs)
+        key = (tuple(x.shape), tuple(e0.shape), x.dtype)
+        try:
+            with self._block_forwards(key) as compiled:
+                out = self._run_blocks(x, step, **kwargs)
+        except Exception as err:
+            if not (compiled and _is_compile_failure(err)):
+                raise
+            logging.warning(
+                f'Compiled WanModel blocks failed ({err!r}), falling back to eager.')
+            self.disable_compile()
+            out = self._run_blocks(x, step, **kwargs)
+        if compiled and self._precompiling:
+            self._compiled_shapes.add(key)
+        x = out
 
         # head
         x = self.head(x, e)
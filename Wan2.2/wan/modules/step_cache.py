@@ -0,0 +1,128 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import torch
+
+__all__ = ['StepCache']
+
+
+class _BranchState:
+
+    def __init__(self):
+        self.inp = None
+        self.residual = None
+        self.t = None
+        self.acc = 0.
+        self.steps = 0
+        self.skipped = 0
+
+
+class StepCache:
+    r"""
+    Reuses the residual of the DiT block stack across sampling steps
+    (TeaCache-style).
+
+    The change between two steps is estimated from the time-modulated input of
+    the first block, i.e. `norm1(x) * (1 + scale) + shift`, as the relative L1
+    distance to the previous step. Distances are accumulated while blocks are
+    skipped; once the sum reaches `threshold`, the stack is recomputed and its
+    residual `out - x` cached for the following steps.
+
+    State is kept per sample, keyed by the position in the batch and the
+    context tensor, so the cond and uncond branches (batched or sequential)
+    and the samples of a batch are tracked separately. A sample whose timestep
+    does not decrease starts a new trajectory. Blocks are only skipped when
+    every sample in the batch agrees.
+
+    Args:
+        threshold (`float`, *optional*, defaults to 0.05):
+            Accumulated relative change below which cached residuals are
+            reused. Larger is faster and less accurate; 0 never skips.
+        warmup (`int`, *optional*, defaults to 2):
+            Steps that are always computed at the start of a trajectory.
+        max_skip (`int`, *optional*, defaults to 3):
+            Maximum number of consecutive skipped steps.
+    """
+
+    def __init__(self, threshold=0.05, warmup=2, max_skip=3):
+        self.threshold = threshold
+        self.warmup = warmup
+        self.max_skip = max_skip
+        self.reset()
+
+    def reset(self):
+        self._states = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hit_rate, 4),
+        }
+
+    @staticmethod
+    def _modulated_input(block, x, e):
+        with torch.amp.autocast('cuda', dtype=torch.float32):
+            shift, scale = (block.modulation[:, :2].unsqueeze(0) +
+                            e[:, :, :2]).float().unbind(2)
+            return block.norm1(x).float() * (1 + scale) + shift
+
+    def _change(self, state, inp, t):
+        r"""
+        Accumulated relative change since the last computed step, or None if
+        the cached residual must not be reused.
+        """
+        if state.inp is None or state.inp.shape != inp.shape:
+            return None
+        if t >= state.t or state.steps < self.warmup or state.skipped >= self.max_skip:
+            return None
+        return state.acc + ((inp - state.inp).abs().mean() /
+                            state.inp.abs().mean().clamp_min(1e-8)).item()
+
+    def __call__(self, blocks, x, keys, t, **kwargs):
+        r"""
+        Runs (or skips) the block stack.
+
+        Args:
+            blocks (List[nn.Module]): `WanModel.blocks`.
+            x (Tensor): Block stack input, shape [B, L, C].
+            keys (List[Hashable]): One branch key per sample.
+            t (List[float]): Per-sample timestep.
+            kwargs: Block arguments, `e` being the projected time embedding
+                of shape [B, L1, 6, C].
+
+        Returns:
+            Tensor: Block stack output, shape [B, L, C].
+        """
+        inp = self._modulated_input(blocks[0], x, kwargs['e'])
+        if len(self._states) + len(keys) > 64:
+            self._states = {k: v for k, v in self._states.items() if k in keys}
+        states = [self._states.setdefault(k, _BranchState()) for k in keys]
+        acc = [self._change(s, u, v) for s, u, v in zip(states, inp, t)]
+
+        if all(u is not None and u < self.threshold for u in acc):
+            self.hits += 1
+            for i, s in enumerate(states):
+                s.inp, s.t, s.acc = inp[i], t[i], acc[i]
+                s.skipped += 1
+            return x + torch.stack([s.residual for s in states]).to(x.dtype)
+
+        out = x
+        for block in blocks:
+            out = block(out, **kwargs)
+        # counted and recorded only once the stack ran, so a forward that is
+        # retried after an exception (e.g. the eager compile fallback) counts once
+        self.misses += 1
+        residual = out - x
+        for i, s in enumerate(states):
+            if s.t is not None and t[i] >= s.t:
+                s.steps = 0
+            s.inp, s.residual, s.t = inp[i], residual[i], t[i]
+            s.acc, s.skipped = 0., 0
+            s.steps += 1
+        return out
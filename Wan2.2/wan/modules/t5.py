@@ -1,12 +1,17 @@
 # Modified from transformers.models.t5.modeling_t5
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import hashlib
 import logging
 import math
+import os
+import threading
+from collections import OrderedDict
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from ..utils.offload import ModelOffloader
 from .tokenizers import HuggingfaceTokenizer
 
 __all__ = [
@@ -14,6 +19,7 @@ __all__ = [
     'T5Encoder',
     'T5Decoder',
     'T5EncoderModel',
+    'T5EmbeddingCache',
 ]
 
 
@@ -469,17 +475,104 @@ def umt5_xxl(**kwargs):
     return _t5('umt5-xxl', **cfg)
 
 
+class T5EmbeddingCache:
+    r"""
+    LRU cache of trimmed UMT5 context tensors, keyed by the normalized prompt.
+
+    Entries are held on the CPU. With `cache_dir` set, every entry is also
+    written to disk, so a new process does not re-encode prompts it has seen
+    before (e.g. the default negative prompt).
+
+    Args:
+        capacity (`int`, *optional*, defaults to 64):
+            Maximum number of entries kept in memory.
+        cache_dir (`str`, *optional*, defaults to None):
+            Directory of the on-disk tier. Disabled if None.
+        namespace (`str`, *optional*, defaults to ''):
+            Mixed into the disk keys so different checkpoints / text lengths
+            never share entries.
+    """
+
+    def __init__(self, capacity=64, cache_dir=None, namespace=''):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(
+            f'{self.namespace}\0{key}'.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f'{digest}.pt')
+
+    def _remember(self, key, tensor):
+        self._entries[key] = tensor
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            tensor = self._entries.get(key)
+            if tensor is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return tensor
+        if self.cache_dir is not None and os.path.isfile(self._path(key)):
+            try:
+                tensor = torch.load(self._path(key), map_location='cpu')
+            except Exception as e:
+                logging.warning(f'failed to load cached T5 embedding: {e}')
+            else:
+                with self._lock:
+                    self._remember(key, tensor)
+                    self.hits += 1
+                return tensor
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, tensor):
+        # clone: the trimmed context is a view into the padded encoder output
+        tensor = tensor.detach().to('cpu').clone()
+        with self._lock:
+            self._remember(key, tensor)
+        if self.cache_dir is not None:
+            path = self._path(key)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            try:
+                torch.save(tensor, tmp)
+                os.replace(tmp, path)
+            except OSError as e:
+                logging.warning(f'failed to write cached T5 embedding: {e}')
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
 class T5EncoderModel:
 
     def __init__(
         self,
         text_len,
         dtype=torch.bfloat16,
-        device=torch.cuda.current_device(),
+        device=None,
         checkpoint_path=None,
         tokenizer_path=None,
         shard_fn=None,
+        cache_size=64,
+        cache_dir=None,
+        pin_memory=False,
     ):
+        if device is None:
+            # resolved lazily so importing this module does not need CUDA
+            device = torch.cuda.current_device(
+            ) if torch.cuda.is_available() else torch.device('cpu')
         self.text_len = text_len
         self.dtype = dtype
         self.device = device
@@ -502,6 +595,23 @@ class T5EncoderModel:
         # init tokenizer
         self.tokenizer = HuggingfaceTokenizer(
             name=tokenizer_path, seq_len=text_len, clean='whitespace')
+        # prompt -> context cache
+        self.cache = T5EmbeddingCache(
+            cache_size,
+            cache_dir,
+            namespace=f'{os.path.basename(str(checkpoint_path))}:{text_len}:{dtype}'
+        ) if cache_size > 0 else None
+        # pinned host copy for cheap GPU <-> CPU moves in `encode`
+        self.pin_memory = pin_memory and shard_fn is None
+        self.offloader = None
+
+    def _offloader(self, device):
+        device = torch.device(device)
+        if not self.pin_memory or device.type != 'cuda':
+            return None
+        if self.offloader is None:
+            self.offloader = ModelOffloader(self.model, device)
+        return self.offloader
 
     def __call__(self, texts, device):
         ids, mask = self.tokenizer(
@@ -511,3 +621,47 @@ class T5EncoderModel:
         seq_lens = mask.gt(0).sum(dim=1).long()
         context = self.model(ids, mask)
         return [u[:v] for u, v in zip(context, seq_lens)]
+
+    def encode(self, texts, device, encode_device=None, offload=False):
+        r"""
+        Cached text encoding. Prompts found in `self.cache` are returned without
+        touching the encoder, so the model is only moved to `encode_device`
+        (and back to the CPU if `offload`) when at least one prompt is missing.
+
+        Args:
+            texts (List[str]): Prompts to encode.
+            device (`torch.device`): Device of the returned context tensors.
+            encode_device (`torch.device`, *optional*, defaults to `device`):
+                Device the encoder runs on for cache misses.
+            offload (`bool`, *optional*, defaults to False):
+                Move the encoder back to the CPU after encoding misses.
+
+        Returns:
+            List[Tensor]: Trimmed context tensors [L_i, C], one per prompt.
+        """
+        encode_device = device if encode_device is None else encode_device
+        keys = [self.tokenizer._clean(u) for u in texts]
+        found = {}
+        if self.cache is not None:
+            for k in dict.fromkeys(keys):
+                tensor = self.cache.get(k)
+                if tensor is not None:
+                    found[k] = tensor
+        missing = {k: u for k, u in zip(keys, texts) if k not in found}
+        if missing:
+            offloader = self._offloader(encode_device)
+            if offloader is not None:
+                offloader.load()
+            else:
+                self.model.to(encode_device)
+            context = self(list(missing.values()), encode_device)
+            if offload:
+                if offloader is not None:
+                    offloader.offload()
+                else:
+                    self.model.cpu()
+            for k, u in zip(missing, context):
+                found[k] = u
+                if self.cache is not None:
+                    self.cache.put(k, u)
+        return [found[k].to(device) for k in keys]
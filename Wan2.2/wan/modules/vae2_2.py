@@ -731,6 +731,53 @@ def count_conv3d(model):
     return count
 
 
+def _tile_starts(size, tile, overlap):
+    # start offsets of overlapping tiles covering [0, size); last tile ends at size
+    if size <= tile:
+        return [0]
+    return list(range(0, size - tile, tile - overlap)) + [size - tile]
+
+
+def _blend_weights(start, length, size, overlap, device):
+    # linear ramp on every edge that overlaps a neighbouring tile
+    w = torch.ones(length, device=device)
+    overlap = min(overlap, length)
+    if overlap > 0:
+        ramp = (torch.arange(overlap, device=device) + 0.5) / overlap
+        if start > 0:
+            w[:overlap] = torch.minimum(w[:overlap], ramp)
+        if start + length < size:
+            w[-overlap:] = torch.minimum(w[-overlap:], ramp.flip(0))
+    return w
+
+
+class _TiledCanvas:
+    r"""
+    Accumulates overlapping spatial tiles [B, C, T, h, w] into one
+    [B, C, T, H, W] output, blending seams with linear ramps.
+    """
+
+    def __init__(self, size, overlap):
+        self.size = size
+        self.overlap = overlap
+        self.out = None
+        self.weight = None
+
+    def add(self, tile, top, left):
+        h, w = tile.shape[-2:]
+        if self.out is None:
+            self.out = tile.new_zeros(*tile.shape[:3], *self.size)
+            self.weight = tile.new_zeros(*self.size)
+        mask = _blend_weights(top, h, self.size[0], self.overlap, tile.device)[:, None] * \
+            _blend_weights(left, w, self.size[1], self.overlap, tile.device)[None]
+        mask = mask.to(tile.dtype)
+        self.out[..., top:top + h, left:left + w] += tile * mask
+        self.weight[top:top + h, left:left + w] += mask
+
+    def result(self):
+        return self.out / self.weight
+
+
 class WanVAE_(nn.Module):
 
     def __init__(
@@ -752,6 +799,8 @@ class WanVAE_(nn.Module):
         self.attn_scales = attn_scales
         self.temperal_downsample = temperal_downsample
         self.temperal_upsample = temperal_downsample[::-1]
+        # pixels per latent along H / W (patchify x spatial downsampling)
+        self.spatial_stride = 2 * 2**(len(dim_mult) - 1)
 
         # modules
         self.encoder = Encoder3d(
@@ -780,26 +829,51 @@ class WanVAE_(nn.Module):
         x_recon = self.decode(mu, scale)
         return x_recon, mu
 
-    def encode(self, x, scale):
+    def _tile_grid(self, h, w, tiling):
+        # tiling is (tile_h, tile_w, overlap) in pixels; returns latent-unit tiles
+        st = self.spatial_stride
+        th, tw = max(1, tiling[0] // st), max(1, tiling[1] // st)
+        ov = tiling[2] // st
+        assert ov < min(th, tw), 'tile overlap must be smaller than the tile'
+        return [(top, left, min(th, h), min(tw, w))
+                for top in _tile_starts(h, th, ov)
+                for left in _tile_starts(w, tw, ov)], ov
+
+    def encode(self, x, scale, tiling=None):
+        r"""
+        Args:
+            tiling (`tuple`, *optional*):
+                (tile_h, tile_w, overlap) in pixels. Encodes overlapping spatial
+                tiles, each with its own causal feature cache, and blends them in
+                latent space, so activation memory scales with the tile area.
+        """
         self.clear_cache()
-        x = patchify(x, patch_size=2)
-        t = x.shape[2]
-        iter_ = 1 + (t - 1) // 4
-        for i in range(iter_):
-            self._enc_conv_idx = [0]
-            if i == 0:
-                out = self.encoder(
-                    x[:, :, :1, :, :],
-                    feat_cache=self._enc_feat_map,
-                    feat_idx=self._enc_conv_idx,
-                )
-            else:
-                out_ = self.encoder(
-                    x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
-                    feat_cache=self._enc_feat_map,
-                    feat_idx=self._enc_conv_idx,
-                )
-                out = torch.cat([out, out_], 2)
+        if tiling is not None:
+            out = self._encode_tiled(x, tiling)
+        else:
+            x = patchify(x, patch_size=2)
+            t = x.shape[2]
+            iter_ = 1 + (t - 1) // 4
+            # collect chunks and concatenate once (avoids quadratic copying)
+            outs = []
+            for i in range(iter_):
+                self._enc_conv_idx = [0]
+                if i == 0:
+                    outs.append(
+                        self.encoder(
+                            x[:, :, :1, :, :],
+                            feat_cache=self._enc_feat_map,
+                            feat_idx=self._enc_conv_idx,
+                        ))
+                else:
+                    outs.append(
+                        self.encoder(
+                            x[:, :, 1 + 4 * (i - 1):1 + 4 * i, :, :],
+                            feat_cache=self._enc_feat_map,
+                            feat_idx=self._enc_conv_idx,
+                        ))
+            out = torch.cat(outs, 2)
+            del outs
         mu, log_var = self.conv1(out).chunk(2, dim=1)
         if isinstance(scale[0], torch.Tensor):
             mu = (mu - scale[0].view(1, self.z_dim, 1, 1, 1)) * scale[1].view(
@@ -809,7 +883,47 @@ class WanVAE_(nn.Module):
         self.clear_cache()
         return mu
 
-    def decode(self, z, scale):
+    def _encode_tiled(self, x, tiling):
+        st = self.spatial_stride
+        h, w = x.shape[3] // st, x.shape[4] // st
+        tiles, ov = self._tile_grid(h, w, tiling)
+        caches = [[None] * self._enc_conv_num for _ in tiles]
+        t = x.shape[2]
+        outs = []
+        for i in range(1 + (t - 1) // 4):
+            frames = x[:, :, :1] if i == 0 else x[:, :, 1 + 4 * (i - 1):1 +
+                                                  4 * i]
+            canvas = _TiledCanvas((h, w), ov)
+            for (top, left, th, tw), cache in zip(tiles, caches):
+                tile = frames[..., top * st:(top + th) * st,
+                              left * st:(left + tw) * st]
+                canvas.add(
+                    self.encoder(
+                        patchify(tile, patch_size=2),
+                        feat_cache=cache,
+                        feat_idx=[0],
+                    ), top, left)
+            outs.append(canvas.result())
+        return torch.cat(outs, 2)
+
+    def decode(self, z, scale, tiling=None):
+        return torch.cat(list(self.decode_stream(z, scale, tiling)), 2)
+
+    def decode_stream(self, z, scale, tiling=None):
+        r"""
+        Decodes `z` one latent frame at a time, yielding each pixel chunk
+        [B, C, T_i, H, W] as soon as its causal step finishes (1 frame for the
+        first latent frame, 4 for every following one). Only the causal
+        feature cache is kept between steps, so the caller decides whether
+        the full clip is ever materialized.
+
+        With `tiling` = (tile_h, tile_w, overlap) in pixels, every latent frame
+        is decoded as overlapping spatial tiles (one causal feature cache per
+        tile) that are blended into the full frame, so decoder activations
+        scale with the tile area instead of the frame area.
+
+        The feature cache lives on the module: do not interleave two streams.
+        """
         self.clear_cache()
         if isinstance(scale[0], torch.Tensor):
             z = z / scale[1].view(1, self.z_dim, 1, 1, 1) + scale[0].view(
@@ -818,25 +932,42 @@ class WanVAE_(nn.Module):
             z = z / scale[1] + scale[0]
         iter_ = z.shape[2]
         x = self.conv2(z)
-        for i in range(iter_):
-            self._conv_idx = [0]
-            if i == 0:
+        if tiling is not None:
+            yield from self._decode_stream_tiled(x, tiling)
+            return
+        try:
+            for i in range(iter_):
+                self._conv_idx = [0]
                 out = self.decoder(
                     x[:, :, i:i + 1, :, :],
                     feat_cache=self._feat_map,
                     feat_idx=self._conv_idx,
-                    first_chunk=True,
+                    first_chunk=(i == 0),
                 )
-            else:
-                out_ = self.decoder(
-                    x[:, :, i:i + 1, :, :],
-                    feat_cache=self._feat_map,
-                    feat_idx=self._conv_idx,
-                )
-                out = torch.cat([out, out_], 2)
-        out = unpatchify(out, patch_size=2)
-        self.clear_cache()
-        return out
+                yield unpatchify(out, patch_size=2)
+        finally:
+            self.clear_cache()
+
+    def _decode_stream_tiled(self, x, tiling):
+        st = self.spatial_stride
+        h, w = x.shape[3:]
+        tiles, ov = self._tile_grid(h, w, tiling)
+        caches = [[None] * self._conv_num for _ in tiles]
+        try:
+            for i in range(x.shape[2]):
+                canvas = _TiledCanvas((h * st, w * st), ov * st)
+                for (top, left, th, tw), cache in zip(tiles, caches):
+                    out = self.decoder(
+                        x[:, :, i:i + 1, top:top + th, left:left + tw],
+                        feat_cache=cache,
+                        feat_idx=[0],
+                        first_chunk=(i == 0),
+                    )
+                    canvas.add(
+                        unpatchify(out, patch_size=2), top * st, left * st)
+                yield canvas.result()
+        finally:
+            self.clear_cache()
 
     def reparameterize(self, mu, log_var):
         std = torch.exp(0.5 * log_var)
@@ -900,6 +1031,8 @@ class Wan2_2_VAE:
 
         self.dtype = dtype
         self.device = device
+        # (tile_h, tile_w, overlap) in pixels, see enable_tiling()
+        self.tiling = None
 
         mean = torch.tensor(
             [
@@ -1027,23 +1160,55 @@ class Wan2_2_VAE:
                 raise TypeError("videos should be a list")
             with amp.autocast(dtype=self.dtype):
                 return [
-                    self.model.encode(u.unsqueeze(0),
-                                      self.scale).float().squeeze(0)
-                    for u in videos
+                    self.model.encode(
+                        u.unsqueeze(0), self.scale,
+                        tiling=self.tiling).float().squeeze(0) for u in videos
                 ]
         except TypeError as e:
             logging.info(e)
             return None
 
+    def enable_tiling(self, tile_size=(256, 256), tile_overlap=64):
+        r"""
+        Opt-in spatially tiled encode/decode for high resolutions on limited VRAM.
+
+        Args:
+            tile_size (`tuple[int]`, *optional*, defaults to (256, 256)):
+                Tile (height, width) in pixels, rounded down to multiples of 16.
+            tile_overlap (`int`, *optional*, defaults to 64):
+                Overlap between neighbouring tiles in pixels; seams are blended
+                linearly across it.
+        """
+        self.tiling = (tile_size[0], tile_size[1], tile_overlap)
+
+    def disable_tiling(self):
+        self.tiling = None
+
+    def decode_stream(self, z):
+        r"""
+        Streaming counterpart of `decode` for a single latent [C, T, H, W].
+        Yields clamped float pixel chunks [3, T_i, H, W] in temporal order;
+        concatenated along dim 1 they equal `decode([z])[0]`.
+        """
+        chunks = self.model.decode_stream(
+            z.unsqueeze(0), self.scale, tiling=self.tiling)
+        while True:
+            # autocast per step: a `with` around the yield would leak into the consumer
+            with amp.autocast(dtype=self.dtype):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            yield chunk.float().clamp_(-1, 1).squeeze(0)
+
     def decode(self, zs):
         try:
             if not isinstance(zs, list):
                 raise TypeError("zs should be a list")
             with amp.autocast(dtype=self.dtype):
                 return [
-                    self.model.decode(u.unsqueeze(0),
-                                      self.scale).float().clamp_(-1,
-                                                                 1).squeeze(0)
+                    self.model.decode(
+                        u.unsqueeze(0), self.scale,
+                        tiling=self.tiling).float().clamp_(-1, 1).squeeze(0)
                     for u in zs
                 ]
         except TypeError as e:
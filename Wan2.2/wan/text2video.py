@@ -25,7 +25,9 @@ from .utils.fm_solvers import (
     get_sampling_sigmas,
     retrieve_timesteps,
 )
+from .utils.cfg import GuidedForward
 from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.offload import ExpertResidency
 
 
 class WanT2V:
@@ -42,6 +44,8 @@ class WanT2V:
         t5_cpu=False,
         init_on_cpu=True,
         convert_model_dtype=False,
+        t5_cache_dir=None,
+        expert_residency='auto',
     ):
         r"""
         Initializes the Wan text-to-video generation model components.
@@ -68,6 +72,13 @@ class WanT2V:
             convert_model_dtype (`bool`, *optional*, defaults to False):
                 Convert DiT model parameters dtype to 'config.param_dtype'.
                 Only works without FSDP.
+            t5_cache_dir (`str`, *optional*, defaults to None):
+                Directory for the on-disk tier of the prompt embedding cache.
+                Without it, embeddings are only cached in memory.
+            expert_residency (`str`, *optional*, defaults to 'auto'):
+                How the high/low noise experts share the GPU: 'resident' keeps
+                both loaded, 'swap' keeps one at a time, 'auto' keeps both while
+                enough memory is left. See `ExpertResidency`.
         """
         self.device = torch.device(f"cuda:{device_id}")
         self.config = config
@@ -89,7 +100,8 @@ class WanT2V:
             device=torch.device('cpu'),
             checkpoint_path=os.path.join(checkpoint_dir, config.t5_checkpoint),
             tokenizer_path=os.path.join(checkpoint_dir, config.t5_tokenizer),
-            shard_fn=shard_fn if t5_fsdp else None)
+            shard_fn=shard_fn if t5_fsdp else None,
+            cache_dir=t5_cache_dir)
 
         self.vae_stride = config.vae_stride
         self.patch_size = config.patch_size
@@ -115,6 +127,14 @@ class WanT2V:
             dit_fsdp=dit_fsdp,
             shard_fn=shard_fn,
             convert_model_dtype=convert_model_dtype)
+        self.residency = ExpertResidency(
+            {
+                'high_noise_model': self.high_noise_model,
+                'low_noise_model': self.low_noise_model,
+            },
+            self.device,
+            policy=expert_residency,
+            pin=not dit_fsdp)
         if use_sp:
             self.sp_size = get_world_size()
         else:
@@ -166,7 +186,11 @@ class WanT2V:
 
         return model
 
-    def _prepare_model_for_timestep(self, t, boundary, offload_model):
+    def _prepare_model_for_timestep(self,
+                                    t,
+                                    boundary,
+                                    offload_model,
+                                    t_next=None):
         r"""
         Prepares and returns the required model for the current timestep.
 
@@ -177,28 +201,21 @@ class WanT2V:
                 The timestep threshold. If `t` is at or above this value,
                 the `high_noise_model` is considered as the required model.
             offload_model (`bool`):
-                A flag intended to control the offloading behavior.
+                Unused, expert placement is handled by `self.residency`.
+            t_next (torch.Tensor, *optional*, defaults to None):
+                Next timestep. On the last high noise step the low noise
+                model is prefetched so the switch does not stall.
 
         Returns:
             torch.nn.Module:
                 The active model on the target device for the current timestep.
         """
         if t.item() >= boundary:
-            required_model_name = 'high_noise_model'
-            offload_model_name = 'low_noise_model'
-        else:
-            required_model_name = 'low_noise_model'
-            offload_model_name = 'high_noise_model'
-        if offload_model or self.init_on_cpu:
-            if next(getattr(
-                    self,
-                    offload_model_name).parameters()).device.type == 'cuda':
-                getattr(self, offload_model_name).to('cpu')
-            if next(getattr(
-                    self,
-                    required_model_name).parameters()).device.type == 'cpu':
-                getattr(self, required_model_name).to(self.device)
-        return getattr(self, required_model_name)
+            model = self.residency.acquire('high_noise_model')
+            if t_next is not None and t_next.item() < boundary:
+                self.residency.prefetch('low_noise_model')
+            return model
+        return self.residency.acquire('low_noise_model')
 
     def generate(self,
                  input_prompt,
@@ -210,7 +227,8 @@ class WanT2V:
                  guide_scale=5.0,
                  n_prompt="",
                  seed=-1,
-                 offload_model=True):
+                 offload_model=True,
+                 batch_cfg=True):
         r"""
         Generates video frames from text prompt using diffusion process.
 
@@ -237,6 +255,9 @@ class WanT2V:
                 Random seed for noise generation. If -1, use random seed.
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            batch_cfg (`bool`, *optional*, defaults to True):
+                Run the conditional and unconditional branches in one batched DiT
+                forward. Falls back to two sequential forwards if that runs out of memory.
 
         Returns:
             torch.Tensor:
@@ -264,17 +285,13 @@ class WanT2V:
         seed_g = torch.Generator(device=self.device)
         seed_g.manual_seed(seed)
 
-        if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
-            if offload_model:
-                self.text_encoder.model.cpu()
-        else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
-            context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+        # cached per prompt: hits skip the encoder and its device transfer
+        context_all = self.text_encoder.encode(
+            [input_prompt, n_prompt],
+            self.device,
+            encode_device=torch.device('cpu') if self.t5_cpu else self.device,
+            offload=offload_model)
+        context, context_null = context_all[:-1], context_all[-1:]
 
         noise = [
             torch.randn(
@@ -331,25 +348,23 @@ class WanT2V:
 
             arg_c = {'context': context, 'seq_len': seq_len}
             arg_null = {'context': context_null, 'seq_len': seq_len}
+            guided_forward = GuidedForward(batch_cfg)
 
-            for _, t in enumerate(tqdm(timesteps)):
+            for i, t in enumerate(tqdm(timesteps)):
                 latent_model_input = latents
                 timestep = [t]
 
                 timestep = torch.stack(timestep)
 
                 model = self._prepare_model_for_timestep(
-                    t, boundary, offload_model)
+                    t, boundary, offload_model,
+                    timesteps[i + 1] if i + 1 < len(timesteps) else None)
                 sample_guide_scale = guide_scale[1] if t.item(
                 ) >= boundary else guide_scale[0]
 
-                noise_pred_cond = model(
-                    latent_model_input, t=timestep, **arg_c)[0]
-                noise_pred_uncond = model(
-                    latent_model_input, t=timestep, **arg_null)[0]
-
-                noise_pred = noise_pred_uncond + sample_guide_scale * (
-                    noise_pred_cond - noise_pred_uncond)
+                noise_pred = guided_forward(model, latent_model_input,
+                                            timestep, arg_c, arg_null,
+                                            sample_guide_scale)
 
                 temp_x0 = sample_scheduler.step(
                     noise_pred.unsqueeze(0),
@@ -360,9 +375,8 @@ class WanT2V:
                 latents = [temp_x0.squeeze(0)]
 
             x0 = latents
+            self.residency.release(offload_model)
             if offload_model:
-                self.low_noise_model.cpu()
-                self.high_noise_model.cpu()
                 torch.cuda.empty_cache()
             if self.rank == 0:
                 videos = self.vae.decode(x0)
@@ -5,6 +5,7 @@ import math
 import os
 import random
 import sys
+import time
 import types
 from contextlib import contextmanager
 from functools import partial
@@ -28,6 +29,8 @@ from .utils.fm_solvers import (
     retrieve_timesteps,
 )
 from .utils.fm_solvers_unipc import FlowUniPCMultistepScheduler
+from .utils.offload import ModelOffloader
+from .utils.cfg import GuidedForward
 from .utils.utils import best_output_size, masks_like
 
 
@@ -45,6 +48,8 @@ class WanTI2V:
         t5_cpu=False,
         init_on_cpu=True,
         convert_model_dtype=False,
+        t5_cache_dir=None,
+        block_offload=2,
     ):
         r"""
         Initializes the Wan text-to-video generation model components.
@@ -71,6 +76,13 @@ class WanTI2V:
             convert_model_dtype (`bool`, *optional*, defaults to False):
                 Convert DiT model parameters dtype to 'config.param_dtype'.
                 Only works without FSDP.
+            t5_cache_dir (`str`, *optional*, defaults to None):
+                Directory for the on-disk tier of the prompt embedding cache.
+                Without it, embeddings are only cached in memory.
+            block_offload (`int`, *optional*, defaults to 2):
+                With `offload_model`, the DiT blocks stay in pinned host memory
+                and are copied onto the GPU this many blocks ahead of execution.
+                0 moves the whole DiT at once. See `ModelOffloader`.
         """
         self.device = torch.device(f"cuda:{device_id}")
         self.config = config
@@ -91,7 +103,9 @@ class WanTI2V:
             device=torch.device('cpu'),
             checkpoint_path=os.path.join(checkpoint_dir, config.t5_checkpoint),
             tokenizer_path=os.path.join(checkpoint_dir, config.t5_tokenizer),
-            shard_fn=shard_fn if t5_fsdp else None)
+            shard_fn=shard_fn if t5_fsdp else None,
+            cache_dir=t5_cache_dir,
+            pin_memory=not t5_cpu)
 
         self.vae_stride = config.vae_stride
         self.patch_size = config.patch_size
@@ -107,6 +121,11 @@ class WanTI2V:
             dit_fsdp=dit_fsdp,
             shard_fn=shard_fn,
             convert_model_dtype=convert_model_dtype)
+        self.offloader = ModelOffloader(
+            self.model,
+            self.device,
+            prefetch_blocks=block_offload,
+            pin=not dit_fsdp)
 
         if use_sp:
             self.sp_size = get_world_size()
@@ -159,6 +178,112 @@ class WanTI2V:
 
         return model
 
+    def _decode(self, x0, sinks=None, callback=None):
+        r"""
+        Decodes a list of latents. With `sinks`, each latent is streamed chunk by
+        chunk into its sink (progress per latent frame) and None is returned for it.
+        """
+        if sinks is None:
+            if callback is not None:
+                callback('vae-decode', 0, 1)
+            return self.vae.decode(x0)
+        total, done = sum(u.size(1) for u in x0), 0
+        for z, sink in zip(x0, sinks):
+            for chunk in self.vae.decode_stream(z):
+                sink(chunk)
+                done += 1
+                if callback is not None:
+                    callback('vae-decode', done, total)
+        return [None] * len(x0)
+
+    def _target_shape(self, size, frame_num):
+        r"""
+        Latent shape [C, F, H, W] and padded sequence length for a text-to-video
+        request of `size` (width, height) and `frame_num` frames.
+        """
+        F = frame_num
+        target_shape = (self.vae.model.z_dim, (F - 1) // self.vae_stride[0] + 1,
+                        size[1] // self.vae_stride[1],
+                        size[0] // self.vae_stride[2])
+
+        seq_len = math.ceil((target_shape[2] * target_shape[3]) /
+                            (self.patch_size[1] * self.patch_size[2]) *
+                            target_shape[1] / self.sp_size) * self.sp_size
+        return target_shape, seq_len
+
+    def _token_mask(self, mask, seq_len):
+        r"""
+        Per-token timestep multiplier [seq_len] for a latent mask [C, F, H, W]:
+        the mask at patch resolution, padded with ones. Built once per
+        generation, so every step only needs `token_mask * t`.
+        """
+        mask = mask[0][:, ::self.patch_size[1], ::self.patch_size[2]].flatten()
+        return torch.cat([mask, mask.new_ones(seq_len - mask.size(0))])
+
+    def precompile(self,
+                   buckets,
+                   mode='default',
+                   cache_dir=None,
+                   batch_cfg=True,
+                   offload_model=True):
+        r"""
+        Compiles the DiT for a fixed set of text-to-video shapes, see
+        `WanModel.enable_compile`. Requests with other shapes (image-to-video
+        sizes, other batch sizes) keep running eagerly.
+
+        Args:
+            buckets (List[Tuple[Tuple[int, int], int]]):
+                (size, frame_num) pairs, size being (width, height).
+            mode (`str`, *optional*, defaults to 'default'):
+                `torch.compile` mode.
+            cache_dir (`str`, *optional*, defaults to None):
+                On-disk cache for the compiled kernels.
+            batch_cfg (`bool`, *optional*, defaults to True):
+                Compile for the batched cond/uncond forward (batch 2) instead of
+                two forwards of batch 1.
+            offload_model (`bool`, *optional*, defaults to True):
+                Offload the DiT again afterwards. Not allowed with
+                'reduce-overhead', whose CUDA graphs need resident weights.
+
+        Returns:
+            dict: Compile seconds per bucket.
+        """
+        if mode == 'reduce-overhead' and offload_model:
+            raise ValueError(
+                "Compile mode 'reduce-overhead' captures CUDA graphs, which "
+                "replay stale weights once the DiT is offloaded; use "
+                "offload_model=False or a mode without CUDA graphs.")
+        if self.sp_size > 1:
+            logging.warning('Compiled DiT is not supported with sequence parallel.')
+            return {}
+        if self.model._compiled is None:
+            self.model.enable_compile(mode, cache_dir)
+        bs = 2 if batch_cfg else 1
+        context = [
+            torch.zeros(
+                1, self.model.text_dim, device=self.device, dtype=torch.float32)
+        ] * bs
+        timings = {}
+        self.offloader.load(stream_blocks=offload_model)
+        with (
+                torch.amp.autocast('cuda', dtype=self.param_dtype),
+                torch.no_grad(),
+                self.model.precompile(),
+        ):
+            for size, frame_num in buckets:
+                target_shape, seq_len = self._target_shape(size, frame_num)
+                x = [torch.zeros(target_shape, device=self.device)] * bs
+                t = torch.full((bs, seq_len), 999., device=self.device)
+                start = time.perf_counter()
+                self.model(x, t=t, context=context, seq_len=seq_len)
+                torch.cuda.synchronize(self.device)
+                timings[(tuple(size), frame_num)] = time.perf_counter() - start
+                logging.info(f'Compiled DiT for size={size} frame_num={frame_num} '
+                             f'in {timings[(tuple(size), frame_num)]:.1f}s')
+        if offload_model:
+            self.offloader.offload()
+        return timings
+
     def generate(self,
                  input_prompt,
                  img=None,
@@ -171,7 +296,10 @@ class WanTI2V:
                  guide_scale=5.0,
                  n_prompt="",
                  seed=-1,
-                 offload_model=True):
+                 offload_model=True,
+                 batch_cfg=True,
+                 callback=None,
+                 sink=None):
         r"""
         Generates video frames from text prompt using diffusion process.
 
@@ -200,6 +328,16 @@ class WanTI2V:
                 Random seed for noise generation. If -1, use random seed.
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            batch_cfg (`bool`, *optional*, defaults to True):
+                Run the conditional and unconditional branches in one batched DiT
+                forward. Falls back to two sequential forwards if that runs out of memory.
+            callback (`callable`, *optional*, defaults to None):
+                Progress hook called as `callback(stage, step, total)` with stage one of
+                'text-encode', 'vae-encode' (i2v only), 'denoise' and 'vae-decode'.
+            sink (`callable`, *optional*, defaults to None):
+                If given, the video is decoded as a stream and every pixel chunk
+                [C, T_i, H, W] is passed to `sink(chunk)` as soon as it is ready
+                (e.g. `StreamingVideoWriter.write`); nothing is returned then.
 
         Returns:
             torch.Tensor:
@@ -222,7 +360,10 @@ class WanTI2V:
                 guide_scale=guide_scale,
                 n_prompt=n_prompt,
                 seed=seed,
-                offload_model=offload_model)
+                offload_model=offload_model,
+                batch_cfg=batch_cfg,
+                callback=callback,
+                sink=sink)
         # t2v
         return self.t2v(
             input_prompt=input_prompt,
@@ -234,7 +375,10 @@ class WanTI2V:
             guide_scale=guide_scale,
             n_prompt=n_prompt,
             seed=seed,
-            offload_model=offload_model)
+            offload_model=offload_model,
+            batch_cfg=batch_cfg,
+            callback=callback,
+            sink=sink)
 
     def t2v(self,
             input_prompt,
@@ -246,7 +390,10 @@ class WanTI2V:
             guide_scale=5.0,
             n_prompt="",
             seed=-1,
-            offload_model=True):
+            offload_model=True,
+            batch_cfg=True,
+            callback=None,
+            sink=None):
         r"""
         Generates video frames from text prompt using diffusion process.
 
@@ -271,6 +418,16 @@ class WanTI2V:
                 Random seed for noise generation. If -1, use random seed.
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            batch_cfg (`bool`, *optional*, defaults to True):
+                Run the conditional and unconditional branches in one batched DiT
+                forward. Falls back to two sequential forwards if that runs out of memory.
+            callback (`callable`, *optional*, defaults to None):
+                Progress hook called as `callback(stage, step, total)` with stage one of
+                'text-encode', 'vae-encode' (i2v only), 'denoise' and 'vae-decode'.
+            sink (`callable`, *optional*, defaults to None):
+                If given, the video is decoded as a stream and every pixel chunk
+                [C, T_i, H, W] is passed to `sink(chunk)` as soon as it is ready
+                (e.g. `StreamingVideoWriter.write`); nothing is returned then.
 
         Returns:
             torch.Tensor:
@@ -281,14 +438,7 @@ class WanTI2V:
                 - W: Frame width from size)
         """
         # preprocess
-        F = frame_num
-        target_shape = (self.vae.model.z_dim, (F - 1) // self.vae_stride[0] + 1,
-                        size[1] // self.vae_stride[1],
-                        size[0] // self.vae_stride[2])
-
-        seq_len = math.ceil((target_shape[2] * target_shape[3]) /
-                            (self.patch_size[1] * self.patch_size[2]) *
-                            target_shape[1] / self.sp_size) * self.sp_size
+        target_shape, seq_len = self._target_shape(size, frame_num)
 
         if n_prompt == "":
             n_prompt = self.sample_neg_prompt
@@ -296,17 +446,15 @@ class WanTI2V:
         seed_g = torch.Generator(device=self.device)
         seed_g.manual_seed(seed)
 
-        if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
-            if offload_model:
-                self.text_encoder.model.cpu()
-        else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
-            context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
+        if callback is not None:
+            callback('text-encode', 0, 1)
+        # cached per prompt: hits skip the encoder and its device transfer
+        context_all = self.text_encoder.encode(
+            [input_prompt, n_prompt],
+            self.device,
+            encode_device=torch.device('cpu') if self.t5_cpu else self.device,
+            offload=offload_model)
+        context, context_null = context_all[:-1], context_all[-1:]
 
         noise = [
             torch.randn(
@@ -356,34 +504,28 @@ class WanTI2V:
             # sample videos
             latents = noise
             mask1, mask2 = masks_like(noise, zero=False)
+            token_mask = self._token_mask(mask2[0], seq_len)
 
             arg_c = {'context': context, 'seq_len': seq_len}
             arg_null = {'context': context_null, 'seq_len': seq_len}
+            guided_forward = GuidedForward(batch_cfg)
 
             if offload_model or self.init_on_cpu:
-                self.model.to(self.device)
-                torch.cuda.empty_cache()
+                self.offloader.load(stream_blocks=offload_model)
 
-            for _, t in enumerate(tqdm(timesteps)):
+            if callback is not None:
+                callback('denoise', 0, len(timesteps))
+            for i, t in enumerate(tqdm(timesteps)):
                 latent_model_input = latents
                 timestep = [t]
 
                 timestep = torch.stack(timestep)
 
-                temp_ts = (mask2[0][0][:, ::2, ::2] * timestep).flatten()
-                temp_ts = torch.cat([
-                    temp_ts,
-                    temp_ts.new_ones(seq_len - temp_ts.size(0)) * timestep
-                ])
-                timestep = temp_ts.unsqueeze(0)
+                timestep = (token_mask * timestep).unsqueeze(0)
 
-                noise_pred_cond = self.model(
-                    latent_model_input, t=timestep, **arg_c)[0]
-                noise_pred_uncond = self.model(
-                    latent_model_input, t=timestep, **arg_null)[0]
-
-                noise_pred = noise_pred_uncond + guide_scale * (
-                    noise_pred_cond - noise_pred_uncond)
+                noise_pred = guided_forward(self.model, latent_model_input,
+                                            timestep, arg_c, arg_null,
+                                            guide_scale)
 
                 temp_x0 = sample_scheduler.step(
                     noise_pred.unsqueeze(0),
@@ -392,13 +534,14 @@ class WanTI2V:
                     return_dict=False,
                     generator=seed_g)[0]
                 latents = [temp_x0.squeeze(0)]
+                if callback is not None:
+                    callback('denoise', i + 1, len(timesteps))
             x0 = latents
             if offload_model:
-                self.model.cpu()
-                torch.cuda.synchronize()
-                torch.cuda.empty_cache()
+                self.offloader.offload()
             if self.rank == 0:
-                videos = self.vae.decode(x0)
+                videos = self._decode(x0, None if sink is None else [sink],
+                                      callback)
 
         del noise, latents
         del sample_scheduler
@@ -410,6 +553,168 @@ class WanTI2V:
 
         return videos[0] if self.rank == 0 else None
 
+    def t2v_batch(self,
+                  input_prompts,
+                  size=(1280, 704),
+                  frame_num=121,
+                  shift=5.0,
+                  sample_solver='unipc',
+                  sampling_steps=50,
+                  guide_scale=5.0,
+                  n_prompt="",
+                  seeds=None,
+                  offload_model=True,
+                  batch_cfg=True,
+                  callback=None,
+                  sinks=None):
+        r"""
+        Generates one video per prompt in a single batched denoising loop.
+
+        All samples share size, frame count and sampling schedule, so their latents
+        are stacked and go through the DiT together. With `batch_cfg` the
+        conditional and unconditional branches of every sample share one forward
+        pass per step; like in `t2v` this falls back to one conditional and one
+        unconditional forward if it runs out of memory.
+
+        Args:
+            input_prompts (`list[str]`):
+                Text prompts, one per output video
+            seeds (`list[int]`, *optional*, defaults to None):
+                One seed per prompt (-1 or None entries draw a random seed). Each
+                sample's noise comes from its own generator, so a prompt/seed pair
+                gives the same initial noise as `t2v` with that seed. The solvers
+                used here are deterministic (the DPM solver only draws noise in its
+                SDE variants), so no generator is needed after the initial noise.
+            callback (`callable`, *optional*, defaults to None):
+                Progress hook, see `generate`.
+            sinks (`list[callable]`, *optional*, defaults to None):
+                One streaming sink per prompt, see `sink` in `generate`.
+
+            The remaining arguments are identical to `t2v`.
+
+        Returns:
+            list[torch.Tensor]:
+                Generated videos, one (C, N, H, W) tensor per prompt (None on ranks > 0
+                and for streamed videos).
+        """
+        n = len(input_prompts)
+        seeds = list(seeds) if seeds is not None else [-1] * n
+        assert len(seeds) == n, "need one seed per prompt"
+
+        # preprocess
+        target_shape, seq_len = self._target_shape(size, frame_num)
+
+        if n_prompt == "":
+            n_prompt = self.sample_neg_prompt
+        seed_gs = []
+        for seed in seeds:
+            seed = seed if seed is not None and seed >= 0 else random.randint(
+                0, sys.maxsize)
+            seed_g = torch.Generator(device=self.device)
+            seed_g.manual_seed(seed)
+            seed_gs.append(seed_g)
+
+        if callback is not None:
+            callback('text-encode', 0, 1)
+        # cached per prompt: hits skip the encoder and its device transfer
+        context_all = self.text_encoder.encode(
+            list(input_prompts) + [n_prompt],
+            self.device,
+            encode_device=torch.device('cpu') if self.t5_cpu else self.device,
+            offload=offload_model)
+        context, context_null = context_all[:-1], context_all[-1:]
+
+        noise = torch.stack([
+            torch.randn(
+                target_shape[0],
+                target_shape[1],
+                target_shape[2],
+                target_shape[3],
+                dtype=torch.float32,
+                device=self.device,
+                generator=seed_g) for seed_g in seed_gs
+        ])
+
+        @contextmanager
+        def noop_no_sync():
+            yield
+
+        no_sync = getattr(self.model, 'no_sync', noop_no_sync)
+
+        # evaluation mode
+        with (
+                torch.amp.autocast('cuda', dtype=self.param_dtype),
+                torch.no_grad(),
+                no_sync(),
+        ):
+
+            if sample_solver == 'unipc':
+                sample_scheduler = FlowUniPCMultistepScheduler(
+                    num_train_timesteps=self.num_train_timesteps,
+                    shift=1,
+                    use_dynamic_shifting=False)
+                sample_scheduler.set_timesteps(
+                    sampling_steps, device=self.device, shift=shift)
+                timesteps = sample_scheduler.timesteps
+            elif sample_solver == 'dpm++':
+                sample_scheduler = FlowDPMSolverMultistepScheduler(
+                    num_train_timesteps=self.num_train_timesteps,
+                    shift=1,
+                    use_dynamic_shifting=False)
+                sampling_sigmas = get_sampling_sigmas(sampling_steps, shift)
+                timesteps, _ = retrieve_timesteps(
+                    sample_scheduler,
+                    device=self.device,
+                    sigmas=sampling_sigmas)
+            else:
+                raise NotImplementedError("Unsupported solver.")
+
+            # sample videos: the scheduler math is elementwise, so one scheduler
+            # steps the whole [N, C, F, H, W] stack
+            latents = noise
+            mask1, mask2 = masks_like([noise[0]], zero=False)
+            token_mask = self._token_mask(mask2[0], seq_len)
+
+            arg_c = {'context': context, 'seq_len': seq_len}
+            arg_null = {'context': context_null * n, 'seq_len': seq_len}
+            guided_forward = GuidedForward(batch_cfg)
+
+            if offload_model or self.init_on_cpu:
+                self.offloader.load(stream_blocks=offload_model)
+
+            if callback is not None:
+                callback('denoise', 0, len(timesteps))
+            for i, t in enumerate(tqdm(timesteps)):
+                timestep = torch.stack([t])
+
+                timestep = (token_mask * timestep).unsqueeze(0).expand(n, -1)
+
+                noise_pred = guided_forward(self.model, list(latents.unbind(0)),
+                                            timestep, arg_c, arg_null,
+                                            guide_scale)
+                if n == 1:
+                    noise_pred = noise_pred.unsqueeze(0)
+
+                latents = sample_scheduler.step(
+                    noise_pred, t, latents, return_dict=False)[0]
+                if callback is not None:
+                    callback('denoise', i + 1, len(timesteps))
+            x0 = list(latents.unbind(0))
+            if offload_model:
+                self.offloader.offload()
+            if self.rank == 0:
+                videos = self._decode(x0, sinks, callback)
+
+        del noise, latents
+        del sample_scheduler
+        if offload_model:
+            gc.collect()
+            torch.cuda.synchronize()
+        if dist.is_initialized():
+            dist.barrier()
+
+        return videos if self.rank == 0 else None
+
     def i2v(self,
             input_prompt,
             img,
@@ -421,7 +726,10 @@ class WanTI2V:
             guide_scale=5.0,
             n_prompt="",
             seed=-1,
-            offload_model=True):
+            offload_model=True,
+            batch_cfg=True,
+            callback=None,
+            sink=None):
         r"""
         Generates video frames from input image and text prompt using diffusion process.
 
@@ -449,6 +757,16 @@ class WanTI2V:
                 Random seed for noise generation. If -1, use random seed
             offload_model (`bool`, *optional*, defaults to True):
                 If True, offloads models to CPU during generation to save VRAM
+            batch_cfg (`bool`, *optional*, defaults to True):
+                Run the conditional and unconditional branches in one batched DiT
+                forward. Falls back to two sequential forwards if that runs out of memory.
+            callback (`callable`, *optional*, defaults to None):
+                Progress hook called as `callback(stage, step, total)` with stage one of
+                'text-encode', 'vae-encode' (i2v only), 'denoise' and 'vae-decode'.
+            sink (`callable`, *optional*, defaults to None):
+                If given, the video is decoded as a stream and every pixel chunk
+                [C, T_i, H, W] is passed to `sink(chunk)` as soon as it is ready
+                (e.g. `StreamingVideoWriter.write`); nothing is returned then.
 
         Returns:
             torch.Tensor:
@@ -497,18 +815,18 @@ class WanTI2V:
             n_prompt = self.sample_neg_prompt
 
         # preprocess
-        if not self.t5_cpu:
-            self.text_encoder.model.to(self.device)
-            context = self.text_encoder([input_prompt], self.device)
-            context_null = self.text_encoder([n_prompt], self.device)
-            if offload_model:
-                self.text_encoder.model.cpu()
-        else:
-            context = self.text_encoder([input_prompt], torch.device('cpu'))
-            context_null = self.text_encoder([n_prompt], torch.device('cpu'))
-            context = [t.to(self.device) for t in context]
-            context_null = [t.to(self.device) for t in context_null]
-
+        if callback is not None:
+            callback('text-encode', 0, 1)
+        # cached per prompt: hits skip the encoder and its device transfer
+        context_all = self.text_encoder.encode(
+            [input_prompt, n_prompt],
+            self.device,
+            encode_device=torch.device('cpu') if self.t5_cpu else self.device,
+            offload=offload_model)
+        context, context_null = context_all[:-1], context_all[-1:]
+
+        if callback is not None:
+            callback('vae-encode', 0, 1)
         z = self.vae.encode([img])
 
         @contextmanager
@@ -548,6 +866,7 @@ class WanTI2V:
             # sample videos
             latent = noise
             mask1, mask2 = masks_like([noise], zero=True)
+            token_mask = self._token_mask(mask2[0], seq_len)
             latent = (1. - mask2[0]) * z[0] + mask2[0] * latent
 
             arg_c = {
@@ -559,34 +878,25 @@ class WanTI2V:
                 'context': context_null,
                 'seq_len': seq_len,
             }
+            guided_forward = GuidedForward(
+                batch_cfg, empty_cache=offload_model and not self.offloader.pin)
 
             if offload_model or self.init_on_cpu:
-                self.model.to(self.device)
-                torch.cuda.empty_cache()
+                self.offloader.load(stream_blocks=offload_model)
 
-            for _, t in enumerate(tqdm(timesteps)):
+            if callback is not None:
+                callback('denoise', 0, len(timesteps))
+            for i, t in enumerate(tqdm(timesteps)):
                 latent_model_input = [latent.to(self.device)]
                 timestep = [t]
 
                 timestep = torch.stack(timestep).to(self.device)
 
-                temp_ts = (mask2[0][0][:, ::2, ::2] * timestep).flatten()
-                temp_ts = torch.cat([
-                    temp_ts,
-                    temp_ts.new_ones(seq_len - temp_ts.size(0)) * timestep
-                ])
-                timestep = temp_ts.unsqueeze(0)
-
-                noise_pred_cond = self.model(
-                    latent_model_input, t=timestep, **arg_c)[0]
-                if offload_model:
-                    torch.cuda.empty_cache()
-                noise_pred_uncond = self.model(
-                    latent_model_input, t=timestep, **arg_null)[0]
-                if offload_model:
-                    torch.cuda.empty_cache()
-                noise_pred = noise_pred_uncond + guide_scale * (
-                    noise_pred_cond - noise_pred_uncond)
+                timestep = (token_mask * timestep).unsqueeze(0)
+
+                noise_pred = guided_forward(self.model, latent_model_input,
+                                            timestep, arg_c, arg_null,
+                                            guide_scale)
 
                 temp_x0 = sample_scheduler.step(
                     noise_pred.unsqueeze(0),
@@ -599,14 +909,15 @@ class WanTI2V:
 
                 x0 = [latent]
                 del latent_model_input, timestep
+                if callback is not None:
+                    callback('denoise', i + 1, len(timesteps))
 
             if offload_model:
-                self.model.cpu()
-                torch.cuda.synchronize()
-                torch.cuda.empty_cache()
+                self.offloader.offload()
 
             if self.rank == 0:
-                videos = self.vae.decode(x0)
+                videos = self._decode(x0, None if sink is None else [sink],
+                                      callback)
 
         del noise, latent, x0
         del sample_scheduler
@@ -0,0 +1,113 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+
+import torch
+
+from ..modules.model import TextContext, WanModel
+
+__all__ = ['GuidedForward']
+
+
+def _cat_branch_args(arg_c, arg_null):
+    r"""
+    Merges the conditional and unconditional model kwargs into one batch of two.
+    List-valued entries (context, y) and context handles are concatenated,
+    everything else (seq_len) must be identical between the branches.
+    """
+    merged = {}
+    for k, v in arg_c.items():
+        if isinstance(v, (list, TextContext)):
+            merged[k] = v + arg_null[k]
+        else:
+            assert arg_null[k] == v, f'cond/uncond mismatch for {k}'
+            merged[k] = v
+    return merged
+
+
+class GuidedForward:
+    r"""
+    Classifier-free guided DiT prediction for one or more samples.
+
+    With `batch_cfg=True` the conditional and unconditional branches share one
+    forward pass of batch size 2N, so patch/time embedding, RoPE setup and the
+    kernel launches of every block run once per step instead of twice. If that
+    forward runs out of GPU memory, the step is redone as one conditional and
+    one unconditional forward of batch size N, and the instance stays
+    sequential for the rest of the sampling loop.
+
+    Text contexts are projected once per model (`WanModel.prepare_context`)
+    and reused by every step, together with their cross-attention keys and
+    values. Use one instance per generation.
+
+    Args:
+        batch_cfg (`bool`, *optional*, defaults to True):
+            Run both branches in one batched forward.
+        empty_cache (`bool`, *optional*, defaults to False):
+            Call `torch.cuda.empty_cache()` between the two sequential forwards
+            (used by the offloading paths).
+    """
+
+    def __init__(self, batch_cfg=True, empty_cache=False):
+        self.batch_cfg = batch_cfg
+        self.empty_cache = empty_cache
+        self._contexts = {}
+
+    def _prepared(self, model, args):
+        context = args.get('context')
+        # FSDP-wrapped models must project inside their own forward
+        if not isinstance(context, list) or not isinstance(model, WanModel):
+            return args
+        key = (id(model), id(context))
+        if key not in self._contexts:
+            self._contexts[key] = (context, model.prepare_context(context))
+        return dict(args, context=self._contexts[key][1])
+
+    def __call__(self, model, x, t, arg_c, arg_null, guide_scale):
+        r"""
+        Args:
+            model (`WanModel`): DiT to evaluate.
+            x (List[Tensor]): Latents of the N samples, as passed to `WanModel.forward`.
+            t (Tensor): Timesteps for these samples, shape [N] or [N, seq_len].
+            arg_c, arg_null (dict): Conditional / unconditional model kwargs,
+                with one context entry per sample.
+            guide_scale (`float`): Guidance scale.
+
+        Returns:
+            Tensor: Guided noise prediction with the shape of `x[0]` for a single
+            sample, stacked to [N, ...] for several.
+        """
+        arg_c = self._prepared(model, arg_c)
+        arg_null = self._prepared(model, arg_null)
+        n = len(x)
+        if self.batch_cfg:
+            try:
+                out = model(
+                    x + x,
+                    t=t.repeat(2, *([1] * (t.dim() - 1))),
+                    **_cat_branch_args(arg_c, arg_null))
+            except torch.cuda.OutOfMemoryError:
+                logging.warning(
+                    'Batched CFG forward ran out of memory, '
+                    'falling back to sequential cond/uncond passes.')
+                self.batch_cfg = False
+                torch.cuda.empty_cache()
+            else:
+                return self._guide(out[:n], out[n:], guide_scale)
+
+        noise_pred_cond = model(x, t=t, **arg_c)
+        if self.empty_cache:
+            torch.cuda.empty_cache()
+        noise_pred_uncond = model(x, t=t, **arg_null)
+        if self.empty_cache:
+            torch.cuda.empty_cache()
+        return self._guide(noise_pred_cond, noise_pred_uncond, guide_scale)
+
+    @staticmethod
+    def _guide(noise_pred_cond, noise_pred_uncond, guide_scale):
+        if len(noise_pred_cond) == 1:
+            noise_pred_cond, noise_pred_uncond = noise_pred_cond[0], noise_pred_uncond[0]
+        else:
+            noise_pred_cond = torch.stack(noise_pred_cond)
+            noise_pred_uncond = torch.stack(noise_pred_uncond)
+        return noise_pred_uncond + guide_scale * (
+            noise_pred_cond - noise_pred_uncond)
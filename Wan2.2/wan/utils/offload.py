@@ -0,0 +1,379 @@
+# Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
+import logging
+
+import torch
+
+__all__ = ['ExpertResidency', 'ModelOffloader']
+
+
+def _tensors(module):
+    return list(module.parameters()) + list(module.buffers())
+
+
+def _nbytes(module):
+    return sum(t.numel() * t.element_size() for t in _tensors(module))
+
+
+def _device(device):
+    device = torch.device(device)
+    if device.type == 'cuda' and device.index is None:
+        device = torch.device('cuda', torch.cuda.current_device())
+    return device
+
+
+def _host_copies(tensors, pin=True):
+    r"""
+    Returns one (pinned) host copy per tensor. CPU tensors are re-pointed to
+    their pinned copy so host memory is not held twice.
+    """
+    host = []
+    for t in tensors:
+        h = t.data if t.device.type == 'cpu' else t.data.cpu()
+        if pin and not h.is_pinned():
+            h = h.pin_memory()
+        if t.device.type == 'cpu':
+            t.data = h
+        host.append(h)
+    return host
+
+
+def _to_device(tensors, host, device):
+    r"""
+    Non-blocking copy of `host` into fresh device tensors on the current stream.
+    """
+    for t, h in zip(tensors, host):
+        if t.device != device:
+            d = torch.empty_like(h, device=device)
+            d.copy_(h, non_blocking=True)
+            t.data = d
+
+
+def _to_host(tensors, host):
+    for t, h in zip(tensors, host):
+        t.data = h
+
+
+class ExpertResidency:
+    r"""
+    Keeps the experts of an MoE pipeline (high/low noise DiT) on the GPU or in
+    pinned host memory, and moves them without stalling the sampling loop.
+
+    Every expert is moved by its own `ModelOffloader`. Evicting re-points its
+    tensors to their pinned host copies, which needs no device-to-host
+    transfer. Loading streams the blocks in on a side stream,
+    `prefetch_blocks` ahead of their execution, and keeps them resident once
+    they ran. An expert switch therefore overlaps with the first forward of
+    the incoming expert instead of waiting for a full copy, also when the
+    outgoing expert has to make room first ('swap', or 'auto' without room
+    for both). `prefetch` starts the copy during the last step of the
+    outgoing expert: the whole incoming expert if both fit, otherwise its
+    first `prefetch_blocks` blocks.
+
+    Policies:
+        - 'resident': load every expert once and never evict.
+        - 'swap': at most one expert on the GPU at a time.
+        - 'auto': keep experts resident while the free GPU memory stays above
+          `reserve_bytes`, swap otherwise.
+
+    Args:
+        experts (dict[str, torch.nn.Module]):
+            Experts by name. Modules may start on the CPU or on `device`.
+        device (torch.device):
+            Target GPU.
+        policy (`str`, *optional*, defaults to 'auto'):
+            One of 'auto', 'resident' or 'swap'.
+        reserve_bytes (`int`, *optional*, defaults to None):
+            GPU memory to leave free for activations and VAE decode in 'auto'
+            mode. Defaults to 20% of the device memory.
+        pin (`bool`, *optional*, defaults to True):
+            Use pinned host copies. Disable for sharded (FSDP) experts, which
+            are then moved with plain `.to()`.
+        prefetch_blocks (`int`, *optional*, defaults to 2):
+            Blocks streamed ahead of execution while an expert is loaded.
+    """
+
+    def __init__(self,
+                 experts,
+                 device,
+                 policy='auto',
+                 reserve_bytes=None,
+                 pin=True,
+                 prefetch_blocks=2):
+        assert policy in ('auto', 'resident', 'swap'), policy
+        self.experts = dict(experts)
+        self.device = _device(device)
+        self.policy = policy
+        self.pin = pin and self.device.type == 'cuda'
+        if reserve_bytes is None and self.device.type == 'cuda':
+            reserve_bytes = torch.cuda.get_device_properties(
+                self.device).total_memory // 5
+        self.reserve_bytes = reserve_bytes or 0
+        self.offloaders = {
+            name: ModelOffloader(module, self.device, prefetch_blocks,
+                                 self.pin)
+            for name, module in self.experts.items()
+        }
+        # experts with a prefetch in flight -> whether they fit next to the others
+        self._prefetched = {}
+        self._active = None
+        self.stats = {'switches': 0, 'prefetched': 0, 'cold_loads': 0}
+
+    def on_device(self, name):
+        return next(self.experts[name].parameters()).device == self.device
+
+    def _free_bytes(self):
+        if self.device.type != 'cuda':
+            return float('inf')
+        free, _ = torch.cuda.mem_get_info(self.device)
+        cached = torch.cuda.memory_reserved(
+            self.device) - torch.cuda.memory_allocated(self.device)
+        return free + cached
+
+    def _fits(self, name):
+        if self.policy == 'resident':
+            return True
+        if self.policy == 'swap':
+            return False
+        return self._free_bytes() - _nbytes(
+            self.experts[name]) >= self.reserve_bytes
+
+    def evict(self, name):
+        r"""
+        Moves an expert off the GPU, including blocks still in flight. Free
+        with pinned copies, since the device tensors are simply dropped in
+        favour of the host copy.
+        """
+        self._prefetched.pop(name, None)
+        if self.pin or self.on_device(name):
+            self.offloaders[name].offload()
+
+    def prefetch(self, name):
+        r"""
+        Starts copying an expert on the side stream while the current expert
+        is still computing: all of it if it fits next to the experts already
+        on the GPU, otherwise only its first blocks, the rest is streamed in
+        by `acquire`.
+        """
+        if not self.pin or self.on_device(name) or name in self._prefetched:
+            return
+        fits = self._fits(name)
+        offloader = self.offloaders[name]
+        offloader.prefetch(None if fits else offloader.prefetch_blocks)
+        self._prefetched[name] = fits
+        self.stats['prefetched'] += 1
+
+    def acquire(self, name):
+        r"""
+        Returns the expert `name` ready for use on the current stream, evicting
+        the other experts first if they cannot stay resident. Blocks that have
+        not arrived yet are streamed in during the returned expert's forward.
+        """
+        if not self.on_device(name):
+            fits = self._prefetched.pop(name, None)
+            if fits is None:
+                fits = self._fits(name)
+                self.stats['cold_loads'] += 1
+            if not fits:
+                for other in self.experts:
+                    if other != name:
+                        self.evict(other)
+            self.offloaders[name].load(stream_blocks=True, keep_blocks=True)
+        if self._active not in (None, name):
+            self.stats['switches'] += 1
+        self._active = name
+        return self.experts[name]
+
+    def release(self, offload):
+        r"""
+        Ends a sampling loop. With `offload`, experts that cannot stay resident
+        are evicted to make room for VAE decode; pinned host copies are kept,
+        so the next job reloads them with a single DMA.
+        """
+        if not offload or self.policy == 'resident':
+            return
+        for name in self.experts:
+            if self.policy == 'swap' or self._free_bytes(
+            ) < self.reserve_bytes:
+                self.evict(name)
+        logging.debug(f'Expert residency: {self.stats}')
+
+
+class ModelOffloader:
+    r"""
+    Pinned-memory offloading for a model that alternates between the GPU and
+    the CPU once per job (DiT before sampling, T5 around a prompt encode).
+
+    Every tensor keeps one pinned host copy, so `offload` is free (tensors are
+    re-pointed to the host copy) and `load` never blocks the host. With
+    `prefetch_blocks > 0`, `load` only places the non-block parameters
+    (embeddings, head) on the GPU; each entry of `model.blocks` is copied in on
+    a side stream `prefetch_blocks` blocks ahead of its execution and dropped
+    right after it ran, so at most `prefetch_blocks + 1` blocks are resident.
+    With `keep_blocks` the streamed blocks stay resident instead, which hides
+    a full load behind the first forward. Block memory is allocated on the
+    compute stream, so memory released there (dropped blocks, an evicted
+    model) is reused without a device synchronization. Code that reads a block's weights outside its forward must call
+    `ensure_block` first; models with a `block_streamer` attribute get the
+    offloader assigned there while blocks are streamed.
+
+    Args:
+        model (torch.nn.Module):
+            Model to offload. Its weights are assumed to be frozen.
+        device (torch.device):
+            Target GPU.
+        prefetch_blocks (`int`, *optional*, defaults to 0):
+            Blocks to stream ahead of execution. 0 loads the whole model.
+        pin (`bool`, *optional*, defaults to True):
+            Use pinned host copies. Without them (e.g. FSDP-sharded models)
+            `load`/`offload` fall back to `.to()` and `torch.cuda.empty_cache()`.
+    """
+
+    def __init__(self, model, device, prefetch_blocks=0, pin=True):
+        self.model = model
+        self.device = _device(device)
+        self.pin = pin and self.device.type == 'cuda'
+        self.prefetch_blocks = prefetch_blocks if self.pin else 0
+        blocks = getattr(model, 'blocks', []) if self.prefetch_blocks else []
+        self.blocks = [_tensors(b) for b in blocks]
+        in_blocks = {id(t) for u in self.blocks for t in u}
+        self.trunk = [t for t in _tensors(model) if id(t) not in in_blocks]
+        self._host = None
+        self._pending = {}
+        self._stream = None
+        self._hooks = []
+        self._keep = False
+        self._modules = list(blocks)
+
+    def _host_copies(self):
+        if self._host is None:
+            self._host = (_host_copies(self.trunk, self.pin),
+                          [_host_copies(u, self.pin) for u in self.blocks])
+        return self._host
+
+    def load(self, stream_blocks=True, keep_blocks=False):
+        r"""
+        Makes the model runnable on `self.device`. Returns immediately, the
+        copies are ordered on the current stream.
+
+        Args:
+            stream_blocks (`bool`, *optional*, defaults to True):
+                Stream the blocks during forward. If False, the whole model is
+                loaded and stays resident until `offload`.
+            keep_blocks (`bool`, *optional*, defaults to False):
+                Keep streamed blocks resident once they ran. The hooks are
+                removed as soon as the last block is in.
+        """
+        if not self.pin:
+            self.model.to(self.device)
+            return
+        trunk, blocks = self._host_copies()
+        _to_device(self.trunk, trunk, self.device)
+        if not (stream_blocks and self.blocks):
+            self._settle()
+            for u, h in zip(self.blocks, blocks):
+                _to_device(u, h, self.device)
+            return
+        if self._hooks and self._keep != keep_blocks:
+            self._remove_hooks()
+        self._keep = keep_blocks
+        if not self._hooks:
+            if hasattr(self.model, 'block_streamer'):
+                self.model.block_streamer = self
+            for i, block in enumerate(self._modules):
+                self._hooks.append(
+                    block.register_forward_pre_hook(
+                        lambda m, args, i=i: self._enter(i)))
+                if not keep_blocks:
+                    self._hooks.append(
+                        block.register_forward_hook(
+                            lambda m, args, out, i=i: self._exit(i)))
+        self.prefetch(self.prefetch_blocks)
+
+    def prefetch(self, count=None):
+        r"""
+        Starts copying the first `count` blocks (all by default) on the side
+        stream, e.g. while another model is still computing. A later `load`
+        picks them up.
+        """
+        if not self.pin:
+            return
+        self._host_copies()
+        n = len(self.blocks)
+        for i in range(n if count is None else min(count, n)):
+            self._prefetch(i)
+
+    def offload(self):
+        r"""
+        Moves the model back to the CPU and removes the block hooks.
+        """
+        if not self.pin:
+            self.model.cpu()
+            torch.cuda.empty_cache()
+            return
+        self._settle()
+        trunk, blocks = self._host_copies()
+        _to_host(self.trunk, trunk)
+        for u, h in zip(self.blocks, blocks):
+            _to_host(u, h)
+
+    def _remove_hooks(self):
+        for h in self._hooks:
+            h.remove()
+        self._hooks = []
+        if getattr(self.model, 'block_streamer', None) is self:
+            self.model.block_streamer = None
+
+    def _settle(self):
+        self._remove_hooks()
+        for i in list(self._pending):
+            self._wait(i)
+
+    def _wait(self, i):
+        torch.cuda.current_stream(self.device).wait_event(self._pending.pop(i))
+
+    def _prefetch(self, i):
+        if i in self._pending or self.blocks[i][0].device == self.device:
+            return
+        if self._stream is None:
+            self._stream = torch.cuda.Stream(self.device)
+        current = torch.cuda.current_stream(self.device)
+        # allocated on the compute stream (see the class docstring); the copy
+        # waits for the work already queued there, i.e. the last use of any
+        # memory it reuses
+        for t, h in zip(self.blocks[i], self._host[1][i]):
+            t.data = torch.empty_like(h, device=self.device)
+        self._stream.wait_stream(current)
+        with torch.cuda.stream(self._stream):
+            for t, h in zip(self.blocks[i], self._host[1][i]):
+                t.data.copy_(h, non_blocking=True)
+        self._pending[i] = self._stream.record_event()
+
+    def ensure_block(self, i):
+        r"""
+        Makes block `i` usable on the current stream ahead of its forward,
+        e.g. for `StepCache`, which reads block 0 to decide whether the stack
+        runs at all. The block's own pre-hook then finds it in place.
+        """
+        if self._hooks:
+            self._enter(i)
+
+    def _enter(self, i):
+        if i in self._pending:
+            self._wait(i)
+        else:
+            _to_device(self.blocks[i], self._host[1][i], self.device)
+        n = len(self.blocks)
+        if self._keep:
+            for j in range(i + 1, min(i + 1 + self.prefetch_blocks, n)):
+                self._prefetch(j)
+            if i == n - 1:
+                # everything is in, later forwards run without hooks
+                self._settle()
+            return
+        # wraps around, so the next forward finds its first blocks in flight
+        for j in range(i + 1, i + 1 + self.prefetch_blocks):
+            if j % n != i:
+                self._prefetch(j % n)
+
+    def _exit(self, i):
+        _to_host(self.blocks[i], self._host[1][i])
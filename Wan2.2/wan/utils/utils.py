@@ -1,17 +1,21 @@
 # Copyright 2024-2025 The Alibaba Wan Team Authors. All rights reserved.
 import argparse
 import binascii
+import concurrent.futures
 import logging
 import os
 import os.path as osp
+import queue
 import shutil
 import subprocess
+import tempfile
+import threading
+import time
 
-import imageio
 import torch
 import torchvision
 
-__all__ = ['save_video', 'save_image', 'str2bool']
+__all__ = ['save_video', 'StreamingVideoWriter', 'save_image', 'str2bool']
 
 
 def rand_name(length=8, suffix=''):
@@ -87,6 +91,245 @@ def merge_video_audio(video_path: str, audio_path: str):
         logging.error(f"merge_video_audio failed with error: {e}")
 
 
+def _ffmpeg_exe():
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return 'ffmpeg'
+
+
+class StreamingVideoWriter:
+    r"""
+    Incremental mp4 writer. Chunks are converted to uint8 RGB on their own
+    device, copied into pinned host buffers and piped as raw frames into one
+    ffmpeg (libx264) process by a background thread, so encoding overlaps with
+    whatever the caller computes next. Pairs with `Wan2_2_VAE.decode_stream`.
+
+    Args:
+        save_file (`str`): Output path.
+        fps (`int`, *optional*, defaults to 30): Frame rate.
+        nrow, normalize, value_range: As in `torchvision.utils.make_grid`.
+        preset (`str`, *optional*, defaults to 'medium'):
+            x264 preset; 'veryfast' / 'ultrafast' trade file size for CPU time.
+        crf (`int`, *optional*, defaults to 10):
+            x264 quality (10 is what imageio's quality=8 used before).
+        max_pending (`int`, *optional*, defaults to 4):
+            Chunks in flight before `write` blocks.
+    """
+
+    def __init__(self,
+                 save_file,
+                 fps=30,
+                 nrow=8,
+                 normalize=True,
+                 value_range=(-1, 1),
+                 preset='medium',
+                 crf=10,
+                 max_pending=4):
+        self.save_file = save_file
+        self.fps = fps
+        self.nrow = nrow
+        self.normalize = normalize
+        self.value_range = value_range
+        self.preset = preset
+        self.crf = crf
+        self.frames = 0
+        self._proc = None
+        self._stderr = None
+        self._thread = None
+        self._error = None
+        self._closed = False
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(max_pending)
+        self._pool = {}
+        self._pool_lock = threading.Lock()
+        self._future = concurrent.futures.Future()
+        self._t0 = time.perf_counter()
+        self._stats = {'bytes_in': 0, 'pipe_s': 0.0, 'stall_s': 0.0}
+
+    def _to_frames(self, chunk):
+        # [C, T, H, W] / [B, C, T, H, W] -> uint8 [T, H, W, 3] on the same device
+        if chunk.dim() == 4:
+            chunk = chunk.unsqueeze(0)
+        low, high = min(self.value_range), max(self.value_range)
+        chunk = chunk.clamp(low, high)
+        if chunk.size(0) == 1:
+            # single video: make_grid would only normalize
+            x = chunk[0]
+            if self.normalize:
+                x = x.sub(low).div(max(high - low, 1e-5))
+            x = x.permute(1, 2, 3, 0)
+        else:
+            x = torch.stack([
+                torchvision.utils.make_grid(
+                    u,
+                    nrow=self.nrow,
+                    normalize=self.normalize,
+                    value_range=self.value_range) for u in chunk.unbind(2)
+            ],
+                            dim=1).permute(1, 2, 3, 0)
+        return (x * 255).type(torch.uint8).contiguous()
+
+    def _start(self, height, width):
+        self._stderr = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen([
+            _ffmpeg_exe(), '-y', '-loglevel', 'error', '-f', 'rawvideo',
+            '-pix_fmt', 'rgb24', '-s', f'{width}x{height}', '-r',
+            str(self.fps), '-i', '-', '-an', '-c:v', 'libx264', '-preset',
+            self.preset, '-crf',
+            str(self.crf), '-pix_fmt', 'yuv420p', self.save_file
+        ],
+                                      stdin=subprocess.PIPE,
+                                      stderr=self._stderr)
+        self._thread = threading.Thread(
+            target=self._run, name='video-writer', daemon=True)
+        self._thread.start()
+
+    def _buffer(self, shape):
+        with self._pool_lock:
+            free = self._pool.setdefault(tuple(shape), [])
+            if free:
+                return free.pop()
+        return torch.empty(shape, dtype=torch.uint8, pin_memory=True)
+
+    def _recycle(self, buf):
+        if buf.is_pinned():
+            with self._pool_lock:
+                self._pool[tuple(buf.shape)].append(buf)
+
+    def write(self, chunk):
+        r"""
+        Queues a chunk [C, T, H, W] (one video) or [B, C, T, H, W] (tiled into
+        a grid per frame, like `save_video`). Returns once the device-to-host
+        copy is queued; blocks only if `max_pending` chunks are still in flight.
+        """
+        if self._error is not None:
+            raise RuntimeError(
+                f'video writer failed: {self._error}') from self._error
+        assert not self._closed, 'writer is closed'
+        frames = self._to_frames(chunk)
+        if self._proc is None:
+            self._start(frames.size(1), frames.size(2))
+
+        t0 = time.perf_counter()
+        self._slots.acquire()
+        self._stats['stall_s'] += time.perf_counter() - t0
+        if frames.device.type == 'cuda':
+            buf = self._buffer(frames.shape)
+            buf.copy_(frames, non_blocking=True)
+            event = torch.cuda.Event()
+            event.record(torch.cuda.current_stream(frames.device))
+        else:
+            buf, event = frames.cpu(), None
+        self.frames += frames.size(0)
+        self._queue.put((buf, event))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            buf, event = item
+            try:
+                if self._error is None:
+                    if event is not None:
+                        event.synchronize()
+                    t0 = time.perf_counter()
+                    self._proc.stdin.write(memoryview(buf.numpy()).cast('B'))
+                    self._stats['pipe_s'] += time.perf_counter() - t0
+                    self._stats['bytes_in'] += buf.numel()
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._recycle(buf)
+                self._slots.release()
+        self._finish()
+
+    def _finish(self):
+        try:
+            try:
+                self._proc.stdin.close()
+            except BrokenPipeError:
+                pass
+            returncode = self._proc.wait()
+            if self._error is None and returncode != 0:
+                self._stderr.seek(0)
+                err = self._stderr.read().decode(errors='replace')[-2000:]
+                self._error = RuntimeError(
+                    f'ffmpeg exited with {returncode}: {err}')
+        finally:
+            self._stderr.close()
+        if self._error is not None:
+            self._future.set_exception(self._error)
+        else:
+            self._future.set_result(self._result())
+
+    def _result(self):
+        return {
+            'path': self.save_file,
+            'frames': self.frames,
+            'size_bytes': os.path.getsize(self.save_file)
+                          if osp.isfile(self.save_file) else 0,
+            'wall_s': round(time.perf_counter() - self._t0, 3),
+            'pipe_s': round(self._stats['pipe_s'], 3),
+            'stall_s': round(self._stats['stall_s'], 3),
+            'bytes_in': self._stats['bytes_in'],
+            'preset': self.preset,
+        }
+
+    def close(self, wait=True):
+        r"""
+        Flushes the remaining frames and finalizes the file.
+
+        Args:
+            wait (`bool`, *optional*, defaults to True):
+                Block until ffmpeg has finished. Otherwise a
+                `concurrent.futures.Future` is returned and the tail of the
+                encode runs in the background.
+
+        Returns:
+            dict | Future: Encoding stats: path, frames, size_bytes, wall_s,
+            pipe_s (time writing to ffmpeg), stall_s (time `write` waited for
+            a free buffer), bytes_in, preset.
+        """
+        if not self._closed:
+            self._closed = True
+            if self._proc is None:
+                self._future.set_result(self._result())
+            else:
+                self._queue.put(None)
+        return self._future.result() if wait else self._future
+
+    def abort(self):
+        r"""
+        Stops encoding and kills ffmpeg (the partial file is left to the caller).
+        """
+        if self._error is None:
+            self._error = RuntimeError('aborted')
+        if self._proc is not None:
+            self._proc.kill()
+        if not self._closed:
+            self._closed = True
+            if self._proc is None:
+                self._future.set_exception(self._error)
+            else:
+                self._queue.put(None)
+        try:
+            self._future.exception()
+        except concurrent.futures.CancelledError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+
 def save_video(tensor,
                save_file=None,
                fps=30,
@@ -100,22 +343,20 @@ def save_video(tensor,
 
     # save to cache
     try:
-        # preprocess
-        tensor = tensor.clamp(min(value_range), max(value_range))
-        tensor = torch.stack([
-            torchvision.utils.make_grid(
-                u, nrow=nrow, normalize=normalize, value_range=value_range)
-            for u in tensor.unbind(2)
-        ],
-                             dim=1).permute(1, 2, 3, 0)
-        tensor = (tensor * 255).type(torch.uint8).cpu()
-
-        # write video
-        writer = imageio.get_writer(
-            cache_file, fps=fps, codec='libx264', quality=8)
-        for frame in tensor.numpy():
-            writer.append_data(frame)
-        writer.close()
+        writer = StreamingVideoWriter(
+            cache_file,
+            fps=fps,
+            nrow=nrow,
+            normalize=normalize,
+            value_range=value_range)
+        # write video in chunks of frames (no full uint8 copy of the clip)
+        try:
+            for chunk in tensor.split(16, dim=2):
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.close()
     except Exception as e:
         logging.info(f'save_video failed, error: {e}')
 
@@ -0,0 +1,264 @@
+# app/job_store.py
+# Job-Status für Wan + ThinkSound in einer SQLite-DB (WAL) statt
+# JOBS_DIR/<job_id>/job.json + result.json. Status-Polls kommen aus einem
+# In-Memory-Cache, Übergänge sind atomar (UPDATE ... WHERE status IN ...).
+
+from typing import Optional, Dict, Any, List, Iterable, Callable
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import os, json, sqlite3, threading, logging, shutil
+
+JOBS_DIR = os.getenv("JOBS_DIR", "/workspace/jobs")
+JOBS_DB = os.getenv("JOBS_DB", os.path.join(JOBS_DIR, "jobs.sqlite3"))
+JOBS_LOG_DIR = os.path.join(JOBS_DIR, "logs")
+# fertige Jobs (done/error) werden nach JOBS_TTL_S samt Log + Ausgabedateien entfernt
+JOBS_TTL_S = int(os.getenv("JOBS_TTL_S", str(7 * 24 * 3600)))
+JOBS_TTL_DELETE_OUTPUTS = os.getenv("JOBS_TTL_DELETE_OUTPUTS", "on") == "on"
+JOBS_CACHE_SIZE = int(os.getenv("JOBS_CACHE_SIZE", "4096"))
+# Neustart: Jobs in queued/running erneut einreihen ("requeue") oder als error markieren ("fail")
+JOBS_RECOVERY = os.getenv("JOBS_RECOVERY", "requeue")
+JOBS_MAX_ATTEMPTS = int(os.getenv("JOBS_MAX_ATTEMPTS", "2"))
+
+ACTIVE = ("queued", "running")
+FINISHED = ("done", "error")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id      TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    created_at  TEXT NOT NULL,
+    started_at  TEXT,
+    finished_at TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    gpu         INTEGER,
+    returncode  INTEGER,
+    error       TEXT,
+    log_path    TEXT,
+    params      TEXT,
+    result      TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs(status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_kind_created ON jobs(kind, created_at);
+"""
+
+_JSON_COLS = ("params", "result")
+
+
+def now_iso() -> str:
+    return datetime.utcnow().isoformat() + "Z"
+
+
+def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    job = dict(row)
+    for col in _JSON_COLS:
+        if job.get(col) is not None:
+            job[col] = json.loads(job[col])
+    return job
+
+
+class JobStore:
+    def __init__(self, path: str = JOBS_DB, cache_size: int = JOBS_CACHE_SIZE):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        os.makedirs(JOBS_LOG_DIR, exist_ok=True)
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.RLock()
+        self._cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._cache_size = cache_size
+
+    # ---- Cache ----
+    def _remember(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        self._cache[job["job_id"]] = job
+        self._cache.move_to_end(job["job_id"])
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return job
+
+    def _load(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._cache.get(job_id)
+        if job is not None:
+            self._cache.move_to_end(job_id)
+            return job
+        row = self._db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._remember(_row_to_job(row)) if row else None
+
+    # ---- Schreiben ----
+    def create(self, job_id: str, kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        job = {
+            "job_id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "created_at": now_iso(),
+            "started_at": None,
+            "finished_at": None,
+            "attempts": 0,
+            "gpu": None,
+            "returncode": None,
+            "error": None,
+            "log_path": os.path.join(JOBS_LOG_DIR, f"{job_id}.log"),
+            "params": params,
+            "result": None,
+        }
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (job_id, kind, status, created_at, attempts, log_path, params) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, job["status"], job["created_at"], 0, job["log_path"], json.dumps(params)),
+            )
+            return dict(self._remember(job))
+
+    def transition(self, job_id: str, to_status: str, from_status: Iterable[str] = None,
+                   **fields) -> bool:
+        """
+        Setzt status=to_status (+ weitere Spalten) nur, wenn der Job aktuell in
+        `from_status` ist. Gibt False zurück, wenn der Übergang nicht passt.
+        """
+        fields["status"] = to_status
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        vals = [json.dumps(v) if k in _JSON_COLS and v is not None else v for k, v in fields.items()]
+        sql = f"UPDATE jobs SET {cols} WHERE job_id = ?"
+        vals.append(job_id)
+        if from_status is not None:
+            from_status = tuple(from_status)
+            sql += f" AND status IN ({', '.join('?' * len(from_status))})"
+            vals.extend(from_status)
+        with self._lock:
+            if self._db.execute(sql, vals).rowcount != 1:
+                return False
+            job = self._cache.get(job_id)
+            if job is not None:
+                job.update(fields)
+            return True
+
+    def mark_running(self, job_id: str, gpu: Optional[int] = None) -> bool:
+        with self._lock:
+            job = self._load(job_id)
+            if job is None:
+                return False
+            return self.transition(job_id, "running", ("queued",),
+                                   started_at=now_iso(), gpu=gpu, attempts=job["attempts"] + 1)
+
+    def mark_done(self, job_id: str, result: Dict[str, Any]) -> bool:
+        return self.transition(job_id, "done", ACTIVE, finished_at=now_iso(),
+                               returncode=0, result=result)
+
+    def mark_error(self, job_id: str, error: str) -> bool:
+        return self.transition(job_id, "error", ACTIVE, finished_at=now_iso(),
+                               returncode=1, error=error)
+
+    def delete(self, job_id: str) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+            self._cache.pop(job_id, None)
+
+    # ---- Lesen ----
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._load(job_id)
+            return dict(job) if job else None
+
+    def list(self, status: Optional[Iterable[str]] = None, kind: Optional[str] = None,
+             since: Optional[str] = None, until: Optional[str] = None,
+             limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        """Neueste zuerst. `since`/`until` sind ISO-Zeitstempel auf created_at."""
+        where, vals = [], []
+        if status:
+            status = [status] if isinstance(status, str) else list(status)
+            where.append(f"status IN ({', '.join('?' * len(status))})")
+            vals.extend(status)
+        if kind:
+            where.append("kind = ?")
+            vals.append(kind)
+        if since:
+            where.append("created_at >= ?")
+            vals.append(since)
+        if until:
+            where.append("created_at < ?")
+            vals.append(until)
+        sql = "SELECT * FROM jobs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
+        vals.extend([limit, offset])
+        with self._lock:
+            return [_row_to_job(r) for r in self._db.execute(sql, vals).fetchall()]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status").fetchall()
+        return {r["status"]: r["n"] for r in rows}
+
+    # ---- Wartung ----
+    def cleanup(self, ttl_s: int = JOBS_TTL_S, delete_outputs: bool = JOBS_TTL_DELETE_OUTPUTS) -> int:
+        """Entfernt fertige Jobs älter als ttl_s samt Log (und optional Ausgabedateien)."""
+        cutoff = (datetime.utcnow() - timedelta(seconds=ttl_s)).isoformat() + "Z"
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT * FROM jobs WHERE status IN ({', '.join('?' * len(FINISHED))}) AND finished_at < ?",
+                (*FINISHED, cutoff),
+            ).fetchall()
+        n = 0
+        for row in rows:
+            job = _row_to_job(row)
+            paths = [job.get("log_path")]
+            if delete_outputs:
+                # absolute Pfade, die der Worker erzeugt hat (siehe *_api.py)
+                paths += (job.get("result") or {}).get("artifacts") or []
+            for p in paths:
+                if p and os.path.isfile(p):
+                    try:
+                        os.remove(p)
+                    except OSError as e:
+                        logging.warning(f"[job_store] {p} nicht löschbar: {e}")
+            # Altlast: frühere JOBS_DIR/<job_id>/-Verzeichnisse
+            shutil.rmtree(os.path.join(JOBS_DIR, job["job_id"]), ignore_errors=True)
+            self.delete(job["job_id"])
+            n += 1
+        if n:
+            logging.info(f"[job_store] {n} abgelaufene Jobs entfernt")
+        return n
+
+    def interrupted(self) -> List[Dict[str, Any]]:
+        """Jobs, die beim letzten Prozessende noch in queued/running hingen (älteste zuerst)."""
+        return list(reversed(self.list(status=ACTIVE, limit=-1)))
+
+    def recover(self, requeue: Dict[str, Callable[[Dict[str, Any]], None]],
+                policy: str = JOBS_RECOVERY, max_attempts: int = JOBS_MAX_ATTEMPTS) -> Dict[str, int]:
+        """
+        Beim Start: hängengebliebene Jobs über requeue[kind](job) neu einreihen oder
+        als error markieren. Jobs, die schon max_attempts-mal gestartet wurden (z.B.
+        weil sie den Prozess selbst abschießen), werden nicht erneut versucht.
+        """
+        stats = {"requeued": 0, "failed": 0}
+        for job in self.interrupted():
+            fn = requeue.get(job["kind"])
+            if policy == "requeue" and fn is not None and job["attempts"] < max_attempts:
+                try:
+                    self.transition(job["job_id"], "queued", ACTIVE, started_at=None, gpu=None)
+                    fn(self.get(job["job_id"]))
+                    stats["requeued"] += 1
+                    continue
+                except Exception as e:
+                    logging.warning(f"[job_store] Requeue von {job['job_id']} fehlgeschlagen: {e}")
+            self.mark_error(job["job_id"], "interrupted by restart")
+            stats["failed"] += 1
+        if any(stats.values()):
+            logging.info(f"[job_store] Recovery: {stats}")
+        return stats
+
+
+_STORE: Optional[JobStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_job_store() -> JobStore:
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = JobStore()
+        return _STORE
@@ -1,22 +1,29 @@
 # /workspace/app/main.py
 from fastapi import FastAPI, BackgroundTasks, Request, HTTPException
+from typing import Optional
 from .editor_api import EditRequest, render_edit
 from fastapi.staticfiles import StaticFiles
 from pathlib import Path
-from fastapi.responses import FileResponse
-import os
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+import os, threading, time, logging
 from .wan_api import (
     TI2VRequest,
     run_wan_ti2v,
     submit_job,
+    requeue_job,
     get_status,
     get_result,
     WAN_ROOT, WAN_CKPT
 )
+from .wan_worker import get_wan_worker
 
 from .thinksound_api import (
-    TSRequest, run_thinksound, submit_ts_job, get_ts_status, get_ts_result, THINK_ROOT
+    TSRequest, run_thinksound, submit_ts_job, requeue_ts_job, get_ts_status, get_ts_result, THINK_ROOT
 )
+from .thinksound_worker import get_ts_worker, THINK_CKPT
+from .scheduler import get_scheduler, QueueFull
+from .job_store import get_job_store
+from .progress import sse_events
 
 
 
@@ -48,10 +55,68 @@ app.mount(
 WAN_FLAG_FILE = "/workspace/status/wan2.2_ready"
 
 
+# Wan- und ThinkSound-Modelle einmal pro Pod laden (im Hintergrund, API ist sofort erreichbar).
+# Sind die Gewichte noch nicht geladen (init.sh läuft noch), passiert das beim ersten Job.
+@app.on_event("startup")
+def warmup_workers():
+    for gpu in get_scheduler().gpus:
+        if os.getenv("WAN_WARMUP", "on") == "on" and os.path.exists(WAN_FLAG_FILE):
+            threading.Thread(target=get_wan_worker(gpu).warmup, daemon=True).start()
+        if os.getenv("TS_WARMUP", "on") == "on" and os.path.exists(THINK_CKPT):
+            threading.Thread(target=get_ts_worker(gpu).warmup, daemon=True).start()
+
+
+# Jobs, die beim letzten Prozessende noch queued/running waren, neu einreihen (oder als error markieren);
+# danach regelmäßig abgelaufene Jobs samt Logs/Ausgaben aufräumen.
+JOBS_CLEANUP_INTERVAL_S = int(os.getenv("JOBS_CLEANUP_INTERVAL_S", "3600"))
+
+@app.on_event("startup")
+def recover_jobs():
+    store = get_job_store()
+    store.recover({"wan": requeue_job, "thinksound": requeue_ts_job})
+
+    def _cleanup_loop():
+        while True:
+            try:
+                store.cleanup()
+            except Exception:
+                logging.exception("[job_store] cleanup fehlgeschlagen")
+            time.sleep(JOBS_CLEANUP_INTERVAL_S)
+
+    threading.Thread(target=_cleanup_loop, name="jobs-cleanup", daemon=True).start()
+
+
+# Queue voll → 429 statt noch einen Job auf die GPU zu legen
+@app.exception_handler(QueueFull)
+def queue_full_handler(request: Request, exc: QueueFull):
+    return JSONResponse(
+        status_code=429,
+        content={"ok": False, "error": "queue_full", "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
 
 @app.get("/health")
 def health():
-    return {"status":"ok","WAN_ROOT":WAN_ROOT,"WAN_CKPT_DIR":WAN_CKPT}
+    gpus = get_scheduler().gpus
+    return {
+        "status":"ok","WAN_ROOT":WAN_ROOT,"WAN_CKPT_DIR":WAN_CKPT,
+        "wan_worker_ready": all(get_wan_worker(g).ready for g in gpus),
+        "ts_worker_ready": all(get_ts_worker(g).ready for g in gpus),
+        "scheduler": get_scheduler().stats(),
+        "jobs": get_job_store().counts(),
+    }
+
+
+# Jobs auflisten, z.B. /jobs?status=running&kind=wan&since=2025-01-01T00:00:00
+@app.get("/jobs")
+def list_jobs(status: Optional[str] = None, kind: Optional[str] = None,
+              since: Optional[str] = None, until: Optional[str] = None,
+              limit: int = 100, offset: int = 0):
+    statuses = status.split(",") if status else None
+    jobs = get_job_store().list(status=statuses, kind=kind, since=since, until=until,
+                                limit=min(limit, 1000), offset=offset)
+    return {"jobs": jobs, "count": len(jobs)}
 
 # ---- Sync (blockierend, wie gehabt) ----
 @app.post("/wan/generate")
@@ -68,6 +133,12 @@ def wan_submit(request: TI2VRequest, bg: BackgroundTasks):
 def wan_status(job_id: str):
     return get_status(job_id)
 
+# Live-Fortschritt als Server-Sent-Events (statt blind zu pollen)
+@app.get("/wan/events/{job_id}")
+def wan_events(job_id: str):
+    return StreamingResponse(sse_events(job_id, get_status), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
 @app.get("/wan/result/{job_id}")
 def wan_result(job_id: str):
     return get_result(job_id)
@@ -98,6 +169,11 @@ def ts_submit(request: TSRequest):
 def ts_status(job_id: str):
     return get_ts_status(job_id)
 
+@app.get("/thinksound/events/{job_id}")
+def ts_events(job_id: str):
+    return StreamingResponse(sse_events(job_id, get_ts_status), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
 @app.get("/thinksound/result/{job_id}")
 def ts_result(job_id: str, request: Request):
     res = get_ts_result(job_id)
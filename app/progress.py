@@ -0,0 +1,168 @@
+# app/progress.py
+# Live-Fortschritt laufender Jobs (Stage, Schritt i/N, Laufzeit, ETA).
+# Die Sampling-Schleifen in Wan2.2 / ThinkSound rufen einen Callback auf,
+# der hier landet; get_status liest daraus, /…/events/{job_id} streamt es per SSE.
+
+from typing import Optional, Dict, Any, Tuple, Iterator
+import json, time, threading
+
+# Anteil jeder Stage am Gesamtfortschritt (Start, Ende) – grob nach gemessener Laufzeit
+STAGE_SPANS: Dict[str, Dict[str, Tuple[float, float]]] = {
+    "wan": {
+        "text-encode": (0.00, 0.03),
+        "vae-encode": (0.03, 0.05),
+        "denoise": (0.05, 0.90),
+        "vae-decode": (0.90, 0.97),
+        "mux": (0.97, 1.00),
+    },
+    "thinksound": {
+        "text-encode": (0.00, 0.15),   # MetaCLIP + Synchformer + T5
+        "denoise": (0.15, 0.85),
+        "vae-decode": (0.85, 0.95),
+        "mux": (0.95, 1.00),
+    },
+}
+
+# Tracker fertiger Jobs noch so lange halten (SSE-Clients holen sich das Endevent)
+_KEEP_FINISHED_S = 300
+
+
+class ProgressTracker:
+    """Fortschritt eines Jobs. `update()` ist der Callback für die Worker."""
+
+    def __init__(self, job_id: str, kind: str):
+        self.job_id = job_id
+        self.kind = kind
+        self.stage: Optional[str] = None
+        self.step = 0
+        self.total = 0
+        self.started = time.time()
+        self.stage_started = self.started
+        self.updated = self.started
+        self.finished: Optional[float] = None
+        self.status = "running"
+        self._version = 0
+        self._cv = threading.Condition()
+
+    def update(self, stage: str, step: int = 0, total: int = 0) -> None:
+        with self._cv:
+            now = time.time()
+            if stage != self.stage:
+                self.stage = stage
+                self.stage_started = now
+            self.step, self.total = step, total
+            self.updated = now
+            self._version += 1
+            self._cv.notify_all()
+
+    def finish(self, status: str) -> None:
+        with self._cv:
+            self.status = status
+            self.finished = self.updated = time.time()
+            self._version += 1
+            self._cv.notify_all()
+
+    def _fraction_locked(self) -> float:
+        if self.status == "done":
+            return 1.0
+        lo, hi = STAGE_SPANS.get(self.kind, {}).get(self.stage, (0.0, 0.0))
+        inner = self.step / self.total if self.total else 0.0
+        return lo + (hi - lo) * min(inner, 1.0)
+
+    def _eta_locked(self, now: float) -> Optional[float]:
+        # Denoise dominiert: ETA aus der Schrittgeschwindigkeit dieser Stage,
+        # hochgerechnet auf den restlichen Gesamtanteil
+        frac = self._fraction_locked()
+        if self.status != "running" or frac <= 0.0:
+            return None
+        if self.stage == "denoise" and self.step > 0 and self.total:
+            per_step = (now - self.stage_started) / self.step
+            lo, hi = STAGE_SPANS[self.kind]["denoise"]
+            rest_denoise = per_step * (self.total - self.step)
+            stage_s = per_step * self.total
+            return rest_denoise + stage_s * (1.0 - hi) / max(hi - lo, 1e-6)
+        return (now - self.started) * (1.0 - frac) / frac
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cv:
+            now = self.finished or time.time()
+            eta = self._eta_locked(now)
+            return {
+                "job_id": self.job_id,
+                "status": self.status,
+                "stage": self.stage,
+                "step": self.step,
+                "total_steps": self.total,
+                "progress": round(self._fraction_locked(), 4),
+                "elapsed_s": round(now - self.started, 1),
+                "eta_s": round(eta, 1) if eta is not None else None,
+                # seit wann kein Event mehr kam → hängende Jobs erkennen
+                "idle_s": round(time.time() - self.updated, 1),
+            }
+
+    def wait(self, version: int, timeout: float) -> int:
+        with self._cv:
+            if self._version == version and self.finished is None:
+                self._cv.wait(timeout)
+            return self._version
+
+
+_TRACKERS: Dict[str, ProgressTracker] = {}
+_LOCK = threading.Lock()
+
+
+def start_tracker(job_id: str, kind: str) -> ProgressTracker:
+    with _LOCK:
+        now = time.time()
+        for jid in [j for j, t in _TRACKERS.items() if t.finished and now - t.finished > _KEEP_FINISHED_S]:
+            del _TRACKERS[jid]
+        t = _TRACKERS[job_id] = ProgressTracker(job_id, kind)
+        return t
+
+
+def get_tracker(job_id: str) -> Optional[ProgressTracker]:
+    with _LOCK:
+        return _TRACKERS.get(job_id)
+
+
+def finish_tracker(job_id: str, status: str) -> None:
+    tracker = get_tracker(job_id)
+    if tracker is not None:
+        tracker.finish(status)
+
+
+def progress_fields(job_id: str, status: str) -> Dict[str, Any]:
+    """Fortschrittsfelder für get_status / get_ts_status (ohne Tracker: queued=0, done=1)."""
+    tracker = get_tracker(job_id)
+    if tracker is None or status == "queued":
+        return {"progress": 1.0 if status == "done" else 0.0, "stage": None}
+    snap = tracker.snapshot()
+    snap.pop("job_id")
+    snap.pop("status")
+    return snap
+
+
+def sse_events(job_id: str, status_fn, heartbeat_s: float = 15.0) -> Iterator[str]:
+    """
+    Server-Sent-Events für einen Job: ein Event pro Fortschritts-Update, Heartbeat-Kommentar
+    wenn nichts passiert. `status_fn(job_id)` liefert den Status für queued/fertige Jobs.
+    """
+    version = -1
+    while True:
+        tracker = get_tracker(job_id)
+        if tracker is None:
+            st = status_fn(job_id)
+            yield f"data: {json.dumps(st)}\n\n"
+            if st.get("error") == "job_not_found" or st.get("status") in ("done", "error"):
+                return
+            time.sleep(min(heartbeat_s, 2.0))   # noch in der Queue
+            continue
+        new_version = tracker.wait(version, heartbeat_s)
+        if new_version == version:
+            yield ": keep-alive\n\n"
+            continue
+        version = new_version
+        snap = tracker.snapshot()
+        yield f"data: {json.dumps(snap)}\n\n"
+        if snap["status"] in ("done", "error"):
+            return
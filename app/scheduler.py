@@ -0,0 +1,251 @@
+# app/scheduler.py
+# Gemeinsamer GPU-Scheduler für Wan- und ThinkSound-Jobs.
+# Statt pro Submit einen eigenen Thread zu starten, landen alle Jobs in einer
+# begrenzten Prioritäts-Queue; pro GPU laufen höchstens SCHED_GPU_CONCURRENCY Jobs.
+# Die Worker rechnen pro GPU und Modellart nur einen Job zur Zeit (eigener Lock),
+# daher laufen gleichzeitige Jobs einer GPU immer mit verschiedenen Modellarten
+# (z.B. Wan + ThinkSound); Werte > Anzahl der Arten bringen nichts.
+# Ist die Queue voll, wird der Job abgelehnt (HTTP 429 + Retry-After).
+
+from typing import Optional, Callable, Dict, Any, List
+import os, math, time, heapq, itertools, threading, logging
+
+SCHED_GPUS = [int(g) for g in os.getenv("SCHED_GPUS", "0").split(",") if g.strip() != ""]
+# Jobs pro GPU gleichzeitig, je Modellart höchstens einer (s.o.)
+SCHED_GPU_CONCURRENCY = int(os.getenv("SCHED_GPU_CONCURRENCY", "1"))
+SCHED_QUEUE_DEPTH = int(os.getenv("SCHED_QUEUE_DEPTH", "32"))
+# Jobs mit gleichem batch_key (z.B. Wan: gleiche Größe/Frames/Steps) werden zu einem
+# Batch von bis zu SCHED_MAX_BATCH Jobs zusammengefasst und gemeinsam gerechnet
+SCHED_MAX_BATCH = int(os.getenv("SCHED_MAX_BATCH", "4"))
+# Startwert für die Retry-After-Schätzung, bis echte Laufzeiten gemessen sind
+SCHED_DEFAULT_JOB_S = float(os.getenv("SCHED_DEFAULT_JOB_S", "60"))
+
+
+class QueueFull(Exception):
+    """Queue hat SCHED_QUEUE_DEPTH erreicht – Client soll nach `retry_after` Sekunden erneut senden."""
+
+    def __init__(self, retry_after: int, depth: int):
+        super().__init__(f"queue full ({depth} jobs), retry after {retry_after}s")
+        self.retry_after = retry_after
+        self.depth = depth
+
+
+class Ticket:
+    """
+    Ein eingereihter Job. `fn(gpu_id)` läuft auf einem Scheduler-Thread.
+    Mit `batch_key` kann der Job mit anderen gleichen Schlüssels gebündelt werden:
+    dann ruft der Scheduler `batch_fn(gpu_id, [payload, ...])` auf, das eine
+    Ergebnisliste in derselben Reihenfolge liefert.
+    """
+
+    def __init__(self, job_id: str, kind: str, fn: Callable[[int], Any], priority: int, seq: int,
+                 on_start=None, on_done=None, on_error=None,
+                 batch_key=None, batch_fn=None, payload=None):
+        self.job_id = job_id
+        self.kind = kind
+        self.fn = fn
+        self.batch_key = batch_key
+        self.batch_fn = batch_fn
+        self.payload = payload
+        self.priority = priority
+        self.seq = seq
+        self.on_start = on_start
+        self.on_done = on_done
+        self.on_error = on_error
+        self.gpu_id: Optional[int] = None
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self._event = threading.Event()
+
+    def sort_key(self):
+        # höhere Priorität zuerst, bei Gleichstand FIFO
+        return (-self.priority, self.seq)
+
+    def __lt__(self, other: "Ticket") -> bool:
+        return self.sort_key() < other.sort_key()
+
+    def wait(self, timeout: Optional[float] = None) -> Any:
+        """Blockiert bis der Job fertig ist (für die synchronen Endpunkte)."""
+        self._event.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class GPUScheduler:
+    def __init__(self, gpus: List[int] = None, per_gpu: int = SCHED_GPU_CONCURRENCY,
+                 depth: int = SCHED_QUEUE_DEPTH, max_batch: int = SCHED_MAX_BATCH):
+        self.gpus = list(gpus if gpus is not None else SCHED_GPUS) or [0]
+        self.per_gpu = max(1, per_gpu)
+        self.depth = depth
+        self.max_batch = max(1, max_batch)
+        self._heap: List[Ticket] = []
+        self._running: Dict[str, Ticket] = {}
+        # pro GPU die gerade laufenden Modellarten (ein Job je Art und GPU)
+        self._busy: Dict[int, set] = {g: set() for g in self.gpus}
+        self._seq = itertools.count()
+        self._cv = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        # gleitender Mittelwert der Jobdauer pro Art (für Retry-After / ETA)
+        self._avg_s: Dict[str, float] = {}
+
+    @property
+    def slots(self) -> int:
+        return len(self.gpus) * self.per_gpu
+
+    # ---- Admission ----
+    def submit(self, job_id: str, kind: str, fn: Callable[[int], Any], *, priority: int = 0,
+               on_start: Optional[Callable[[int], None]] = None,
+               on_done: Optional[Callable[[Any], None]] = None,
+               on_error: Optional[Callable[[BaseException], None]] = None,
+               batch_key=None, batch_fn: Optional[Callable[[int, List[Any]], List[Any]]] = None,
+               payload=None) -> Ticket:
+        with self._cv:
+            if len(self._heap) >= self.depth:
+                raise QueueFull(self._retry_after_locked(), self.depth)
+            t = Ticket(job_id, kind, fn, priority, next(self._seq), on_start, on_done, on_error,
+                       batch_key=batch_key, batch_fn=batch_fn, payload=payload)
+            heapq.heappush(self._heap, t)
+            self._ensure_threads_locked()
+            # nicht jeder Slot darf jeden Job nehmen (Art läuft evtl. schon auf seiner GPU)
+            self._cv.notify_all()
+        return t
+
+    def _job_s(self, kind: str) -> float:
+        return self._avg_s.get(kind, SCHED_DEFAULT_JOB_S)
+
+    def _retry_after_locked(self) -> int:
+        # grob: bis ein Queue-Platz frei wird, muss der vorderste Schwung durch die Slots
+        ahead = sum(self._job_s(t.kind) for t in self._heap[:self.slots]) or SCHED_DEFAULT_JOB_S
+        return max(1, math.ceil(ahead / self.slots))
+
+    # ---- Abfragen ----
+    def position(self, job_id: str) -> Optional[int]:
+        """1-basierte Position in der Queue, None wenn nicht (mehr) wartend."""
+        with self._cv:
+            for i, t in enumerate(sorted(self._heap)):
+                if t.job_id == job_id:
+                    return i + 1
+        return None
+
+    def estimate_wait_s(self, job_id: str) -> Optional[float]:
+        with self._cv:
+            ordered = sorted(self._heap)
+            for i, t in enumerate(ordered):
+                if t.job_id == job_id:
+                    ahead = sum(self._job_s(o.kind) for o in ordered[:i])
+                    ahead += sum(self._job_s(r.kind) for r in self._running.values())
+                    return round(ahead / self.slots, 1)
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cv:
+            return {
+                "gpus": self.gpus,
+                "per_gpu": self.per_gpu,
+                "queue_depth": self.depth,
+                "max_batch": self.max_batch,
+                "queued": len(self._heap),
+                "running": len(self._running),
+                "avg_job_s": {k: round(v, 1) for k, v in self._avg_s.items()},
+            }
+
+    # ---- Ausführung ----
+    def _ensure_threads_locked(self) -> None:
+        if self._threads:
+            return
+        for gpu in self.gpus:
+            for slot in range(self.per_gpu):
+                th = threading.Thread(target=self._loop, args=(gpu,), name=f"sched-gpu{gpu}-{slot}", daemon=True)
+                th.start()
+                self._threads.append(th)
+
+    def _next_locked(self, gpu_id: int) -> Optional[Ticket]:
+        """Vorderster Job, dessen Modellart auf `gpu_id` noch nicht läuft (sonst None)."""
+        busy = self._busy[gpu_id]
+        for t in sorted(self._heap):
+            if t.kind not in busy:
+                self._heap.remove(t)
+                heapq.heapify(self._heap)
+                return t
+        return None
+
+    def _take_batch_locked(self, first: Ticket) -> List[Ticket]:
+        """Weitere wartende Jobs mit gleichem batch_key (in Queue-Reihenfolge) mitnehmen."""
+        if first.batch_key is None or first.batch_fn is None or self.max_batch == 1:
+            return [first]
+        batch = [first]
+        for t in sorted(self._heap):
+            if len(batch) >= self.max_batch:
+                break
+            if t.batch_key == first.batch_key:
+                batch.append(t)
+        if len(batch) > 1:
+            taken = {id(t) for t in batch}
+            self._heap = [t for t in self._heap if id(t) not in taken]
+            heapq.heapify(self._heap)
+        return batch
+
+    def _loop(self, gpu_id: int) -> None:
+        while True:
+            with self._cv:
+                first = self._next_locked(gpu_id)
+                while first is None:
+                    self._cv.wait()
+                    first = self._next_locked(gpu_id)
+                batch = self._take_batch_locked(first)
+                self._busy[gpu_id].add(first.kind)
+                for t in batch:
+                    t.gpu_id = gpu_id
+                    self._running[t.job_id] = t
+            t0 = time.time()
+            results: List[Any] = []
+            error: Optional[BaseException] = None
+            try:
+                for t in batch:
+                    if t.on_start:
+                        t.on_start(gpu_id)
+                if len(batch) == 1:
+                    results = [batch[0].fn(gpu_id)]
+                else:
+                    logging.info(f"[scheduler] Batch aus {len(batch)} {batch[0].kind}-Jobs auf GPU {gpu_id}")
+                    results = batch[0].batch_fn(gpu_id, [t.payload for t in batch])
+            except BaseException as e:
+                logging.exception(f"[scheduler] Job(s) {[t.job_id for t in batch]} ({batch[0].kind}) fehlgeschlagen")
+                error = e
+            dt = time.time() - t0
+            for i, t in enumerate(batch):
+                try:
+                    if error is not None:
+                        t.error = error
+                        if t.on_error:
+                            t.on_error(error)
+                    else:
+                        t.result = results[i]
+                        if t.on_done:
+                            t.on_done(t.result)
+                except BaseException:
+                    logging.exception(f"[scheduler] Callback für {t.job_id} fehlgeschlagen")
+                finally:
+                    with self._cv:
+                        self._running.pop(t.job_id, None)
+                    t._event.set()
+            with self._cv:
+                # Laufzeit pro Job: ein Batch zählt anteilig
+                per_job = dt / len(batch)
+                prev = self._avg_s.get(batch[0].kind)
+                self._avg_s[batch[0].kind] = per_job if prev is None else 0.8 * prev + 0.2 * per_job
+                self._busy[gpu_id].discard(batch[0].kind)
+                self._cv.notify_all()
+
+
+_SCHED: Optional[GPUScheduler] = None
+_SCHED_LOCK = threading.Lock()
+
+
+def get_scheduler() -> GPUScheduler:
+    global _SCHED
+    with _SCHED_LOCK:
+        if _SCHED is None:
+            _SCHED = GPUScheduler()
+        return _SCHED
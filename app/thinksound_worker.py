@@ -0,0 +1,376 @@
+# app/thinksound_worker.py
+# Hält Feature-Extractor (MetaCLIP, Synchformer, T5) und das ThinkSound-Diffusionsmodell
+# einmal pro Pod im Speicher – statt pro Clip demo.sh → extract_latents.py → predict.py
+# zu starten. Features gehen direkt als Tensoren ins Modell (kein demo.npz mehr).
+
+from typing import Optional, Callable, Dict, Any, List, Tuple
+from datetime import datetime
+import os, sys, json, uuid, threading, logging, time, subprocess, tempfile, functools
+
+from .wan_worker import _JobLog
+
+THINK_ROOT = os.getenv("THINK_ROOT", "/workspace/ThinkSound")
+THINK_DEVICE = os.getenv("THINK_DEVICE", "cuda:0")
+THINK_MODEL_CONFIG = os.getenv(
+    "THINK_MODEL_CONFIG", os.path.join(THINK_ROOT, "ThinkSound", "configs", "model_configs", "thinksound.json"))
+THINK_CKPT = os.getenv("THINK_CKPT", os.path.join(THINK_ROOT, "ckpts", "thinksound.ckpt"))
+THINK_VAE_CKPT = os.getenv("THINK_VAE_CKPT", os.path.join(THINK_ROOT, "ckpts", "vae.ckpt"))
+THINK_SYNCH_CKPT = os.getenv("THINK_SYNCH_CKPT", os.path.join(THINK_ROOT, "ckpts", "synchformer_state_dict.pth"))
+THINK_RESULTS = os.getenv("THINK_RESULTS_DIR", "results")   # relativ zu THINK_ROOT (wie demo.sh)
+THINK_USE_HALF = os.getenv("THINK_USE_HALF", "off") == "on"
+THINK_SEED = int(os.getenv("THINK_SEED", "42"))              # wie defaults.ini
+# Flow-Sampler + Zeitplan (ThinkSound/inference/sampling.py), pro Request überschreibbar.
+# 40 Euler-Schritte linear = bisheriges Verhalten; eval_samplers.py vergleicht Alternativen.
+THINK_SAMPLER = os.getenv("THINK_SAMPLER", "euler")
+THINK_SCHEDULE = os.getenv("THINK_SCHEDULE", "linear")
+THINK_STEPS = int(os.getenv("THINK_STEPS", "40"))
+# Batching über Requests: Clips, deren Dauer in dasselbe THINK_BATCH_BUCKET_S-Raster fällt,
+# rechnet der Scheduler gemeinsam (bis SCHED_MAX_BATCH). 1 = nur gleich lange Clips, Ergebnis
+# identisch zum Einzellauf; > 1 füllt kürzere Clips auf (leere Video-Features) und schneidet danach.
+THINK_BATCH_BUCKET_S = int(os.getenv("THINK_BATCH_BUCKET_S", "1"))
+# VAE-Decode in Stücken von THINK_DECODE_CHUNK Latents (Überlappung THINK_DECODE_OVERLAP, ≥ rezeptives
+# Feld), die sofort in WAV + ffmpeg-Mux gestreamt werden; kleiner = früher Audio + flacher Speicher
+THINK_DECODE_CHUNK = int(os.getenv("THINK_DECODE_CHUNK", "128"))
+THINK_DECODE_OVERLAP = int(os.getenv("THINK_DECODE_OVERLAP", "32"))
+if not 0 <= THINK_DECODE_OVERLAP < THINK_DECODE_CHUNK:
+    raise ValueError(f"THINK_DECODE_OVERLAP muss in [0, THINK_DECODE_CHUNK) liegen, ist "
+                     f"{THINK_DECODE_OVERLAP} bei THINK_DECODE_CHUNK={THINK_DECODE_CHUNK}")
+
+# Default-Längen im Config; das Modell selbst ist dauerunabhängig
+_BUILD_DURATION = 9.0
+
+# ThinkSound ist kein installiertes Paket → Repo-Pfad importierbar machen
+if THINK_ROOT not in sys.path:
+    sys.path.insert(0, THINK_ROOT)
+
+
+def _probe_duration(video_path: str) -> int:
+    """
+    Videodauer in ganzen Sekunden (demo.sh schneidet ebenfalls ab). batch_key() fragt im
+    Submit-Handler, der Worker später noch einmal – ffprobe läuft pro Datei (Pfad + mtime +
+    Größe) nur einmal.
+    """
+    st = os.stat(video_path)
+    return _probe_duration_cached(video_path, st.st_mtime_ns, st.st_size)
+
+
+@functools.lru_cache(maxsize=256)
+def _probe_duration_cached(video_path: str, mtime_ns: int, size: int) -> int:
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+         "-of", "default=noprint_wrappers=1:nokey=1", video_path],
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+    ).stdout.strip()
+    return int(float(out))
+
+
+def _as_mp4(video_path: str, tmp_dir: str) -> str:
+    """Nicht-MP4 wie in demo.sh vorher nach MP4 konvertieren (für Decoder + Muxing)."""
+    if video_path.lower().endswith(".mp4"):
+        return video_path
+    out = os.path.join(tmp_dir, "input.mp4")
+    subprocess.run(
+        ["ffmpeg", "-y", "-i", video_path, "-c:v", "libx264", "-preset", "fast",
+         "-c:a", "aac", "-strict", "experimental", out],
+        check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    )
+    return out
+
+
+def batch_key(req) -> Optional[Tuple]:
+    """
+    Requests mit gleichem Schlüssel können gemeinsam gerechnet werden (gleicher Dauer-Bucket +
+    Sampler). None (nicht bündeln), wenn das Video nicht lesbar ist – der Einzellauf meldet dann den Fehler.
+    """
+    try:
+        duration = _probe_duration(req.video_path)
+    except (subprocess.CalledProcessError, ValueError, OSError):
+        return None
+    bucket = -(-duration // max(1, THINK_BATCH_BUCKET_S))
+    return ("thinksound", bucket, req.sampler or THINK_SAMPLER, req.schedule or THINK_SCHEDULE,
+            req.sample_steps or THINK_STEPS)
+
+
+class ThinkSoundWorker:
+    """
+    Ein Worker pro GPU. Extractor und Modell werden beim ersten Job (oder per warmup())
+    geladen und bleiben danach resident. Das MMmodule liest die Sequenzlängen aus den
+    Eingaben (RoPE-Tabellen im LRU je Länge), jede Clip-Dauer läuft auf demselben Modell.
+    """
+
+    def __init__(self, device: str = THINK_DEVICE):
+        self.device = device
+        self._extractor = None
+        self._clip_processor = None
+        self._sync_transform = None
+        self._model = None
+        self._model_config: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    # ---- Modelle ----
+    def _load(self) -> None:
+        if self._model is not None:
+            return
+
+        import torch
+        from transformers import AutoProcessor
+        from extract_latents import FeaturesUtils
+        from data_utils.v2a_utils.vggsound_224_no_audio import make_sync_transform
+        from predict import build_model
+
+        t0 = time.time()
+        logging.info(f"[ts_worker] Lade Feature-Extractor (use_half={THINK_USE_HALF})")
+        # FeaturesUtils legt alles auf 'cuda' → aktuelles Device = GPU dieses Workers
+        with torch.cuda.device(self.device):
+            self._extractor = FeaturesUtils(
+                vae_ckpt=None,
+                vae_config=None,
+                enable_conditions=True,
+                synchformer_ckpt=THINK_SYNCH_CKPT,
+                use_half=THINK_USE_HALF,
+            )
+        self._clip_processor = AutoProcessor.from_pretrained("facebook/metaclip-h14-fullcc2.5b")
+        self._sync_transform = make_sync_transform()
+
+        logging.info(f"[ts_worker] Lade ThinkSound aus {THINK_CKPT} auf {self.device}")
+        with open(THINK_MODEL_CONFIG) as f:
+            self._model_config = json.load(f)
+        model = build_model(self._model_config, _BUILD_DURATION, THINK_CKPT, THINK_VAE_CKPT)
+        self._model = model.to(self.device).eval().requires_grad_(False)
+        logging.info(f"[ts_worker] Modelle bereit nach {time.time() - t0:.1f}s")
+
+    def warmup(self) -> None:
+        with self._lock:
+            self._load()
+
+    @property
+    def ready(self) -> bool:
+        return self._model is not None
+
+    @staticmethod
+    def _sampler_settings(req) -> Tuple[str, str, int]:
+        """(sampler, schedule, steps) für `req`; vor dem Feature-Extract prüfen, nicht erst nach Sekunden im Sampler."""
+        from ThinkSound.inference.sampling import FLOW_SAMPLERS, FLOW_SCHEDULES
+
+        sampler = req.sampler or THINK_SAMPLER
+        schedule = req.schedule or THINK_SCHEDULE
+        steps = req.sample_steps or THINK_STEPS
+        if sampler not in FLOW_SAMPLERS:
+            raise ValueError(f"unbekannter sampler {sampler!r}, erlaubt: {sorted(FLOW_SAMPLERS)}")
+        if schedule not in FLOW_SCHEDULES:
+            raise ValueError(f"unbekannter schedule {schedule!r}, erlaubt: {sorted(FLOW_SCHEDULES)}")
+        if steps < 1:
+            raise ValueError(f"sample_steps muss >= 1 sein, nicht {steps}")
+        return sampler, schedule, steps
+
+    def _features(self, req, sample_id: str, tmp: str):
+        """
+        Video → MetaCLIP/Synchformer/T5-Features (früher extract_latents.py → demo.npz).
+        Gibt (src_video, duration, (reals, meta)) zurück, (reals, meta) wie predict.load().
+        """
+        import torch
+        from extract_latents import extract_features
+        from data_utils.v2a_utils.vggsound_224_no_audio import load_video_chunks
+
+        src_video = _as_mp4(req.video_path, tmp)
+        duration = _probe_duration(src_video)
+        logging.info(f"Duration is: {duration}")
+
+        # caption = Titel (= sample_id), caption_cot = Beschreibung – wie in demo.sh
+        clip_chunk, sync_chunk = load_video_chunks(
+            src_video, duration, self._clip_processor, self._sync_transform, video_id="demo")
+        caption_cot = req.text.replace('"', "'")
+        with torch.no_grad(), torch.cuda.device(self.device):
+            feats = extract_features(
+                self._extractor, clip_chunk[None], sync_chunk[None], [sample_id], [caption_cot])
+
+        latent_len = round(44100 / 64 / 32 * duration)
+        meta = {k: v[0].float().to(self.device) for k, v in feats.items()}
+        meta.update({
+            "id": "demo",
+            "caption": sample_id,
+            "caption_cot": caption_cot,
+            "video_exist": torch.tensor(True, device=self.device),
+        })
+        return src_video, duration, (torch.zeros((1, 64, latent_len), dtype=torch.float32), meta)
+
+    @staticmethod
+    def _writer(src_video: str, sample_id: str):
+        """
+        StreamingAudioWriter für WAV + gemuxtes MP4 (Pfade relativ zu THINK_ROOT wie bisher).
+        Gibt (writer, wav_path, mp4_path) zurück.
+        Der Dateiname bekommt ein zufälliges Suffix: Jobs mit gleicher sample_id (auch im
+        selben Batch) würden sich sonst gegenseitig die Dateien überschreiben.
+        """
+        from predict import StreamingAudioWriter
+
+        audio_dir = os.path.join(THINK_RESULTS, f"{datetime.now().strftime('%m%d')}_batch_size1")
+        os.makedirs(os.path.join(THINK_ROOT, audio_dir), exist_ok=True)
+        stem = f"{sample_id}_{uuid.uuid4().hex[:8]}"
+        wav_path = os.path.join(audio_dir, f"{stem}.wav")
+        mp4_path = os.path.join(audio_dir, f"{stem}_aud.mp4")
+        writer = StreamingAudioWriter(os.path.join(THINK_ROOT, wav_path), 44100,
+                                      video_path=src_video, out_mp4=os.path.join(THINK_ROOT, mp4_path))
+        return writer, wav_path, mp4_path
+
+    def generate(self, req, log_path: Optional[str] = None,
+                 progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, Any]:
+        """
+        Blockierend: erzeugt Audio für `req` (TSRequest), muxt es ins Video und speichert beides.
+        `progress(stage, step, total)` wie bei WanWorker.generate.
+        """
+        from lightning.pytorch import seed_everything
+        from predict import predict_step
+
+        sample_id = req.sample_id or uuid.uuid4().hex[:8]
+        sampler, schedule, steps = self._sampler_settings(req)
+
+        with self._lock, _JobLog(log_path), tempfile.TemporaryDirectory() as tmp:
+            self._load()
+            t0 = time.time()
+
+            if progress:
+                progress("text-encode", 0, 1)
+
+            # 1) Features
+            src_video, duration, batch = self._features(req, sample_id, tmp)
+            t_feat = time.time() - t0
+
+            # 2) Diffusion (früher predict.py); das Audio geht segmentweise in WAV + ffmpeg-Mux
+            writer, wav_path, mp4_path = self._writer(src_video, sample_id)
+            seed_everything(THINK_SEED, workers=True)
+            try:
+                predict_step(
+                    self._model,
+                    batch=[batch[0], (batch[1],)],
+                    diffusion_objective=self._model_config["model"]["diffusion"]["diffusion_objective"],
+                    device=self.device,
+                    steps=steps,
+                    sampler=sampler,
+                    schedule=schedule,
+                    callback=(lambda d: progress(d["stage"], d["i"] + 1 if d["stage"] == "denoise" else 0, d["steps"]))
+                    if progress else None,
+                    sinks=[writer.write],
+                    decode_chunk_size=THINK_DECODE_CHUNK,
+                    decode_overlap=THINK_DECODE_OVERLAP,
+                )
+                t_diff = time.time() - t0 - t_feat
+
+                # 3) Muxen abschließen (ffmpeg lief schon während des Decodes mit)
+                if progress:
+                    progress("mux", 0, 1)
+                writer.close()
+            except BaseException:
+                writer.abort()
+                raise
+            logging.info(f"Muxed video written: {mp4_path}")
+
+            return {
+                "audio_path": mp4_path,
+                "wav_path": wav_path,
+                "sample_id": sample_id,
+                "duration_sec": duration,
+                "sampler": sampler,
+                "schedule": schedule,
+                "sample_steps": steps,
+                "features_s": round(t_feat, 3),
+                "diffusion_s": round(t_diff, 3),
+                "total_s": round(time.time() - t0, 3),
+            }
+
+    def generate_batch(self, items: List[Tuple[Any, Optional[str], Optional[Callable]]]) -> List[Dict[str, Any]]:
+        """
+        Blockierend: mehrere Requests mit gleichem batch_key() in einem gemeinsamen
+        Denoising-Lauf (predict.predict_batch). Kürzere Clips werden auf den längsten
+        aufgefüllt und danach wieder auf ihre Länge geschnitten.
+        `items` = [(req, log_path, progress), ...] wie bei WanWorker.generate_batch.
+        """
+        if len(items) == 1:
+            req, log_path, progress = items[0]
+            return [self.generate(req, log_path=log_path, progress=progress)]
+
+        from predict import predict_batch
+
+        reqs = [it[0] for it in items]
+        progresses = [it[2] for it in items if it[2]]
+        sample_ids = [r.sample_id or uuid.uuid4().hex[:8] for r in reqs]
+        # batch_key() garantiert gleiche Sampler-Einstellungen
+        sampler, schedule, steps = self._sampler_settings(reqs[0])
+
+        def _progress(stage, step, total):
+            for p in progresses:
+                p(stage, step, total)
+
+        with self._lock, _JobLog([it[1] for it in items]), tempfile.TemporaryDirectory() as tmp:
+            self._load()
+            t0 = time.time()
+            _progress("text-encode", 0, 1)
+
+            # 1) Features pro Request (eigenes Temp-Verzeichnis für die MP4-Konvertierung)
+            feats = []
+            for i, (req, sample_id) in enumerate(zip(reqs, sample_ids)):
+                os.makedirs(os.path.join(tmp, str(i)))
+                feats.append(self._features(req, sample_id, os.path.join(tmp, str(i))))
+            t_feat = time.time() - t0
+
+            # 2) Diffusion gemeinsam; jeder Clip startet vom selben Noise wie allein (THINK_SEED)
+            # und streamt beim Decode in seinen eigenen Writer
+            writers = [self._writer(src_video, sample_id) for (src_video, _, _), sample_id in zip(feats, sample_ids)]
+            try:
+                predict_batch(
+                    self._model,
+                    [batch for _, _, batch in feats],
+                    diffusion_objective=self._model_config["model"]["diffusion"]["diffusion_objective"],
+                    device=self.device,
+                    seeds=[THINK_SEED] * len(reqs),
+                    steps=steps,
+                    sampler=sampler,
+                    schedule=schedule,
+                    callback=lambda d: _progress(d["stage"], d["i"] + 1 if d["stage"] == "denoise" else 0, d["steps"]),
+                    sinks=[w.write for w, _, _ in writers],
+                    decode_chunk_size=THINK_DECODE_CHUNK,
+                    decode_overlap=THINK_DECODE_OVERLAP,
+                )
+                t_diff = time.time() - t0 - t_feat
+
+                # 3) Muxen abschließen
+                _progress("mux", 0, 1)
+                for w, _, _ in writers:
+                    w.close()
+            except BaseException:
+                for w, _, _ in writers:
+                    w.abort()
+                raise
+
+            results = []
+            for (_, duration, _), sample_id, (_, wav_path, mp4_path) in zip(feats, sample_ids, writers):
+                logging.info(f"Muxed video written: {mp4_path}")
+                results.append({
+                    "audio_path": mp4_path,
+                    "wav_path": wav_path,
+                    "sample_id": sample_id,
+                    "duration_sec": duration,
+                    "sampler": sampler,
+                    "schedule": schedule,
+                    "sample_steps": steps,
+                    "batch_size": len(reqs),
+                    "features_s": round(t_feat, 3),
+                    "diffusion_s": round(t_diff, 3),
+                })
+            total_s = round(time.time() - t0, 3)
+            for res in results:
+                res["total_s"] = total_s
+            return results
+
+
+# ein residenter Worker pro GPU (Zuteilung macht app/scheduler.py)
+_WORKERS: Dict[str, ThinkSoundWorker] = {}
+_WORKER_LOCK = threading.Lock()
+
+
+def get_ts_worker(gpu_id: Optional[int] = None) -> ThinkSoundWorker:
+    device = THINK_DEVICE if gpu_id is None else f"cuda:{gpu_id}"
+    with _WORKER_LOCK:
+        if device not in _WORKERS:
+            _WORKERS[device] = ThinkSoundWorker(device)
+        return _WORKERS[device]
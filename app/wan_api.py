@@ -1,14 +1,16 @@
 # app/wan_api.py
 from pydantic import BaseModel
 from typing import Optional, Literal, Dict, Any
-from datetime import datetime
-import os, uuid, subprocess, threading, json, re
+import os, uuid
+
+from .wan_worker import get_wan_worker, batch_key, wait_encoded, on_encoded
+from .scheduler import get_scheduler
+from .job_store import get_job_store
+from .progress import start_tracker, get_tracker, finish_tracker, progress_fields
 
 # ====== Pfade / Defaults ======
 WAN_ROOT = os.getenv("WAN_ROOT", "/workspace/Wan2.2")
 WAN_CKPT = os.getenv("WAN_CKPT_DIR", "/workspace/Wan2.2/Wan2.2-TI2V-5B")
-JOBS_DIR = os.getenv("JOBS_DIR", "/workspace/jobs")
-os.makedirs(JOBS_DIR, exist_ok=True)
 
 ALLOWED_SIZES = {
     "720*1280","1280*720","480*832","832*480","704*1280","1280*704","1024*704","704*1024"
@@ -26,149 +28,126 @@ class TI2VRequest(BaseModel):
     offload_model: bool = True
     convert_model_dtype: bool = True
     ckpt_dir: Optional[str] = None
-    infer_frames: int = 10 
+    # kein infer_frames mehr: wirkte nur bei s2v, die Länge bestimmt frame_num
     task: Literal["ti2v-5B"] = "ti2v-5B"
+    priority: int = 0            # höher = früher dran (Scheduler)
 
-# ====== Hilfsfunktionen ======
-def _job_paths(job_id: str) -> Dict[str, str]:
-    jdir = os.path.join(JOBS_DIR, job_id)
-    return {
-        "dir": jdir,
-        "meta": os.path.join(jdir, "job.json"),
-        "log": os.path.join(jdir, "out.log"),
-        "result": os.path.join(jdir, "result.json"),
-    }
-
-def _write_json(path: str, data: Dict[str, Any]) -> None:
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
-def _read_json(path: str) -> Optional[Dict[str, Any]]:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return None
-
-def _parse_saved_video(stdout: str) -> Optional[str]:
-    # sucht nach Zeile: "Saving generated video to <path>.mp4"
-    m = re.search(r"Saving generated video to\s+(.+?\.mp4)", stdout)
-    return m.group(1).strip() if m else None
-
-def _build_cmd(req: TI2VRequest) -> list:
-    ckpt_dir = req.ckpt_dir or WAN_CKPT
-    return [
-        "python", os.path.join(WAN_ROOT, "generate.py"),
-        "--task", req.task,
-        "--ckpt_dir", ckpt_dir,
-        "--prompt", req.prompt,
-        "--size", req.size,
-        "--frame_num", str(req.frame_num),
-        "--sample_steps", str(req.sample_steps),
-        "--sample_guide_scale", str(req.sample_guide_scale),
-        "--offload_model", str(req.offload_model),
-        "--convert_model_dtype",
-        "--infer_frames", str(req.infer_frames),
-    ]
+# Gleichartige Jobs (gleiche Größe/Frames/Steps) rechnet der Scheduler gemeinsam
+def _run_batch(gpu: int, items: list) -> list:
+    return get_wan_worker(gpu).generate_batch(items)
 
 # ====== Synchron (bestehend) ======
+# Läuft jetzt im warmen Worker statt über `python generate.py`.
+# Geht ebenfalls durch den Scheduler (QueueFull → 429 in main.py).
 def run_wan_ti2v(req: TI2VRequest) -> dict:
-    env = os.environ.copy()
-    env.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:64")
-
-    p = subprocess.run(
-        _build_cmd(req), cwd=WAN_ROOT, env=env,
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
-    )
+    job_id = "sync-"+uuid.uuid4().hex[:8]
+    ticket = get_scheduler().submit(
+        job_id, "wan", lambda gpu: get_wan_worker(gpu).generate(req), priority=req.priority,
+        batch_key=batch_key(req), batch_fn=_run_batch, payload=(req, None, None))
+    try:
+        res = wait_encoded(ticket.wait())
+    except Exception as e:
+        return {
+            "ok": False,
+            "returncode": 1,
+            "error": f"{type(e).__name__}: {e}",
+            "job_id": job_id,
+            "wan_root": WAN_ROOT,
+        }
     return {
-        "ok": p.returncode == 0,
-        "returncode": p.returncode,
-        "stdout": p.stdout,
-        "job_id": "sync-"+uuid.uuid4().hex[:8],
+        "ok": True,
+        "returncode": 0,
+        "video_path": res["video_path"],
+        "timings": {k: v for k, v in res.items() if k.endswith("_s")},
+        "encode": res.get("encode"),
+        "step_cache": res.get("step_cache"),
+        "job_id": job_id,
         "wan_root": WAN_ROOT,
     }
 
 # ====== Asynchron (Submit → Status → Result) ======
+# Job-Zustand liegt im JobStore (SQLite), nicht mehr in JOBS_DIR/<job_id>/*.json
+def _enqueue(job: Dict[str, Any], req: TI2VRequest) -> None:
+    store = get_job_store()
+    job_id = job["job_id"]
+
+    # Job in die GPU-Queue; ein Scheduler-Thread ruft den residenten Worker der GPU auf
+    def _on_start(gpu_id: int):
+        start_tracker(job_id, "wan")
+        store.mark_running(job_id, gpu_id)
+
+    def _mark_done(res: Dict[str, Any]):
+        store.mark_done(job_id, {
+            "video_path": res.get("video_path"),
+            "timings": {k: v for k, v in res.items() if k.endswith("_s")},
+            "encode": res.get("encode"),
+            "step_cache": res.get("step_cache"),
+            "artifacts": [res.get("video_path")],
+        })
+        finish_tracker(job_id, "done")
+
+    def _on_error(e: BaseException):
+        store.mark_error(job_id, f"{type(e).__name__}: {e}")
+        finish_tracker(job_id, "error")
+
+    # fertig erst, wenn ffmpeg das mp4 abgeschlossen hat – der GPU-Slot ist da schon frei
+    def _on_done(res: Dict[str, Any]):
+        on_encoded(res, _mark_done, _on_error)
+
+    get_scheduler().submit(
+        job_id, "wan",
+        lambda gpu: get_wan_worker(gpu).generate(
+            req, log_path=job["log_path"], progress=get_tracker(job_id).update),
+        priority=req.priority,
+        on_start=_on_start, on_done=_on_done, on_error=_on_error,
+        batch_key=batch_key(req), batch_fn=_run_batch,
+        payload=(req, job["log_path"], lambda *a: get_tracker(job_id).update(*a)),
+    )
+
 def submit_job(req: TI2VRequest) -> str:
     job_id = uuid.uuid4().hex
-    paths = _job_paths(job_id)
-    meta = {
-        "job_id": job_id,
-        "created_at": datetime.utcnow().isoformat()+"Z",
-        "status": "queued",
-        "params": req.model_dump(),
-        "wan_root": WAN_ROOT,
-        "wan_ckpt": req.ckpt_dir or WAN_CKPT,
-        "stdout_len": 0,
-    }
-    _write_json(paths["meta"], meta)
-
-    # Background-Thread startet Subprozess
-    def _runner():
-        env = os.environ.copy()
-        env.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:64")
-        # status: running
-        meta = _read_json(paths["meta"]) or {}
-        meta["status"] = "running"
-        meta["started_at"] = datetime.utcnow().isoformat()+"Z"
-        _write_json(paths["meta"], meta)
-
-        with open(paths["log"], "w", encoding="utf-8") as logf:
-            p = subprocess.Popen(
-                _build_cmd(req), cwd=WAN_ROOT, env=env,
-                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1
-            )
-            stdout_accum = []
-            for line in p.stdout:
-                logf.write(line)
-                stdout_accum.append(line)
-            p.wait()
-            full_out = "".join(stdout_accum)
-            result_path = _parse_saved_video(full_out)
-
-        # status: done/error
-        meta = _read_json(paths["meta"]) or {}
-        meta["finished_at"] = datetime.utcnow().isoformat()+"Z"
-        meta["returncode"] = p.returncode
-        if p.returncode == 0:
-            meta["status"] = "done"
-            _write_json(paths["result"], {
-                "job_id": job_id,
-                "video_path": result_path,
-            })
-        else:
-            meta["status"] = "error"
-        _write_json(paths["meta"], meta)
-
-    threading.Thread(target=_runner, daemon=True).start()
+    store = get_job_store()
+    params = req.model_dump()
+    params["ckpt_dir"] = req.ckpt_dir or WAN_CKPT
+    job = store.create(job_id, "wan", params)
+    try:
+        _enqueue(job, req)
+    except Exception:
+        # abgelehnt (QueueFull) → keine Job-Leiche liegen lassen
+        store.delete(job_id)
+        raise
     return job_id
 
+def requeue_job(job: Dict[str, Any]) -> None:
+    """Crash-Recovery (main.py beim Start): Job mit gespeicherten Parametern neu einreihen."""
+    _enqueue(job, TI2VRequest(**job["params"]))
+
 def get_status(job_id: str) -> Dict[str, Any]:
-    paths = _job_paths(job_id)
-    meta = _read_json(paths["meta"])
-    if not meta:
+    job = get_job_store().get(job_id)
+    if not job:
         return {"error":"job_not_found", "job_id": job_id}
-    # Fortschritt (nur simpel): running = 0/1, done = 1
-    prog = 1.0 if meta.get("status") == "done" else (0.0 if meta.get("status")=="queued" else 0.5)
+    sched = get_scheduler()
     return {
         "job_id": job_id,
-        "status": meta.get("status"),
-        "progress": prog,
-        "created_at": meta.get("created_at"),
-        "started_at": meta.get("started_at"),
-        "finished_at": meta.get("finished_at"),
-        "returncode": meta.get("returncode"),
+        "status": job["status"],
+        # Stage, Schritt i/N, elapsed, ETA aus den Sampling-Callbacks
+        **progress_fields(job_id, job["status"]),
+        "queue_position": sched.position(job_id),
+        "est_wait_s": sched.estimate_wait_s(job_id),
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "returncode": job["returncode"],
+        "error": job["error"],
     }
 
 def get_result(job_id: str) -> Dict[str, Any]:
-    paths = _job_paths(job_id)
-    meta = _read_json(paths["meta"])
-    if not meta:
+    job = get_job_store().get(job_id)
+    if not job:
         return {"error":"job_not_found", "job_id": job_id}
-    if meta.get("status") != "done":
-        return {"error":"not_ready", "job_id": job_id, "status": meta.get("status")}
-    res = _read_json(paths["result"]) or {}
+    if job["status"] != "done":
+        return {"error":"not_ready", "job_id": job_id, "status": job["status"]}
+    res = job["result"] or {}
     # Für RunPod-Proxy: absoluter Pfad → direkte Datei-URL anbieten ist Sache deiner App.
     return {
         "job_id": job_id,
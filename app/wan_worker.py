@@ -0,0 +1,383 @@
+# app/wan_worker.py
+# Hält die WanTI2V-Pipeline (T5, VAE, DiT) einmal pro Pod im Speicher
+# und arbeitet Jobs aus einer Queue ab – statt pro Clip generate.py zu starten.
+
+from typing import Optional, Callable, Dict, Any, List, Tuple
+import os, sys, uuid, threading, logging, time, gc
+
+WAN_ROOT = os.getenv("WAN_ROOT", "/workspace/Wan2.2")
+WAN_CKPT = os.getenv("WAN_CKPT_DIR", "/workspace/Wan2.2/Wan2.2-TI2V-5B")
+WAN_DEVICE = int(os.getenv("WAN_DEVICE", "0"))
+# Gleicher Zielordner wie bisher in generate.py (ThinkSound liest dort)
+WAN_OUT_DIR = os.getenv("WAN_OUT_DIR", "/workspace/ThinkSound/Videos")
+# cond + uncond in einem DiT-Forward (fällt bei OOM automatisch auf zwei Forwards zurück)
+WAN_BATCH_CFG = os.getenv("WAN_BATCH_CFG", "on") == "on"
+# T5-Embeddings der Prompts zusätzlich auf Platte cachen (leer = nur im Speicher)
+WAN_T5_CACHE_DIR = os.getenv("WAN_T5_CACHE_DIR", "/workspace/cache/wan_t5") or None
+# VAE in überlappenden Kacheln rechnen, z.B. "256x256:64" (HxW:Overlap in Pixeln), leer = aus.
+# Spart bei großen Auflösungen VRAM, damit der DiT nicht ausgelagert werden muss.
+WAN_VAE_TILING = os.getenv("WAN_VAE_TILING", "")
+# x264-Preset des Video-Writers (z.B. "veryfast"/"ultrafast": schneller, größere Dateien)
+WAN_X264_PRESET = os.getenv("WAN_X264_PRESET", "medium")
+# Bei offload_model: so viele DiT-Blöcke werden vorab aus dem Pinned-RAM auf die GPU kopiert
+# (0 = ganzer DiT auf einmal)
+WAN_BLOCK_OFFLOAD = int(os.getenv("WAN_BLOCK_OFFLOAD", "2"))
+# Step-Cache des DiT: Schwelle für die Wiederverwendung des Block-Residuals (z.B. "0.05"),
+# leer = aus. Höher = schneller, aber ungenauer.
+WAN_STEP_CACHE = os.getenv("WAN_STEP_CACHE", "")
+# torch.compile für den DiT: "off" oder ein Compile-Modus ("default", "max-autotune-no-cudagraphs",
+# "reduce-overhead" = mit CUDA-Graphs). Kompiliert wird beim Laden der Pipeline für alle Buckets
+# "Größe:Frames"; andere Formen laufen eager. Die Kernels landen im Cache-Ordner (überlebt Pod-Neustarts).
+WAN_COMPILE = os.getenv("WAN_COMPILE", "off")
+WAN_COMPILE_CACHE = os.getenv("WAN_COMPILE_CACHE", "/workspace/cache/wan_compile")
+WAN_COMPILE_BUCKETS = os.getenv(
+    "WAN_COMPILE_BUCKETS",
+    ",".join(f"{s}:8" for s in ("720*1280", "1280*720", "480*832", "832*480",
+                               "704*1280", "1280*704", "1024*704", "704*1024")))
+
+# Muss vor der ersten CUDA-Initialisierung gesetzt sein (früher pro Subprozess)
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:64")
+
+# Wan2.2 ist kein installiertes Paket → Repo-Pfad importierbar machen
+if WAN_ROOT not in sys.path:
+    sys.path.insert(0, WAN_ROOT)
+
+
+def _remove_partial(paths: List[str]) -> None:
+    """Halb geschriebene Videos eines fehlgeschlagenen Jobs entfernen."""
+    for p in paths:
+        try:
+            os.remove(p)
+        except OSError:
+            pass
+
+
+class _ThreadFilter(logging.Filter):
+    """Lässt nur Records des Threads durch, der den Job rechnet."""
+
+    def __init__(self, thread_id: int):
+        super().__init__()
+        self.thread_id = thread_id
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.thread == self.thread_id
+
+
+class _JobLog:
+    """Hängt für die Dauer eines Jobs einen FileHandler an den Root-Logger
+    (ersetzt das frühere stdout-Mitschreiben nach out.log). Bei Batches
+    bekommt jedes Job-Log denselben Mitschnitt. Der Scheduler rechnet pro GPU
+    in einem eigenen Thread – jedes Job-Log nimmt nur Records seines Threads."""
+
+    # Root-Level auf INFO, solange irgendein Job-Log offen ist; der letzte stellt es zurück
+    _active = 0
+    _saved_level = None
+    _level_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.paths = [p for p in (path if isinstance(path, (list, tuple)) else [path]) if p]
+        self.handlers = []
+
+    def __enter__(self):
+        root = logging.getLogger()
+        thread_filter = _ThreadFilter(threading.get_ident())
+        for path in self.paths:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            handler = logging.FileHandler(path, encoding="utf-8")
+            handler.setFormatter(
+                logging.Formatter("[%(asctime)s] %(levelname)s: %(message)s"))
+            handler.addFilter(thread_filter)
+            root.addHandler(handler)
+            self.handlers.append(handler)
+        if self.handlers:
+            with _JobLog._level_lock:
+                if _JobLog._active == 0:
+                    _JobLog._saved_level = root.level
+                    if root.level > logging.INFO:
+                        root.setLevel(logging.INFO)
+                _JobLog._active += 1
+        return self
+
+    def __exit__(self, *exc):
+        root = logging.getLogger()
+        for handler in self.handlers:
+            root.removeHandler(handler)
+            handler.close()
+        if self.handlers:
+            with _JobLog._level_lock:
+                _JobLog._active -= 1
+                if _JobLog._active == 0:
+                    root.setLevel(_JobLog._saved_level)
+        return False
+
+
+def _offload(req) -> bool:
+    # CUDA-Graphs ("reduce-overhead") spielen die Gewichts-Adressen vom Capture ab,
+    # der DiT muss dann resident bleiben
+    return req.offload_model and WAN_COMPILE != "reduce-overhead"
+
+
+def batch_key(req) -> Tuple:
+    """Requests mit gleichem Schlüssel können gemeinsam gerechnet werden (gleiche Latent-Form + Schedule)."""
+    return ("wan", req.task, req.ckpt_dir or WAN_CKPT, req.convert_model_dtype, req.size,
+            req.frame_num, req.sample_steps, req.sample_guide_scale, _offload(req))
+
+
+class WanWorker:
+    """
+    Ein Worker pro GPU. Die Pipeline wird beim ersten Job (oder per warmup())
+    gebaut und bleibt danach resident. Ändert sich ckpt_dir / convert_model_dtype,
+    wird sie einmal neu aufgebaut.
+    """
+
+    def __init__(self, device_id: int = WAN_DEVICE):
+        self.device_id = device_id
+        self._pipe = None
+        self._pipe_key: Optional[Tuple[str, str, bool]] = None
+        self._lock = threading.Lock()
+
+    # ---- Pipeline ----
+    def _load(self, task: str, ckpt_dir: str, convert_model_dtype: bool):
+        key = (task, ckpt_dir, convert_model_dtype)
+        if self._pipe is not None and self._pipe_key == key:
+            return self._pipe
+
+        import torch
+        import wan
+        from wan.configs import WAN_CONFIGS
+
+        if self._pipe is not None:
+            # alte Pipeline freigeben, bevor die neue Speicher braucht
+            self._pipe = None
+            self._pipe_key = None
+            gc.collect()
+            torch.cuda.empty_cache()
+
+        t0 = time.time()
+        logging.info(f"[wan_worker] Lade WanTI2V ({task}) aus {ckpt_dir} auf cuda:{self.device_id}")
+        self._pipe = wan.WanTI2V(
+            config=WAN_CONFIGS[task],
+            checkpoint_dir=ckpt_dir,
+            device_id=self.device_id,
+            rank=0,
+            convert_model_dtype=convert_model_dtype,
+            t5_cache_dir=WAN_T5_CACHE_DIR,
+            block_offload=WAN_BLOCK_OFFLOAD,
+        )
+        if WAN_VAE_TILING:
+            size, _, overlap = WAN_VAE_TILING.partition(":")
+            tile_h, tile_w = (int(u) for u in size.split("x"))
+            self._pipe.vae.enable_tiling((tile_h, tile_w), int(overlap or 64))
+        if WAN_STEP_CACHE:
+            self._pipe.model.enable_step_cache(float(WAN_STEP_CACHE))
+        if WAN_COMPILE != "off":
+            from wan.configs import SIZE_CONFIGS
+            buckets = [(SIZE_CONFIGS[size], int(frames)) for size, _, frames in
+                       (u.strip().partition(":") for u in WAN_COMPILE_BUCKETS.split(",") if u.strip())]
+            if WAN_COMPILE == "reduce-overhead":
+                logging.warning("[wan_worker] WAN_COMPILE=reduce-overhead: DiT bleibt resident, "
+                                "offload_model der Requests wird ignoriert")
+            self._pipe.precompile(buckets, mode=WAN_COMPILE, cache_dir=WAN_COMPILE_CACHE,
+                                  batch_cfg=WAN_BATCH_CFG,
+                                  offload_model=WAN_COMPILE != "reduce-overhead")
+        self._pipe_key = key
+        logging.info(f"[wan_worker] Pipeline bereit nach {time.time() - t0:.1f}s")
+        return self._pipe
+
+    @staticmethod
+    def _step_cache_stats(pipe) -> Optional[Dict[str, Any]]:
+        # Trefferquote des letzten Jobs, Zähler danach zurücksetzen
+        cache = pipe.model.step_cache
+        if cache is None:
+            return None
+        stats = cache.stats()
+        cache.reset()
+        return stats
+
+    def warmup(self, ckpt_dir: Optional[str] = None) -> None:
+        with self._lock:
+            self._load("ti2v-5B", ckpt_dir or WAN_CKPT, True)
+
+    @property
+    def ready(self) -> bool:
+        return self._pipe is not None
+
+    def generate(self, req, log_path: Optional[str] = None,
+                 progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, Any]:
+        """
+        Blockierend: erzeugt ein Video für `req` (TI2VRequest) und speichert es.
+        `progress(stage, step, total)` bekommt die Events aus WanTI2V (siehe app/progress.py).
+        """
+        from wan.configs import MAX_AREA_CONFIGS, SIZE_CONFIGS, WAN_CONFIGS
+        from wan.utils.utils import StreamingVideoWriter
+
+        with self._lock, _JobLog(log_path):
+            cfg = WAN_CONFIGS[req.task]
+            pipe = self._load(req.task, req.ckpt_dir or WAN_CKPT, req.convert_model_dtype)
+
+            t0 = time.time()
+            logging.info(f"Input prompt: {req.prompt}")
+            os.makedirs(WAN_OUT_DIR, exist_ok=True)
+            save_file = os.path.join(WAN_OUT_DIR, f"{uuid.uuid4().hex[:8]}.mp4")
+            logging.info(f"Streaming generated video to {save_file}")
+            # der VAE-Decode schiebt jeden Frame-Chunk direkt in ffmpeg (Hintergrund-Thread),
+            # das komplette Video liegt nie am Stück im Speicher
+            writer = StreamingVideoWriter(save_file, fps=cfg.sample_fps, nrow=1, preset=WAN_X264_PRESET)
+            try:
+                pipe.generate(
+                    req.prompt,
+                    size=SIZE_CONFIGS[req.size],
+                    max_area=MAX_AREA_CONFIGS[req.size],
+                    frame_num=req.frame_num,
+                    shift=cfg.sample_shift,
+                    sample_solver="unipc",
+                    sampling_steps=req.sample_steps,
+                    guide_scale=req.sample_guide_scale,
+                    seed=-1,
+                    offload_model=_offload(req),
+                    batch_cfg=WAN_BATCH_CFG,
+                    callback=progress,
+                    sink=writer.write,
+                )
+            except BaseException:
+                writer.abort()
+                _remove_partial([save_file])
+                raise
+            t_gen = time.time() - t0
+            if progress:
+                progress("mux", 0, 1)
+
+            return {
+                "video_path": save_file,
+                "generate_s": round(t_gen, 3),
+                "total_s": round(time.time() - t0, 3),
+                "step_cache": self._step_cache_stats(pipe),
+                # ffmpeg-Nachlauf läuft weiter, während die GPU schon den nächsten Job rechnet
+                "encode_future": writer.close(wait=False),
+            }
+
+    def generate_batch(self, items: List[Tuple[Any, Optional[str], Optional[Callable]]]) -> List[Dict[str, Any]]:
+        """
+        Blockierend: mehrere Requests mit gleichem batch_key() in einem gemeinsamen
+        Denoising-Lauf (WanTI2V.t2v_batch). `items` = [(req, log_path, progress), ...].
+        Läuft der Batch auch ohne Batched-CFG aus dem Speicher, wird er halbiert und
+        jede Hälfte für sich gerechnet (bis hinunter zu Einzeljobs).
+        """
+        if len(items) == 1:
+            req, log_path, progress = items[0]
+            return [self.generate(req, log_path=log_path, progress=progress)]
+
+        import torch
+        from wan.configs import SIZE_CONFIGS, WAN_CONFIGS
+        from wan.utils.utils import StreamingVideoWriter
+
+        reqs = [it[0] for it in items]
+        progresses = [it[2] for it in items if it[2]]
+        req = reqs[0]
+
+        def _progress(stage, step, total):
+            for p in progresses:
+                p(stage, step, total)
+
+        oom = False
+        with self._lock, _JobLog([it[1] for it in items]):
+            cfg = WAN_CONFIGS[req.task]
+            pipe = self._load(req.task, req.ckpt_dir or WAN_CKPT, req.convert_model_dtype)
+
+            t0 = time.time()
+            for r in reqs:
+                logging.info(f"Input prompt: {r.prompt}")
+            os.makedirs(WAN_OUT_DIR, exist_ok=True)
+            save_files = [os.path.join(WAN_OUT_DIR, f"{uuid.uuid4().hex[:8]}.mp4") for _ in reqs]
+            for f in save_files:
+                logging.info(f"Streaming generated video to {f}")
+            writers = [StreamingVideoWriter(f, fps=cfg.sample_fps, nrow=1, preset=WAN_X264_PRESET)
+                       for f in save_files]
+            try:
+                pipe.t2v_batch(
+                    [r.prompt for r in reqs],
+                    size=SIZE_CONFIGS[req.size],
+                    frame_num=req.frame_num,
+                    shift=cfg.sample_shift,
+                    sample_solver="unipc",
+                    sampling_steps=req.sample_steps,
+                    guide_scale=req.sample_guide_scale,
+                    seeds=[-1] * len(reqs),
+                    offload_model=_offload(req),
+                    batch_cfg=WAN_BATCH_CFG,
+                    callback=_progress,
+                    sinks=[w.write for w in writers],
+                )
+            except BaseException as e:
+                for w in writers:
+                    w.abort()
+                _remove_partial(save_files)
+                if not isinstance(e, torch.cuda.OutOfMemoryError):
+                    raise
+                logging.warning(f"[wan_worker] Batch mit {len(reqs)} Jobs passt nicht in den "
+                                f"GPU-Speicher, teile ihn auf")
+                oom = True
+            if not oom:
+                t_gen = time.time() - t0
+                _progress("mux", 0, 1)
+
+                total_s = round(time.time() - t0, 3)
+                step_cache = self._step_cache_stats(pipe)
+                return [{
+                    "video_path": f,
+                    "generate_s": round(t_gen, 3),
+                    "batch_size": len(reqs),
+                    "total_s": total_s,
+                    "step_cache": step_cache,
+                    "encode_future": w.close(wait=False),
+                } for f, w in zip(save_files, writers)]
+
+        # außerhalb von Lock und Job-Log, die Hälften öffnen beides neu
+        gc.collect()
+        torch.cuda.empty_cache()
+        half = len(items) // 2
+        return self.generate_batch(items[:half]) + self.generate_batch(items[half:])
+
+
+def wait_encoded(res: Dict[str, Any]) -> Dict[str, Any]:
+    """Blockierend: wartet auf den ffmpeg-Nachlauf und legt die Encoder-Stats unter res["encode"] ab."""
+    fut = res.pop("encode_future", None)
+    if fut is not None:
+        res["encode"] = fut.result()
+        res["encode_s"] = res["encode"]["wall_s"]
+    return res
+
+
+def on_encoded(res: Dict[str, Any], on_done: Callable[[Dict[str, Any]], None],
+               on_error: Callable[[BaseException], None]) -> None:
+    """
+    Nicht blockierend: ruft on_done(res) bzw. on_error(e), sobald das Video fertig
+    geschrieben ist. So gibt der Scheduler den GPU-Slot schon vor dem Encoder-Ende frei.
+    """
+    fut = res.get("encode_future")
+    if fut is None:
+        on_done(res)
+        return
+
+    def _cb(_):
+        try:
+            wait_encoded(res)
+        except BaseException as e:
+            on_error(e)
+            return
+        on_done(res)
+
+    fut.add_done_callback(_cb)
+
+
+# ein residenter Worker pro GPU (Zuteilung macht app/scheduler.py)
+_WORKERS: Dict[int, WanWorker] = {}
+_WORKER_LOCK = threading.Lock()
+
+
+def get_wan_worker(device_id: Optional[int] = None) -> WanWorker:
+    device_id = WAN_DEVICE if device_id is None else device_id
+    with _WORKER_LOCK:
+        if device_id not in _WORKERS:
+            _WORKERS[device_id] = WanWorker(device_id)
+        return _WORKERS[device_id]
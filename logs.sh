@@ -2,21 +2,28 @@
 # logs.sh – Live Log für einen Job
 # Usage: bash logs.sh [job_id]  (ohne = neuster Job)
 
-JOB_ID=${1:-$(ls -t /workspace/jobs 2>/dev/null | head -1)}
+JOBS_DIR=${JOBS_DIR:-/workspace/jobs}
+DB_FILE=${JOBS_DB:-$JOBS_DIR/jobs.sqlite3}
+
+# Job-Status liegt in der SQLite-DB (app/job_store.py)
+db_query() {
+  python3 -c "import sqlite3,sys; r=sqlite3.connect(sys.argv[1]).execute(sys.argv[2], sys.argv[3:]).fetchone(); print(r[0] if r else '')" "$DB_FILE" "$@" 2>/dev/null
+}
+
+JOB_ID=${1:-$(db_query "SELECT job_id FROM jobs ORDER BY created_at DESC LIMIT 1")}
 if [ -z "$JOB_ID" ]; then echo "❌ Keine Jobs gefunden"; exit 1; fi
 
-LOG_FILE="/workspace/jobs/$JOB_ID/out.log"
-META_FILE="/workspace/jobs/$JOB_ID/job.json"
+LOG_FILE="$JOBS_DIR/logs/$JOB_ID.log"
 
 echo "=== 📡 Live Log für Job: $JOB_ID ==="
 echo "Log: $LOG_FILE"
 echo "Drücke Strg+C zum Stoppen"
 echo
 
-# Funktion: Status & Fortschritt aus JSON holen
+# Funktion: Status & Fortschritt aus der Job-DB holen
 show_header() {
-  if [ -f "$META_FILE" ]; then
-    STATUS=$(python3 -c "import json; print(json.load(open('$META_FILE')).get('status','unknown'))")
+  STATUS=$(db_query "SELECT status FROM jobs WHERE job_id = ?" "$JOB_ID")
+  if [ -n "$STATUS" ]; then
     echo "Status: $STATUS"
     
     # Fortschritt aus Log parsen (z.B. "Processing frame 42/80")